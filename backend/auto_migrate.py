@@ -1,9 +1,17 @@
 import logging
-from sqlalchemy import text, inspect
+from datetime import datetime
+from sqlalchemy import text, inspect, update, bindparam, String
 from sqlalchemy.exc import OperationalError
 
+import models
+
 logger = logging.getLogger(__name__)
 
+# Columns moved from ISO text to native timestamps (models.IsoDateTime)
+TIMESTAMP_COLUMNS = [(models.Appointment, "start_time"), (models.Notification, "created_at")]
+CONVERT_BATCH_SIZE = 1000
+SQLITE_DATETIME_LENGTH = 26 # 'YYYY-MM-DD HH:MM:SS.ffffff', how SQLAlchemy stores DateTime in SQLite
+
 def run_auto_migrations(engine):
     """
     Checks for missing columns and adds them (simple migration system).
@@ -29,6 +37,79 @@ def run_auto_migrations(engine):
             logger.info("Migration successful: Added 'workout_credits'.")
         else:
             logger.info("Schema up to date: 'workout_credits' exists.")
+
+        migrate_timestamps(engine)
             
     except Exception as e:
         logger.error(f"Migration failed: {e}")
+
+
+def migrate_timestamps(engine):
+    """
+    Converts ISO text in TIMESTAMP_COLUMNS to native timestamps and creates
+    the tables' composite indexes (create_all only adds indexes to new tables).
+    Postgres changes the column type in place; SQLite keeps its declared
+    type (SQLite has no ALTER COLUMN) and gets its values rewritten in
+    SQLAlchemy's DateTime storage format, so they compare and sort as
+    timestamps. Safe to re-run: converted rows are skipped.
+    """
+    inspector = inspect(engine)
+    for model, column in TIMESTAMP_COLUMNS:
+        table = model.__tablename__
+        if not inspector.has_table(table):
+            continue
+
+        if engine.dialect.name == "postgresql":
+            column_type = {c["name"]: c["type"] for c in inspector.get_columns(table)}[column]
+            if isinstance(column_type, String):
+                logger.info(f"Migrating: '{table}.{column}' from text to TIMESTAMP.")
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column} TYPE TIMESTAMP WITHOUT TIME ZONE "
+                        f"USING NULLIF({column}, '')::timestamp"
+                    ))
+        else:
+            converted = _rewrite_sqlite_timestamps(engine, model, column)
+            if converted:
+                logger.info(f"Migration successful: {converted} '{table}.{column}' values converted to timestamps.")
+
+        with engine.begin() as conn:
+            for index in model.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+def _rewrite_sqlite_timestamps(engine, model, column) -> int:
+    """Rewrites ISO text values ('2025-01-06T09:00:00') through the typed column, in batches."""
+    table = model.__tablename__
+    # Anything not already in DateTime storage format (the 'T' separator, no microseconds, ...)
+    pending = text(
+        f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL "
+        f"AND (instr({column}, 'T') > 0 OR length({column}) != {SQLITE_DATETIME_LENGTH}) "
+        f"ORDER BY id LIMIT {CONVERT_BATCH_SIZE}"
+    )
+    rewrite = update(model.__table__).where(
+        model.__table__.c.id == bindparam("row_id")
+    ).values({column: bindparam("value")})
+
+    converted = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(pending).all()
+            if not rows:
+                return converted
+            params = []
+            for row_id, value in rows:
+                try:
+                    params.append({"row_id": row_id, "value": datetime.fromisoformat(value)})
+                except (TypeError, ValueError):
+                    # Unreadable as a timestamp: cleared, or it would break every read of the row
+                    logger.warning(f"Migrating: '{table}.{column}' of row {row_id} is not a timestamp ({value!r}), cleared.")
+                    params.append({"row_id": row_id, "value": None})
+            conn.execute(rewrite, params)
+            converted += len(params)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from database import engine
+    run_auto_migrations(engine)
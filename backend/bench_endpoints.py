@@ -0,0 +1,231 @@
+"""
+In-process endpoint benchmark.
+
+Drives the FastAPI app with TestClient against generated datasets
+(generate_dataset.generate) of several sizes, in a throwaway SQLite database.
+For every endpoint it records p50/p95/p99 latency and DB queries per request,
+writes the results as JSON, and can compare them with a saved baseline:
+a p95 slower than the baseline by more than --threshold, or more queries per
+request, is reported as a regression (exit code 1).
+
+Usage:
+    python bench_endpoints.py --sizes 200,1000 --save-baseline bench_baseline.json
+    python bench_endpoints.py --sizes 200,1000 --baseline bench_baseline.json > ../bench_output.txt
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Configure Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("bench")
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(latencies_ms, queries, statuses) -> dict:
+    return {
+        "n": len(latencies_ms),
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+        "queries": round(sum(queries) / len(queries), 1),
+        "statuses": sorted(set(statuses)),
+    }
+
+
+class Bench:
+    """Times requests and counts the SQL statements each one executes."""
+
+    def __init__(self, client, engine):
+        from sqlalchemy import event
+
+        self.client = client
+        self.query_count = 0
+        self.results = {}
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            self.query_count += 1
+
+    def request(self, name: str, method: str, url: str, **kwargs):
+        before = self.query_count
+        start = time.perf_counter()
+        response = self.client.request(method, url, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        samples = self.results.setdefault(name, ([], [], []))
+        samples[0].append(elapsed_ms)
+        samples[1].append(self.query_count - before)
+        samples[2].append(response.status_code)
+        return response
+
+    def summary(self) -> dict:
+        return {name: summarize(*samples) for name, samples in self.results.items()}
+
+
+def booking_targets(db, week_start: datetime, count: int):
+    """
+    (trainer_id, start_time) pairs that respect the capacity rules in a week
+    nobody else books: at most 3 trainers x 2 clients per slot, client hours only.
+    """
+    import models
+
+    targets = []
+    client_hours = [f"{h:02d}:00" for h in list(range(7, 13)) + list(range(15, 21))]
+    shifts = db.query(models.Availability).order_by(models.Availability.id).all()
+    slot_trainers = {}
+    for shift in shifts:
+        for hour in client_hours:
+            if shift.start_time <= hour < shift.end_time:
+                trainers = slot_trainers.setdefault((shift.day_of_week, hour), [])
+                if len(trainers) < 3 and shift.trainer_id not in trainers:
+                    trainers.append(shift.trainer_id)
+
+    for (day_of_week, hour), trainers in sorted(slot_trainers.items()):
+        start_time = f"{(week_start + timedelta(days=day_of_week)).strftime('%Y-%m-%d')}T{hour}:00"
+        for trainer_id in trainers:
+            targets.extend([(trainer_id, start_time)] * 2)
+        if len(targets) >= count:
+            break
+    return targets[:count]
+
+
+def run_size(size: int, args) -> dict:
+    from fastapi.testclient import TestClient
+
+    import main
+    import models
+    from database import SessionLocal, engine
+    from generate_dataset import generate
+
+    def regenerate():
+        generate(engine, clients=size, trainers=max(size // 40, 6), seed=args.seed)
+        main.shift_index.invalidate()
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    schedule_week = today - timedelta(days=today.weekday()) + timedelta(days=14)
+    booking_week = schedule_week + timedelta(days=7)
+
+    bench = Bench(TestClient(main.app), engine)
+
+    # 1. Heavy admin operations: fresh dataset per sample so every run does the same work
+    for _ in range(args.heavy_repeat):
+        regenerate()
+        payload = {"week_start_date": schedule_week.strftime("%Y-%m-%d")}
+        bench.request("POST /appointments/auto-schedule", "POST", "/appointments/auto-schedule", json=payload)
+        bench.request("POST /appointments/auto-resolve", "POST", "/appointments/auto-resolve", json=payload)
+
+    # 2. Bookings: distinct clients with credits into free seats of another week
+    db = SessionLocal()
+    try:
+        clients = db.query(models.User).filter(
+            models.User.role == "client",
+            models.User.workout_credits > 0
+        ).order_by(models.User.id).limit(args.repeat).all()
+        targets = booking_targets(db, booking_week, len(clients))
+    finally:
+        db.close()
+
+    for client, (trainer_id, start_time) in zip(clients, targets):
+        bench.request("POST /appointments/", "POST", "/appointments/", json={
+            "trainer_id": trainer_id,
+            "client_name": client.first_name or "Client",
+            "client_email": client.email,
+            "start_time": start_time,
+        })
+
+    # 3. Reads on the scheduled dataset
+    for _ in range(args.repeat):
+        bench.request("GET /appointments/", "GET", "/appointments/")
+        bench.request("GET /users/", "GET", "/users/")
+        bench.request("GET /trainers/", "GET", "/trainers/")
+
+    return bench.summary()
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Regressions: p95 more than `threshold` slower, or more queries per request."""
+    regressions = []
+    for size, endpoints in results.items():
+        for name, current in endpoints.items():
+            previous = baseline.get(size, {}).get(name)
+            if not previous:
+                continue
+            if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append(f"[{size}] {name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+            if current["queries"] > previous["queries"]:
+                regressions.append(f"[{size}] {name}: queries {previous['queries']} -> {current['queries']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hot endpoints in-process against generated datasets.")
+    parser.add_argument("--sizes", default="200,1000", help="Comma-separated client counts")
+    parser.add_argument("--repeat", type=int, default=30, help="Samples per light endpoint")
+    parser.add_argument("--heavy-repeat", type=int, default=3, help="Samples for auto-schedule / auto-resolve")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed p95 slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    save_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    # The app binds its engine at import time: point it at a scratch DB first,
+    # and run from the scratch dir so uploads / mock logs land there too.
+    workdir = tempfile.mkdtemp(prefix="gym-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(workdir)
+    logging.getLogger().setLevel(logging.WARNING)
+    # whatsapp_service prints mock messages when its logger has no handler
+    logging.getLogger("whatsapp_service").addHandler(logging.NullHandler())
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        start = time.perf_counter()
+        results[str(size)] = run_size(size, args)
+        logger.warning(f"Size {size}: done in {time.perf_counter() - start:.1f}s")
+
+    for size, endpoints in results.items():
+        print(f"\n== {size} clients ==")
+        print(f"{'endpoint':<36}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}")
+        for name, stats in endpoints.items():
+            print(f"{name:<36}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['queries']:>10}")
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import func, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import client_usage
+import models
+import occupancy
+import outbox
+import schemas
+from week_state import MAX_CLIENTS_PER_SLOT, MAX_CLIENTS_PER_TRAINER, MAX_TRAINERS_PER_SLOT
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+BOOKING_ATTEMPTS = 5         # tries before a locked slot is reported as busy
+RETRY_BACKOFF = 0.05         # seconds, multiplied by the attempt number
+
+MAX_BATCH_SIZE = 100         # bookings per POST /appointments/batch
+
+# Start hours clients may book (07:00-12:00, 15:00-20:00)
+CLIENT_HOURS = tuple(range(7, 13)) + tuple(range(15, 21))
+
+# Postgres serialization failure / deadlock
+RETRYABLE_PGCODES = ("40001", "40P01")
+
+DUPLICATE_BOOKING = "You already have a booking at this time."
+NO_CREDITS = "You have 0 workout credits remaining. Resupply via admin."
+
+
+# --- Rules ---
+# Shared by single and batch bookings, so both report the same errors.
+
+def parse_slot(start_time: str) -> datetime:
+    try:
+        appt_date = datetime.fromisoformat(start_time).replace(tzinfo=None) # Naive, as IsoDateTime stores it
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    if appt_date.date() < datetime.now().date():
+        raise HTTPException(status_code=400, detail="Cannot book appointments in the past.")
+    return appt_date
+
+
+def canonical(appointment: schemas.AppointmentCreate, appt_date: datetime) -> schemas.AppointmentCreate:
+    """
+    The appointment with its slot as the text Appointment.start_time reads
+    back ('…T09:00', '…T09:00:00.000' -> '…T09:00:00'), so occupancy, lock,
+    waitlist and usage keys match the stored bookings.
+    """
+    return appointment.model_copy(update={"start_time": appt_date.isoformat()})
+
+
+def week_bounds(appt_date: datetime):
+    """Monday 00:00 of the appointment's week, and the following Monday."""
+    start_of_week = (appt_date - timedelta(days=appt_date.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start_of_week, start_of_week + timedelta(days=7)
+
+
+def check_capacity(total_clients: int, active_trainers: int, trainer_clients: int):
+    """Max 6 clients per slot, 2 per trainer, 3 active trainers per slot."""
+    if total_clients >= MAX_CLIENTS_PER_SLOT:
+        raise HTTPException(status_code=400, detail="Gym capacity reached for this time slot (Max 6 clients).")
+    if trainer_clients >= MAX_CLIENTS_PER_TRAINER:
+        raise HTTPException(status_code=400, detail="Trainer is fully booked for this time slot (Max 2 clients).")
+    if trainer_clients == 0 and active_trainers >= MAX_TRAINERS_PER_SLOT:
+        raise HTTPException(status_code=400, detail="Shift capacity reached (Max 3 trainers per shift).")
+
+
+def check_client(client_user, start_time: str) -> int:
+    """Client-only hours (07-12, 15-20). Returns the weekly limit (3 for unknown emails)."""
+    if not client_user:
+        return 3 # Default fallback
+
+    if client_user.role == "client":
+        try:
+            hour = int(start_time.split("T")[1].split(":")[0])
+        except (IndexError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid time format.")
+        if hour not in CLIENT_HOURS:
+            raise HTTPException(
+                status_code=400,
+                detail="Clients can only book between 07:00-12:00 or 15:00-20:00."
+            )
+    return client_user.weekly_workout_limit
+
+
+# --- Booking ---
+
+def is_retryable(error: OperationalError) -> bool:
+    """Lock conflicts worth another attempt (vs. real database errors)."""
+    if getattr(error.orig, "pgcode", None) in RETRYABLE_PGCODES:
+        return True
+    return "database is locked" in str(error.orig)
+
+
+def run_with_retries(db: Session, work, label: str):
+    """
+    Runs work() and commits, retrying the whole transaction on lock
+    conflicts. HTTPExceptions roll back and propagate unchanged.
+    """
+    for attempt in range(1, BOOKING_ATTEMPTS + 1):
+        try:
+            result = work()
+            db.commit()
+            return result
+        except HTTPException:
+            db.rollback()
+            raise
+        except OperationalError as e:
+            db.rollback()
+            if not is_retryable(e):
+                raise
+            logger.warning(f"Booking {label}: lock conflict (attempt {attempt}/{BOOKING_ATTEMPTS})")
+            time.sleep(RETRY_BACKOFF * attempt)
+
+    raise HTTPException(status_code=503, detail="This time slot is busy right now, please try again.")
+
+
+async def run_with_retries_async(db: AsyncSession, work, label: str):
+    """
+    run_with_retries for async handlers: work(session) is the same sync code,
+    run on the AsyncSession's connection via run_sync; backoff doesn't block
+    the event loop.
+    """
+    for attempt in range(1, BOOKING_ATTEMPTS + 1):
+        try:
+            result = await db.run_sync(work)
+            await db.commit()
+            return result
+        except HTTPException:
+            await db.rollback()
+            raise
+        except OperationalError as e:
+            await db.rollback()
+            if not is_retryable(e):
+                raise
+            logger.warning(f"Booking {label}: lock conflict (attempt {attempt}/{BOOKING_ATTEMPTS})")
+            await asyncio.sleep(RETRY_BACKOFF * attempt)
+
+    raise HTTPException(status_code=503, detail="This time slot is busy right now, please try again.")
+
+
+def create_booking(db: Session, appointment: schemas.AppointmentCreate) -> models.Appointment:
+    """
+    Books the appointment atomically: checks and writes run under the slot
+    lock (its occupancy row) and the client's row lock, and credits are
+    taken with a guarded UPDATE. Lock conflicts are retried; rule
+    violations raise HTTP 400. Returns the committed appointment.
+    """
+    db_appointment = run_with_retries(db, lambda: _book(db, appointment), appointment.start_time)
+    db.refresh(db_appointment)
+    return db_appointment
+
+
+async def create_booking_async(db: AsyncSession, appointment: schemas.AppointmentCreate) -> models.Appointment:
+    """create_booking for async handlers (same checks and locks)."""
+    db_appointment = await run_with_retries_async(db, lambda session: _book(session, appointment), appointment.start_time)
+    await db.refresh(db_appointment)
+    return db_appointment
+
+
+def _book(db: Session, appointment: schemas.AppointmentCreate) -> models.Appointment:
+    # 0. Date checks (before locking, so bad input never creates a lock row)
+    appt_date = parse_slot(appointment.start_time)
+    start_of_week, end_of_week = week_bounds(appt_date)
+    appointment = canonical(appointment, appt_date)
+
+    # 1. Lock the slot before reading anything
+    occupancy.lock(db, appointment.start_time)
+
+    # 2. Duplicate Booking Check: User cannot book the same slot twice
+    existing_appointment = db.query(models.Appointment.id).filter(
+        models.Appointment.client_email == appointment.client_email,
+        models.Appointment.start_time == appointment.start_time,
+        models.Appointment.status != "cancelled"
+    ).first()
+    if existing_appointment:
+        raise HTTPException(status_code=400, detail=DUPLICATE_BOOKING)
+
+    # 3. Gym / Trainer Capacity (occupancy rows, locked above)
+    slot = occupancy.slot(db, appointment.start_time)
+    trainer_client_count = occupancy.trainer_clients(db, appointment.start_time, appointment.trainer_id)
+    check_capacity(slot.total_clients, slot.active_trainers, trainer_client_count)
+
+    # 4. Client: row-locked (Postgres) so parallel bookings of the same client
+    # in different slots can't both pass the weekly limit
+    client_user = db.query(models.User).filter(
+        models.User.email == appointment.client_email
+    ).with_for_update().first()
+
+    user_limit = check_client(client_user, appointment.start_time)
+
+    # 5. Weekly Workout Limit: the client's counter row (unknown emails are counted by email)
+    if client_user:
+        weekly_count = client_usage.count(db, client_user.id, appointment.start_time)
+    else:
+        weekly_count = db.query(func.count(models.Appointment.id)).filter(
+            models.Appointment.client_email == appointment.client_email,
+            models.Appointment.status != "cancelled",
+            models.Appointment.start_time >= start_of_week,
+            models.Appointment.start_time < end_of_week
+        ).scalar()
+    if weekly_count >= user_limit:
+        raise HTTPException(status_code=400, detail=f"Weekly workout limit reached ({user_limit} sessions/week).")
+
+    # 6. Workout Credits: decrement only if still positive
+    if client_user:
+        taken = db.execute(
+            update(models.User)
+            .where(models.User.id == client_user.id, models.User.workout_credits > 0)
+            .values(workout_credits=models.User.workout_credits - 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not taken:
+            raise HTTPException(status_code=400, detail=NO_CREDITS)
+        db.expire(client_user, ["workout_credits"])
+
+    db_appointment = models.Appointment(**appointment.dict())
+    if client_user and not db_appointment.client_id:
+        db_appointment.client_id = client_user.id
+    db.add(db_appointment)
+    occupancy.add(db, appointment.start_time, appointment.trainer_id, 1)
+    client_usage.add(db, db_appointment.client_id, appointment.start_time, 1)
+
+    # 7. Confirmation message: outbox row, sent after commit by the outbox workers
+    outbox.enqueue_appointment_created(db, db_appointment)
+    return db_appointment
+
+
+# --- Batch Booking ---
+
+def create_batch(db: Session, appointments):
+    """
+    Books a list of appointments against one locked snapshot: every slot
+    and client is locked and read once, items are checked in order with
+    in-memory counters (earlier items count against later ones), and the
+    accepted ones are written in one transaction.
+
+    Returns one (appointment, None) or (None, error detail) per item.
+    """
+    results = run_with_retries(db, lambda: _book_batch(db, appointments), f"batch of {len(appointments)}")
+    for db_appointment, _ in results:
+        if db_appointment is not None:
+            db.refresh(db_appointment)
+    return results
+
+
+def _book_batch(db: Session, appointments):
+    results = [None] * len(appointments)
+
+    # 0. Date checks
+    appointments = list(appointments)
+    dates = {}
+    for i, appointment in enumerate(appointments):
+        try:
+            dates[i] = parse_slot(appointment.start_time)
+        except HTTPException as e:
+            results[i] = (None, e.detail)
+            continue
+        appointments[i] = canonical(appointment, dates[i])
+    if not dates:
+        return results
+
+    slots = sorted({appointments[i].start_time for i in dates})
+    emails = sorted({appointments[i].client_email for i in dates})
+    weeks = {i: week_bounds(dt) for i, dt in dates.items()}
+    range_start = min(start for start, _ in weeks.values())
+    range_end = max(end for _, end in weeks.values())
+
+    # 1. Lock every slot (sorted, so parallel batches can't deadlock), then the clients
+    for slot in slots:
+        occupancy.lock(db, slot)
+    clients = {
+        c.email: c for c in db.query(models.User).filter(
+            models.User.email.in_(emails)
+        ).order_by(models.User.id).with_for_update().all()
+    }
+
+    # 2. Snapshot: occupancy, existing bookings and weekly counts
+    slot_counts = {
+        row.start_time: [row.total_clients, row.active_trainers]
+        for row in db.query(models.SlotOccupancy).filter(
+            models.SlotOccupancy.start_time.in_(slots)
+        ).populate_existing().all()
+    }
+    trainer_counts = {
+        (row.start_time, row.trainer_id): row.clients
+        for row in db.query(models.SlotTrainerOccupancy).filter(
+            models.SlotTrainerOccupancy.start_time.in_(slots)
+        ).populate_existing().all()
+    }
+
+    # (email, slot datetime): compared as datetimes, whatever text form either side has
+    booked = {
+        (email, datetime.fromisoformat(start_time))
+        for email, start_time in db.query(models.Appointment.client_email, models.Appointment.start_time).filter(
+            models.Appointment.client_email.in_(emails),
+            models.Appointment.status != "cancelled",
+            models.Appointment.start_time.in_(slots)
+        ).all()
+    }
+
+    # Weekly counts: counter rows of known clients, unknown emails counted by email
+    weekly_counts = defaultdict(int) # (email, week start iso) -> bookings
+    week_starts = {start for start, _ in weeks.values()}
+    usage = client_usage.counts(db, [c.id for c in clients.values()], [client_usage.week_key(w) for w in week_starts])
+    for email, client_user in clients.items():
+        for week_start in week_starts:
+            weekly_counts[(email, week_start.isoformat())] = usage.get((client_user.id, client_usage.week_key(week_start)), 0)
+    unknown = [email for email in emails if email not in clients]
+    if unknown:
+        for email, start_time in db.query(models.Appointment.client_email, models.Appointment.start_time).filter(
+            models.Appointment.client_email.in_(unknown),
+            models.Appointment.status != "cancelled",
+            models.Appointment.start_time >= range_start,
+            models.Appointment.start_time < range_end
+        ).all():
+            week_start, _ = week_bounds(datetime.fromisoformat(start_time))
+            weekly_counts[(email, week_start.isoformat())] += 1
+
+    credits = {c.id: c.workout_credits for c in clients.values()}
+    taken = defaultdict(int) # client id -> credits used by this batch
+
+    # 3. Check items in order against the snapshot
+    new_appointments = []
+    for i in sorted(dates):
+        appointment = appointments[i]
+        slot, email = appointment.start_time, appointment.client_email
+        week_key = (email, weeks[i][0].isoformat())
+        client_user = clients.get(email)
+        try:
+            if (email, dates[i]) in booked:
+                raise HTTPException(status_code=400, detail=DUPLICATE_BOOKING)
+            total_clients, active_trainers = slot_counts.setdefault(slot, [0, 0])
+            trainer_clients = trainer_counts.get((slot, appointment.trainer_id), 0)
+            check_capacity(total_clients, active_trainers, trainer_clients)
+            user_limit = check_client(client_user, slot)
+            if weekly_counts[week_key] >= user_limit:
+                raise HTTPException(status_code=400, detail=f"Weekly workout limit reached ({user_limit} sessions/week).")
+            if client_user and credits[client_user.id] - taken[client_user.id] <= 0:
+                raise HTTPException(status_code=400, detail=NO_CREDITS)
+        except HTTPException as e:
+            results[i] = (None, e.detail)
+            continue
+
+        # Accepted: count it against the following items
+        booked.add((email, dates[i]))
+        slot_counts[slot][0] += 1
+        if trainer_clients == 0:
+            slot_counts[slot][1] += 1
+        trainer_counts[(slot, appointment.trainer_id)] = trainer_clients + 1
+        weekly_counts[week_key] += 1
+
+        db_appointment = models.Appointment(**appointment.dict())
+        if client_user:
+            taken[client_user.id] += 1
+            if not db_appointment.client_id:
+                db_appointment.client_id = client_user.id
+        new_appointments.append(db_appointment)
+        results[i] = (db_appointment, None)
+
+    # 4. Write: credits (guarded, clients are locked), appointments, occupancy, weekly counters, outbox
+    for client_id, count in taken.items():
+        updated = db.execute(
+            update(models.User)
+            .where(models.User.id == client_id, models.User.workout_credits >= count)
+            .values(workout_credits=models.User.workout_credits - count)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            # Can't happen while the row is locked; fail the whole batch rather than overdraw
+            raise HTTPException(status_code=409, detail="Credits changed during the batch, please retry.")
+
+    db.add_all(new_appointments)
+    db.flush()
+    occupancy.refresh(db, {a.start_time for a in new_appointments})
+    usage_deltas = defaultdict(int)
+    for a in new_appointments:
+        usage_deltas[(a.client_id, client_usage.week_key(a.start_time))] += 1
+    client_usage.apply(db, usage_deltas)
+
+    trainer_names = dict(db.query(models.Trainer.id, models.Trainer.name).filter(
+        models.Trainer.id.in_({a.trainer_id for a in new_appointments})
+    ).all()) if new_appointments else {}
+    for a in new_appointments:
+        outbox.enqueue_appointment_created(db, a, trainer_names.get(a.trainer_id) or "Gym Trainer")
+    for client_user in clients.values():
+        db.expire(client_user, ["workout_credits"])
+    return results
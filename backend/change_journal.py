@@ -0,0 +1,148 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Change kinds
+CLIENT = "client"              # limit / credits / account changed: re-plan all of the client's slots
+DEFAULT_SLOT = "default_slot"  # a client's default slot added or removed
+SHIFT = "shift"                # a trainer availability added or removed
+FREED_SLOT = "freed_slot"      # booked seats freed (cancel / delete): re-plan clients who default to that slot
+
+
+# --- Recording ---
+# Entries are added to the caller's session, so they commit in the same transaction as the change.
+
+def record_client(db: Session, user_id: int):
+    db.add(models.ScheduleChange(kind=CLIENT, user_id=user_id, created_at=datetime.now().isoformat()))
+
+
+def record_default_slots(db: Session, user_id: int, slots):
+    now_iso = datetime.now().isoformat()
+    for slot in slots:
+        db.add(models.ScheduleChange(
+            kind=DEFAULT_SLOT,
+            user_id=user_id,
+            day_of_week=slot.day_of_week,
+            start_time=slot.start_time,
+            created_at=now_iso
+        ))
+
+
+def record_shift(db: Session, trainer_id: int, day_of_week: int, start_time: str, end_time: str):
+    db.add(models.ScheduleChange(
+        kind=SHIFT,
+        trainer_id=trainer_id,
+        day_of_week=day_of_week,
+        start_time=start_time,
+        end_time=end_time,
+        created_at=datetime.now().isoformat()
+    ))
+
+
+def record_freed_slots(db: Session, start_times):
+    """One entry per distinct (weekday, HH:MM) among the freed ISO slots."""
+    now_iso = datetime.now().isoformat()
+    slots = set()
+    for start_time in start_times:
+        slot_dt = datetime.fromisoformat(start_time)
+        slots.add((slot_dt.weekday(), slot_dt.strftime("%H:%M")))
+    for day_of_week, start_time in sorted(slots):
+        db.add(models.ScheduleChange(
+            kind=FREED_SLOT,
+            day_of_week=day_of_week,
+            start_time=start_time,
+            created_at=now_iso
+        ))
+
+
+def reset_runs(db: Session, start: datetime, end: datetime):
+    """
+    Forgets the runs of the weeks overlapping [start, end) (e.g. a cleared
+    week), so their next auto-schedule is a full pass.
+    """
+    db.query(models.ScheduleRun).filter(
+        models.ScheduleRun.week_start > (start - timedelta(days=7)).strftime("%Y-%m-%d"),
+        models.ScheduleRun.week_start < end.strftime("%Y-%m-%d")
+    ).delete(synchronize_session=False)
+
+
+# --- Reading ---
+
+def latest_change_id(db: Session) -> int:
+    return db.query(func.max(models.ScheduleChange.id)).scalar() or 0
+
+
+def last_run(db: Session, week_start: datetime):
+    return db.query(models.ScheduleRun).filter(
+        models.ScheduleRun.week_start == week_start.strftime("%Y-%m-%d")
+    ).first()
+
+
+def changes_since(db: Session, change_id: int, up_to: int):
+    return db.query(models.ScheduleChange).filter(
+        models.ScheduleChange.id > change_id,
+        models.ScheduleChange.id <= up_to
+    ).all()
+
+
+def affected_clients(db: Session, changes):
+    """
+    Client ids whose bookings may change because of the journal entries:
+    the changed clients themselves, plus every client with a default slot
+    at a changed slot or inside a changed trainer shift.
+    """
+    client_ids = {c.user_id for c in changes if c.kind in (CLIENT, DEFAULT_SLOT) and c.user_id}
+
+    slot_filters = []
+    for c in changes:
+        if c.kind in (DEFAULT_SLOT, FREED_SLOT):
+            slot_filters.append(and_(
+                models.ClientDefaultSlot.day_of_week == c.day_of_week,
+                models.ClientDefaultSlot.start_time == c.start_time
+            ))
+        elif c.kind == SHIFT:
+            slot_filters.append(and_(
+                models.ClientDefaultSlot.day_of_week == c.day_of_week,
+                models.ClientDefaultSlot.start_time >= c.start_time,
+                models.ClientDefaultSlot.start_time < c.end_time
+            ))
+
+    if slot_filters:
+        rows = db.query(models.ClientDefaultSlot.user_id).filter(or_(*slot_filters)).distinct().all()
+        client_ids.update(r[0] for r in rows)
+
+    return client_ids
+
+
+def mark_run(db: Session, week_start: datetime, change_id: int):
+    """Records that the week is planned up to journal entry `change_id` (committed by the caller)."""
+    run = last_run(db, week_start)
+    if run is None:
+        run = models.ScheduleRun(week_start=week_start.strftime("%Y-%m-%d"))
+        db.add(run)
+    run.last_change_id = change_id
+    run.completed_at = datetime.now().isoformat()
+    db.flush()
+
+
+def prune(db: Session, current_week_start: datetime):
+    """
+    Drops journal entries every current/future planned week has already consumed.
+    Past weeks are never re-planned, and weeks without a run get a full run.
+    """
+    oldest_needed = db.query(func.min(models.ScheduleRun.last_change_id)).filter(
+        models.ScheduleRun.week_start >= current_week_start.strftime("%Y-%m-%d")
+    ).scalar()
+    if oldest_needed:
+        # Keep entry `oldest_needed` itself: SQLite reuses ids above the highest remaining row
+        deleted = db.query(models.ScheduleChange).filter(
+            models.ScheduleChange.id < oldest_needed
+        ).delete(synchronize_session=False)
+        if deleted:
+            logger.info(f"Pruned {deleted} schedule journal entries")
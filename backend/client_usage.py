@@ -0,0 +1,197 @@
+"""
+Per-client weekly booking counters.
+
+client_week_usage keeps one row per (client, week) with the client's
+active bookings that week (weeks start Monday 00:00, as booking.week_bounds),
+so the weekly-limit check is a primary-key read instead of a range scan
+over appointments.
+
+Every write path keeps it in step inside its own transaction, next to the
+occupancy tables: single bookings / cancellations apply a delta (add),
+bulk writes recount the clients or weeks they touched (refresh_clients /
+refresh_range). audit() compares it with appointments and rebuild()
+recomputes it:
+
+    python client_usage.py --audit
+    python client_usage.py --rebuild
+"""
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+from occupancy import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def _insert(db: Session):
+    """Dialect insert with ON CONFLICT support (Postgres / SQLite)."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def week_key(moment) -> str:
+    """Monday (YYYY-MM-DD) of the week containing an ISO slot string, date or datetime."""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    return (moment - timedelta(days=moment.weekday())).strftime("%Y-%m-%d")
+
+
+# --- Reads ---
+
+def count(db: Session, client_id: int, moment) -> int:
+    """Active bookings of the client in the week of `moment` (slot string or datetime)."""
+    row = db.get(models.ClientWeekUsage, (client_id, week_key(moment)), populate_existing=True)
+    return row.bookings if row else 0
+
+
+def counts(db: Session, client_ids, week_starts) -> dict:
+    """(client_id, week_start) -> bookings for every combination that has any."""
+    client_ids, week_starts = list(set(client_ids)), list(set(week_starts))
+    if not client_ids or not week_starts:
+        return {}
+    result = {}
+    for i in range(0, len(client_ids), CHUNK_SIZE):
+        for row in db.query(models.ClientWeekUsage).filter(
+            models.ClientWeekUsage.client_id.in_(client_ids[i:i + CHUNK_SIZE]),
+            models.ClientWeekUsage.week_start.in_(week_starts)
+        ).populate_existing().all():
+            result[(row.client_id, row.week_start)] = row.bookings
+    return result
+
+
+# --- Maintenance ---
+
+def add(db: Session, client_id: int, start_time: str, delta: int):
+    """Applies one booking (+1) or cancellation (-1) of the client at the slot."""
+    if client_id is None:
+        return
+    apply(db, {(client_id, week_key(start_time)): delta})
+
+
+def apply(db: Session, deltas: dict):
+    """Adds {(client_id, week_start): delta} in one upsert (the row update is atomic)."""
+    deltas = {key: delta for key, delta in deltas.items() if key[0] is not None and delta}
+    if not deltas:
+        return
+    stmt = _insert(db)(models.ClientWeekUsage)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.ClientWeekUsage.client_id, models.ClientWeekUsage.week_start],
+        set_={"bookings": models.ClientWeekUsage.bookings + stmt.excluded.bookings}
+    )
+    db.execute(stmt, [
+        {"client_id": client_id, "week_start": week_start, "bookings": delta}
+        for (client_id, week_start), delta in sorted(deltas.items())
+    ])
+
+
+def refresh_clients(db: Session, client_ids):
+    """Recounts every week of the given clients (after bulk deletes / cancellations)."""
+    client_ids = sorted({c for c in client_ids if c is not None})
+    for i in range(0, len(client_ids), CHUNK_SIZE):
+        chunk = client_ids[i:i + CHUNK_SIZE]
+        _recount(
+            db,
+            [models.Appointment.client_id.in_(chunk)],
+            [models.ClientWeekUsage.client_id.in_(chunk)]
+        )
+
+
+def refresh_range(db: Session, start_iso: str, end_iso: str):
+    """Recounts every week overlapping [start_iso, end_iso), e.g. a scheduled or cleared week."""
+    first = week_key(start_iso)
+    last = datetime.fromisoformat(week_key(datetime.fromisoformat(end_iso) - timedelta(microseconds=1)))
+    after = (last + timedelta(days=7)).strftime("%Y-%m-%d")
+    _recount(
+        db,
+        [models.Appointment.start_time >= first, models.Appointment.start_time < after],
+        [models.ClientWeekUsage.week_start >= first, models.ClientWeekUsage.week_start < after]
+    )
+
+
+def rebuild(db: Session) -> int:
+    """Recomputes the table from appointments (committed by the caller). Returns (client, week) rows."""
+    return _recount(db, [], [])
+
+
+def expected(db: Session, appointment_filter) -> dict:
+    """(client_id, week_start) -> active bookings, counted from appointments."""
+    day = func.date(models.Appointment.start_time)
+    per_day = db.query(
+        models.Appointment.client_id,
+        day,
+        func.count(models.Appointment.id)
+    ).filter(
+        models.Appointment.client_id.isnot(None),
+        models.Appointment.status != "cancelled",
+        *appointment_filter
+    ).group_by(models.Appointment.client_id, day).all()
+
+    totals = defaultdict(int)
+    for client_id, day, bookings in per_day:
+        totals[(client_id, week_key(day))] += bookings
+    return totals
+
+
+def _recount(db: Session, appointment_filter, usage_filter) -> int:
+    """Replaces the usage rows selected by usage_filter with counts from the matching appointments."""
+    totals = expected(db, appointment_filter)
+    db.query(models.ClientWeekUsage).filter(*usage_filter).delete(synchronize_session=False)
+    if totals:
+        db.execute(_insert(db)(models.ClientWeekUsage), [
+            {"client_id": client_id, "week_start": week_start, "bookings": bookings}
+            for (client_id, week_start), bookings in sorted(totals.items())
+        ])
+    db.flush()
+    return len(totals)
+
+
+def audit(db: Session) -> list:
+    """Rows that disagree with appointments: [{client_id, week_start, stored, expected}] (empty = in step)."""
+    totals = expected(db, [])
+    stored = {(row.client_id, row.week_start): row.bookings for row in db.query(models.ClientWeekUsage).all()}
+    mismatches = []
+    for key in sorted(set(totals) | set(stored)):
+        if stored.get(key, 0) != totals.get(key, 0):
+            client_id, week_start = key
+            mismatches.append({"client_id": client_id, "week_start": week_start, "stored": stored.get(key, 0), "expected": totals.get(key, 0)})
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-client weekly booking counters.")
+    parser.add_argument("--audit", action="store_true", help="Report counters that disagree with appointments")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute counters from appointments")
+    args = parser.parse_args()
+    if not (args.audit or args.rebuild):
+        parser.print_help()
+        return
+
+    from database import SessionLocal, engine
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.audit:
+            mismatches = audit(db)
+            for m in mismatches:
+                logger.warning(f"Client {m['client_id']} week {m['week_start']}: stored {m['stored']}, expected {m['expected']}")
+            logger.info(f"Client week usage audit: {len(mismatches)} mismatches")
+        if args.rebuild:
+            rows = rebuild(db)
+            db.commit()
+            logger.info(f"Client week usage rebuilt: {rows} (client, week) rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -1,5 +1,10 @@
+import contextvars
+import heapq
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -23,6 +28,34 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+# --- Async Engine ---
+# The same database through an async driver (aiosqlite / asyncpg), for the
+# async request handlers: they wait on the database instead of holding one
+# of the threadpool's workers.
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+ASYNC_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "20"))
+
+
+def async_database_url(url: str) -> str:
+    for sync_prefix, async_prefix in (
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+async_engine = create_async_engine(
+    async_database_url(SQLALCHEMY_DATABASE_URL),
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW
+)
+# expire_on_commit=False: attributes can't lazy-load after commit in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -31,3 +64,101 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# --- Query Instrumentation ---
+# Every SQL statement is tagged with the route of the request (or job) that ran it.
+# The HTTP middleware in main.py sets `current_route`; GET /admin/metrics/queries reads the totals.
+
+QUERY_METRICS_ENABLED = os.getenv("QUERY_METRICS", "1") == "1"
+SLOWEST_PER_ROUTE = 5
+
+current_route = contextvars.ContextVar("current_route", default="(no route)")
+# {"count": int, "total_ms": float} of the request in progress (shared with the worker thread)
+current_request_stats = contextvars.ContextVar("current_request_stats", default=None)
+
+
+class QueryMetrics:
+    """Per-route query counts, total SQL time and slowest statements (process-wide)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def _route(self, route: str) -> dict:
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = {"requests": 0, "queries": 0, "total_ms": 0.0, "slowest": []}
+        return stats
+
+    def record_query(self, route: str, statement: str, elapsed_ms: float):
+        with self._lock:
+            stats = self._route(route)
+            stats["queries"] += 1
+            stats["total_ms"] += elapsed_ms
+            slowest = stats["slowest"]
+            entry = (elapsed_ms, statement[:500])
+            if len(slowest) < SLOWEST_PER_ROUTE:
+                heapq.heappush(slowest, entry)
+            elif elapsed_ms > slowest[0][0]:
+                heapq.heapreplace(slowest, entry)
+
+    def record_request(self, route: str):
+        with self._lock:
+            self._route(route)["requests"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            rows = []
+            for route, stats in self._routes.items():
+                requests = stats["requests"]
+                rows.append({
+                    "route": route,
+                    "requests": requests,
+                    "queries": stats["queries"],
+                    "queries_per_request": round(stats["queries"] / requests, 2) if requests else None,
+                    "total_sql_ms": round(stats["total_ms"], 2),
+                    "slowest": [
+                        {"ms": round(ms, 2), "statement": statement}
+                        for ms, statement in sorted(stats["slowest"], reverse=True)
+                    ],
+                })
+        return sorted(rows, key=lambda r: r["total_sql_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+query_metrics = QueryMetrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The start time lives on the per-statement context, so a statement that
+    # raises leaves nothing behind on the (pooled) connection
+    if QUERY_METRICS_ENABLED and context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not QUERY_METRICS_ENABLED:
+        return
+    start = getattr(context, "_query_start", None)
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    query_metrics.record_query(current_route.get(), statement, elapsed_ms)
+    request_stats = current_request_stats.get()
+    if request_stats is not None:
+        request_stats["count"] += 1
+        request_stats["total_ms"] += elapsed_ms
+
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,187 @@
+"""
+Synthetic large-gym dataset generator.
+
+Builds a deterministic dataset (admin, trainers + shifts, clients + default
+slots) with bulk executemany inserts, so 10k+ clients take seconds instead of
+the row-by-row commits of the seed_* scripts. The same arguments and seed
+always produce the same rows and ids, so scheduler benchmarks can be compared
+run to run.
+
+Usage:
+    python generate_dataset.py --clients 10000 --trainers 60 --seed 42
+    DATABASE_URL=sqlite:////tmp/bench.db python generate_dataset.py --clients 2000
+
+The target database is WIPED first. A running server keeps its shift index in
+memory: call POST /admin/shift-index/rebuild after generating.
+"""
+import argparse
+import logging
+import random
+import time
+
+from sqlalchemy import delete, insert
+from sqlalchemy.engine import Engine
+
+import models
+from database import engine as default_engine
+
+# Configure Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_PASSWORD = "GymStrong2026!"
+
+DAYS = range(7)                                      # 0 = Monday ... 6 = Sunday
+HOURS = [f"{h:02d}:00" for h in range(6, 22)]        # bookable slot starts 06:00 .. 21:00
+SHIFT_BLOCKS = [("06:00", "14:00"), ("14:00", "22:00")]
+PEAK_HOURS = {"07:00", "08:00", "09:00", "17:00", "18:00", "19:00"}
+
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn"]
+LAST_NAMES = ["Smith", "Garcia", "Chen", "Müller", "Rossi", "Silva", "Kowalski", "Nguyen", "Cohen", "Ivanova"]
+
+# Tables cleared before generating (children first)
+WIPE_ORDER = [
+    models.Notification,
+    models.OutboxMessage,
+    models.WaitlistEntry,
+    models.SlotTrainerOccupancy,
+    models.SlotOccupancy,
+    models.ClientWeekUsage,
+    models.Appointment,
+    models.ClientDefaultSlot,
+    models.Availability,
+    models.Trainer,
+    models.ScheduleChange,
+    models.ScheduleRun,
+    models.User,
+]
+
+
+def slot_weights(distribution: str):
+    """Relative popularity of each bookable hour for client default slots."""
+    if distribution == "uniform":
+        return [1] * len(HOURS)
+    if distribution == "peak":
+        return [4 if hour in PEAK_HOURS else 1 for hour in HOURS]
+    raise ValueError(f"Unknown slot distribution '{distribution}'")
+
+
+def generate(
+    engine: Engine,
+    clients: int = 1000,
+    trainers: int = 20,
+    shift_density: float = 0.6,
+    slots_per_client=(1, 4),
+    distribution: str = "peak",
+    seed: int = 42,
+    password_hash: str = DEFAULT_PASSWORD,
+    batch_size: int = 5000,
+) -> dict:
+    """
+    Wipes the schedule tables and inserts a generated gym. Returns row counts.
+
+    - shift_density: chance that a trainer works each (day, morning/evening) block.
+    - slots_per_client: (min, max) default slots per client, drawn uniformly.
+    - distribution: "peak" (mornings/evenings 4x as popular) or "uniform".
+    - password_hash: stored as-is for every user (computed once by the caller).
+    """
+    rnd = random.Random(seed)
+    weights = slot_weights(distribution)
+    min_slots, max_slots = slots_per_client
+
+    # 1. Build rows in memory with explicit ids (deterministic, no round trips)
+    users, trainer_rows, shifts, default_slots = [], [], [], []
+    users.append({"id": 1, "email": "admin@gym.com", "hashed_password": password_hash, "role": "admin",
+                  "weekly_workout_limit": 3, "workout_credits": 10})
+
+    for i in range(trainers):
+        user_id = len(users) + 1
+        users.append({"id": user_id, "email": f"trainer{i + 1}@gym.com", "hashed_password": password_hash,
+                      "role": "trainer", "first_name": rnd.choice(FIRST_NAMES), "last_name": rnd.choice(LAST_NAMES),
+                      "weekly_workout_limit": 3, "workout_credits": 10})
+        trainer_id = i + 1
+        trainer_rows.append({"id": trainer_id, "user_id": user_id, "name": f"Trainer {i + 1}",
+                             "role": "Coach", "bio": "Generated trainer", "photo_url": ""})
+        for day in DAYS:
+            for start_time, end_time in SHIFT_BLOCKS:
+                if rnd.random() < shift_density:
+                    shifts.append({"trainer_id": trainer_id, "day_of_week": day, "start_time": start_time,
+                                   "end_time": end_time, "is_recurring": True})
+
+    for i in range(clients):
+        user_id = len(users) + 1
+        users.append({"id": user_id, "email": f"client{i + 1}@gym.com", "hashed_password": password_hash,
+                      "role": "client", "first_name": rnd.choice(FIRST_NAMES), "last_name": rnd.choice(LAST_NAMES),
+                      "weekly_workout_limit": rnd.choice([1, 2, 2, 3, 3, 4]),
+                      "workout_credits": rnd.choice([0, 4, 8, 12, 20])})
+        wanted = set()
+        for _ in range(rnd.randint(min_slots, max_slots)):
+            wanted.add((rnd.choice(DAYS), rnd.choices(HOURS, weights)[0]))
+        for day, start_time in sorted(wanted):
+            default_slots.append({"user_id": user_id, "day_of_week": day, "start_time": start_time})
+
+    # 2. Wipe + bulk insert in one transaction
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for model in WIPE_ORDER:
+            conn.execute(delete(model))
+        for model, rows in (
+            (models.User, users),
+            (models.Trainer, trainer_rows),
+            (models.Availability, shifts),
+            (models.ClientDefaultSlot, default_slots),
+        ):
+            for start in range(0, len(rows), batch_size):
+                conn.execute(insert(model), rows[start:start + batch_size])
+
+    return {
+        "users": len(users),
+        "trainers": len(trainer_rows),
+        "availabilities": len(shifts),
+        "default_slots": len(default_slots),
+    }
+
+
+def parse_range(value: str):
+    """'1-4' -> (1, 4); '2' -> (2, 2)"""
+    low, _, high = value.partition("-")
+    low, high = int(low), int(high or low)
+    if low < 0 or high < low:
+        raise argparse.ArgumentTypeError(f"Invalid range '{value}'")
+    return low, high
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large synthetic gym dataset (wipes the database).")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--trainers", type=int, default=20)
+    parser.add_argument("--shift-density", type=float, default=0.6, help="Chance a trainer works each day/half-day block")
+    parser.add_argument("--slots-per-client", type=parse_range, default=(1, 4), help="Default slots per client, e.g. 1-4")
+    parser.add_argument("--distribution", choices=["peak", "uniform"], default="peak", help="Popularity of default slot hours")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="Password stored for every generated user")
+    parser.add_argument("--bcrypt", action="store_true", help="Store a bcrypt hash of --password (computed once)")
+    args = parser.parse_args()
+
+    password_hash = args.password
+    if args.bcrypt:
+        from passlib.context import CryptContext
+        password_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(args.password)
+
+    start = time.perf_counter()
+    counts = generate(
+        default_engine,
+        clients=args.clients,
+        trainers=args.trainers,
+        shift_density=args.shift_density,
+        slots_per_client=args.slots_per_client,
+        distribution=args.distribution,
+        seed=args.seed,
+        password_hash=password_hash,
+    )
+    logger.info(f"Generated {counts} in {time.perf_counter() - start:.2f}s")
+    logger.info("If the server is running, call POST /admin/shift-index/rebuild")
+
+
+if __name__ == "__main__":
+    main()
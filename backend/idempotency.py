@@ -0,0 +1,210 @@
+"""
+Idempotency-Key support for retried writes.
+
+The first request with a key claims it (a pending row), runs, and stores
+its status code + JSON body on the row. Replays of the same key and
+request get the stored response back from a primary-key lookup without
+running again; a replay while the first request is still running gets
+409. Keys expire after IDEMPOTENCY_TTL_HOURS and are purged in batches.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+PENDING_TIMEOUT = 60          # seconds before a claim without a response counts as abandoned
+PURGE_INTERVAL = 300          # seconds between purges (per process)
+PURGE_BATCH_SIZE = 500        # expired keys deleted per purge
+MAX_KEY_LENGTH = 255
+
+_purge_lock = threading.Lock()
+_next_purge = 0.0
+
+
+def fingerprint(route: str, payload) -> str:
+    """Hash of the route + request body: a key may only be replayed with the same request."""
+    raw = json.dumps([route, payload], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def run(db: Session, key: str, route: str, payload, work):
+    """
+    Runs work() -> JSON-serializable body at most once per key. Without a
+    key it just runs work(). A replay returns the stored response as a
+    JSONResponse (with an Idempotent-Replayed header).
+
+    Client errors (4xx) are stored like successes, so a replay sees the
+    same answer; 409 / 5xx release the key so the retry runs for real.
+    """
+    if not key:
+        return work()
+    check_key(key)
+
+    record = claim(db, key, route, fingerprint(route, payload))
+    if record is not None:
+        return replay(record, route, key)
+
+    try:
+        body = work()
+    except Exception as e:
+        db.rollback()
+        settle_error(db, key, e)
+        raise
+
+    complete(db, key, 200, body)
+    return body
+
+
+async def run_async(db: AsyncSession, key: str, route: str, payload, work):
+    """run() for async handlers: `work` is a coroutine function; bookkeeping runs via run_sync."""
+    if not key:
+        return await work()
+    check_key(key)
+
+    request_hash = fingerprint(route, payload)
+    record = await db.run_sync(lambda session: claim(session, key, route, request_hash))
+    if record is not None:
+        return replay(record, route, key)
+
+    try:
+        body = await work()
+    except Exception as e:
+        await db.rollback()
+        await db.run_sync(lambda session: settle_error(session, key, e))
+        raise
+
+    await db.run_sync(lambda session: complete(session, key, 200, body))
+    return body
+
+
+def check_key(key: str):
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters.")
+
+
+def replay(record: models.IdempotencyKey, route: str, key: str) -> JSONResponse:
+    logger.info(f"Idempotent replay: {route} key={key}")
+    return JSONResponse(
+        status_code=record.status_code,
+        content=json.loads(record.response),
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+def settle_error(db: Session, key: str, error: Exception):
+    """Stores client errors for replay; anything else releases the key."""
+    if isinstance(error, HTTPException) and error.status_code < 500 and error.status_code != 409:
+        complete(db, key, error.status_code, {"detail": error.detail})
+    else:
+        release(db, key)
+
+
+def claim(db: Session, key: str, route: str, request_hash: str):
+    """
+    Returns the completed record for a replay, or None once this request
+    owns the key (committed pending row). Raises 422 for a key reused with a
+    different request, 409 while another request holds it. A key older than
+    IDEMPOTENCY_TTL_HOURS counts as absent, whether or not it was purged yet.
+    """
+    for _ in range(3):
+        record = db.get(models.IdempotencyKey, key, populate_existing=True)
+        if record is not None and is_expired(record):
+            # Only the request that still sees this exact row deletes it; then claim afresh
+            db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.key == key,
+                models.IdempotencyKey.created_at == record.created_at
+            ).delete(synchronize_session=False)
+            db.commit()
+            continue
+        if record is not None:
+            if record.request_hash != request_hash:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request.")
+            if record.status_code is not None:
+                return record
+
+            started = datetime.fromisoformat(record.created_at)
+            if datetime.now() - started < timedelta(seconds=PENDING_TIMEOUT):
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.")
+            # Abandoned (crashed mid-request): take it over
+            record.created_at = datetime.now().isoformat()
+            db.commit()
+            return None
+
+        db.add(models.IdempotencyKey(
+            key=key,
+            route=route,
+            request_hash=request_hash,
+            created_at=datetime.now().isoformat()
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Claimed concurrently: look again
+            db.rollback()
+            continue
+        purge_expired(db)
+        return None
+
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.")
+
+
+def is_expired(record: models.IdempotencyKey) -> bool:
+    started = datetime.fromisoformat(record.created_at)
+    return datetime.now() - started >= timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+
+def complete(db: Session, key: str, status_code: int, body):
+    record = db.get(models.IdempotencyKey, key, populate_existing=True)
+    if record is None:
+        return
+    record.status_code = status_code
+    record.response = json.dumps(body, default=str)
+    db.commit()
+
+
+def release(db: Session, key: str):
+    db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.status_code.is_(None)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def purge_expired(db: Session, force: bool = False) -> int:
+    """
+    Deletes up to PURGE_BATCH_SIZE expired keys, at most once per
+    PURGE_INTERVAL per process (unless forced). Returns rows deleted.
+    """
+    global _next_purge
+    with _purge_lock:
+        if not force and time.monotonic() < _next_purge:
+            return 0
+        _next_purge = time.monotonic() + PURGE_INTERVAL
+
+    cutoff = (datetime.now() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)).isoformat()
+    expired = select(models.IdempotencyKey.key).where(
+        models.IdempotencyKey.created_at < cutoff
+    ).limit(PURGE_BATCH_SIZE)
+    deleted = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key.in_(expired)
+    ).delete(synchronize_session=False)
+    db.commit()
+    if deleted:
+        logger.info(f"Purged {deleted} expired idempotency keys")
+    return deleted
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal, current_route
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "20"))   # queued + running jobs accepted at once
+JOB_MAX_ATTEMPTS = 3                                        # restarts before a job is marked failed
+PROGRESS_INTERVAL = 0.5                                     # seconds between progress writes
+
+# kind -> handler(db, params, progress) -> JSON-serializable result
+JOB_HANDLERS = {}
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+def register(kind: str):
+    """Decorator: registers a long admin operation that can run as a background job."""
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def serialize(job: models.Job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "params": json.loads(job.params) if job.params else {},
+        "progress": {"done": job.progress_done or 0, "total": job.progress_total or 0},
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def submit(db: Session, kind: str, params: dict) -> models.Job:
+    if kind not in JOB_HANDLERS:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind '{kind}'. Options: {', '.join(JOB_HANDLERS)}")
+
+    pending = db.query(models.Job).filter(models.Job.status.in_(["queued", "running"])).count()
+    if pending >= JOB_QUEUE_LIMIT:
+        raise HTTPException(status_code=429, detail="Too many jobs in progress. Try again later.")
+
+    now_iso = datetime.now().isoformat()
+    job = models.Job(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        status="queued",
+        params=json.dumps(params or {}),
+        progress_done=0,
+        progress_total=0,
+        attempts=0,
+        created_at=now_iso,
+        updated_at=now_iso
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    _executor.submit(_run, job.id)
+    logger.info(f"Job {job.id} ({kind}) queued")
+    return job
+
+
+def resume_pending():
+    """
+    Re-queues jobs left 'queued' or 'running' by a previous process.
+    Called once at startup so jobs survive a restart.
+    """
+    db = SessionLocal()
+    try:
+        pending = db.query(models.Job).filter(models.Job.status.in_(["queued", "running"])).order_by(models.Job.created_at).all()
+        resumed = []
+        for job in pending:
+            # Compare-and-set against the row as read: another process resuming at the
+            # same time (or a worker that just claimed the job) makes this a no-op
+            if job.attempts >= JOB_MAX_ATTEMPTS:
+                changes = {"status": "failed", "error": "Gave up after repeated restarts"}
+            else:
+                changes = {"status": "queued"}
+            changes["updated_at"] = datetime.now().isoformat()
+            updated = db.query(models.Job).filter(
+                models.Job.id == job.id,
+                models.Job.status == job.status,
+                models.Job.updated_at == job.updated_at
+            ).update(changes, synchronize_session=False)
+            if updated and changes["status"] == "queued":
+                resumed.append(job.id)
+        db.commit()
+    finally:
+        db.close()
+
+    for job_id in resumed:
+        _executor.submit(_run, job_id)
+    if resumed:
+        logger.info(f"Resumed {len(resumed)} pending jobs")
+
+
+class Progress:
+    """
+    Progress callback handed to job handlers: progress(done, total).
+    Writes through its own session (throttled) so the handler's transaction
+    is never committed early.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, done: int, total: int):
+        now = time.monotonic()
+        if done < total and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        with self._lock:
+            self._last_write = now
+            _update(self.job_id, progress_done=done, progress_total=total)
+
+
+def _update(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        fields["updated_at"] = datetime.now().isoformat()
+        db.query(models.Job).filter(models.Job.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run(job_id: str):
+    db = SessionLocal()
+    try:
+        # Claim: only the worker whose UPDATE moves the job out of 'queued' runs it
+        claimed = db.query(models.Job).filter(
+            models.Job.id == job_id,
+            models.Job.status == "queued"
+        ).update({
+            "status": "running",
+            "attempts": func.coalesce(models.Job.attempts, 0) + 1,
+            "updated_at": datetime.now().isoformat()
+        }, synchronize_session=False)
+        db.commit()
+        if claimed != 1:
+            return
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        handler = JOB_HANDLERS.get(job.kind)
+        params = json.loads(job.params) if job.params else {}
+
+        if handler is None:
+            raise RuntimeError(f"No handler registered for job kind '{job.kind}'")
+
+        logger.info(f"Job {job_id} ({job.kind}) started")
+        current_route.set(f"JOB {job.kind}") # Worker threads run outside any request: tag queries by job kind
+        result = handler(db, params, Progress(job_id))
+        _update(job_id, status="succeeded", result=json.dumps(result, default=str))
+        logger.info(f"Job {job_id} finished")
+    except HTTPException as e:
+        db.rollback()
+        _update(job_id, status="failed", error=str(e.detail))
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        db.rollback()
+        _update(job_id, status="failed", error=str(e))
+    finally:
+        db.close()
@@ -1,10 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import JSONResponse, Response
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from starlette.routing import Match
+from typing import List, Optional
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
 
 import models, schemas
-from database import engine, get_db
+import scheduler
+import jobs
+import change_journal
+import booking
+import client_usage
+import idempotency
+import occupancy
+import outbox
+import waitlist
+from shift_index import shift_index
+from week_state import WeekState
+from database import engine, get_db, get_async_db, current_route, current_request_stats, query_metrics
 from auto_migrate import run_auto_migrations
 
 # Run simple migrations before creating tables (or after, depending on preference, but before app start)
@@ -46,6 +68,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Query Instrumentation ---
+# Tags every SQL statement with the matched route ("GET /users/{user_id}") so
+# GET /admin/metrics/queries can report per-endpoint totals.
+# QUERY_DEBUG_HEADER=1 adds X-Query-Count / X-Query-Time-Ms to every response.
+QUERY_DEBUG_HEADER = os.getenv("QUERY_DEBUG_HEADER") == "1"
+
+def route_template(scope) -> str:
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{scope['method']} {route.path}"
+    return f"{scope['method']} (unmatched)"
+
+@app.middleware("http")
+async def tag_queries_with_route(request: Request, call_next):
+    route = route_template(request.scope)
+    request_stats = {"count": 0, "total_ms": 0.0}
+    route_token = current_route.set(route)
+    stats_token = current_request_stats.set(request_stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_route.reset(route_token)
+        current_request_stats.reset(stats_token)
+
+    query_metrics.record_request(route)
+    if QUERY_DEBUG_HEADER:
+        response.headers["X-Query-Count"] = str(request_stats["count"])
+        response.headers["X-Query-Time-Ms"] = f"{request_stats['total_ms']:.2f}"
+    return response
+
 # --- Shared Seeding Logic ---
 def seed_data(db: Session):
     if db.query(models.User).count() > 0:
@@ -107,9 +160,32 @@ def startup_event():
     try:
         if db.query(models.User).count() == 0:
             seed_data(db)
+
+        # First start with the occupancy tables: fill them from existing appointments
+        if db.query(models.SlotOccupancy).first() is None and db.query(models.Appointment).first() is not None:
+            slots = occupancy.rebuild(db)
+            db.commit()
+            logger.info(f"Slot occupancy built for {slots} booked slots")
+
+        # Same for the per-client weekly counters
+        if db.query(models.ClientWeekUsage).first() is None and db.query(models.Appointment).first() is not None:
+            rows = client_usage.rebuild(db)
+            db.commit()
+            logger.info(f"Client week usage built: {rows} (client, week) rows")
     finally:
         db.close()
 
+    # Pick up background jobs interrupted by a restart
+    jobs.resume_pending()
+
+    # Start sending queued WhatsApp messages (OUTBOX_WORKERS=0: a separate process does it)
+    outbox.worker.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    outbox.worker.stop()
+    whatsapp_service.mock_log.flush()
+
 # ... (Existing Endpoints) ...
 
 @app.get("/test-seed")
@@ -118,13 +194,19 @@ def seed_db(force: bool = False, db: Session = Depends(get_db)):
         logger.info("--- FORCING DATABASE RESET ---")
         try:
             db.query(models.Appointment).delete()
+            db.query(models.SlotTrainerOccupancy).delete()
+            db.query(models.SlotOccupancy).delete()
+            db.query(models.ClientWeekUsage).delete()
+            db.query(models.WaitlistEntry).delete()
             db.query(models.Availability).delete()
             # Trainers and Clients are Users, but Trainer model links to User
             db.query(models.Trainer).delete() 
             db.query(models.ClientDefaultSlot).delete()
             db.query(models.Notification).delete()
+            db.query(models.OutboxMessage).delete()
             db.query(models.User).delete()
             db.commit()
+            shift_index.invalidate()
             logger.info("--- DATABASE WIPED ---")
         except Exception as e:
             logger.error(f"Error wiping DB: {e}")
@@ -134,8 +216,11 @@ def seed_db(force: bool = False, db: Session = Depends(get_db)):
 
 
 @app.post("/login", response_model=schemas.User)
-def login(creds: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == creds.email).first()
+async def login(creds: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.default_slots)).filter(models.User.email == creds.email)
+    )
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -188,15 +273,18 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
                 start_time=slot.start_time
             )
             db.add(db_slot)
+        change_journal.record_default_slots(db, db_user.id, user.default_slots)
         db.commit()
         db.refresh(db_user) # Refresh to load the relationship
 
     return db_user
 
 @app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    return users
+async def read_users(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.default_slots)).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 @app.get("/users/{user_id}", response_model=schemas.User)
 def read_user(user_id: int, db: Session = Depends(get_db)):
@@ -224,15 +312,26 @@ def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Dep
         db_user.phone_number = user_update.phone_number
     
     if user_update.weekly_workout_limit is not None:
+        if user_update.weekly_workout_limit != db_user.weekly_workout_limit:
+            change_journal.record_client(db, user_id)
         db_user.weekly_workout_limit = user_update.weekly_workout_limit
         
     if user_update.workout_credits is not None:
+        if user_update.workout_credits != db_user.workout_credits:
+            change_journal.record_client(db, user_id)
         db_user.workout_credits = user_update.workout_credits
 
     if user_update.profile_picture_url is not None:
         db_user.profile_picture_url = user_update.profile_picture_url
     
     if user_update.default_slots is not None:
+        # Journal removed + added slots (unchanged ones cancel out)
+        old_slots = {(s.day_of_week, s.start_time): s for s in db_user.default_slots}
+        new_slots = {(s.day_of_week, s.start_time): s for s in user_update.default_slots}
+        changed = [old_slots[k] for k in old_slots.keys() - new_slots.keys()] + \
+                  [new_slots[k] for k in new_slots.keys() - old_slots.keys()]
+        change_journal.record_default_slots(db, user_id, changed)
+
         # Delete existing slots
         db.query(models.ClientDefaultSlot).filter(models.ClientDefaultSlot.user_id == user_id).delete()
         
@@ -257,13 +356,24 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
 
     # 1. Clean up associated Trainer if exists
     trainer = db.query(models.Trainer).filter(models.Trainer.user_id == user_id).first()
+
+    # Slots whose occupancy changes (the user's bookings as client or trainer)
+    booking_filter = models.Appointment.client_id == user_id
+    if trainer:
+        booking_filter = or_(booking_filter, models.Appointment.trainer_id == trainer.id)
+    touched_slots = [row[0] for row in db.query(models.Appointment.start_time).filter(booking_filter).distinct().all()]
+    touched_clients = {user_id} | {row[0] for row in db.query(models.Appointment.client_id).filter(booking_filter).distinct().all()}
+
     if trainer:
         # Cascade delete trainer stuff
+        for av in trainer.availabilities:
+            change_journal.record_shift(db, trainer.id, av.day_of_week, av.start_time, av.end_time)
         db.query(models.Appointment).filter(models.Appointment.trainer_id == trainer.id).delete()
         db.query(models.Availability).filter(models.Availability.trainer_id == trainer.id).delete()
         db.delete(trainer)
 
-    # 2. Clean up Client Slots
+    # 2. Clean up Client Slots (their seats free up for others)
+    change_journal.record_default_slots(db, user_id, db_user.default_slots)
     db.query(models.ClientDefaultSlot).filter(models.ClientDefaultSlot.user_id == user_id).delete()
 
     # 3. Clean up Appointments (as Client)
@@ -271,9 +381,15 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     
     # 4. Clean up Notifications
     db.query(models.Notification).filter(models.Notification.user_id == user_id).delete()
+    db.query(models.WaitlistEntry).filter(models.WaitlistEntry.client_id == user_id).delete()
 
+    occupancy.refresh(db, touched_slots)
+    client_usage.refresh_clients(db, touched_clients)
+    change_journal.record_freed_slots(db, touched_slots)
     db.delete(db_user)
     db.commit()
+    if trainer:
+        shift_index.remove_trainer(trainer.id)
     return None
 
 # --- Trainer Endpoints ---
@@ -288,40 +404,45 @@ def create_trainer(trainer: schemas.TrainerCreate, db: Session = Depends(get_db)
     return db_trainer
 
 @app.get("/trainers/", response_model=List[schemas.Trainer])
-def read_trainers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    trainers = db.query(models.Trainer).offset(skip).limit(limit).all()
-    return trainers
+async def read_trainers(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(models.Trainer).options(selectinload(models.Trainer.availabilities)).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 @app.delete("/trainers/{trainer_id}")
 def delete_trainer(trainer_id: int, db: Session = Depends(get_db)):
+    return fire_trainer_internal(trainer_id, db)
+
+def fire_trainer_internal(trainer_id: int, db: Session, progress=None):
     trainer = db.query(models.Trainer).filter(models.Trainer.id == trainer_id).first()
     if trainer is None:
         raise HTTPException(status_code=404, detail="Trainer not found")
         
     # --- FIRE TRAINER LOGIC ---
     from datetime import datetime
-    now_iso = datetime.now().isoformat()
-    print(f"DEBUG: Firing Trainer {trainer_id} at {now_iso}")
+    now = datetime.now()
     
     # 1. Identify Future Appointments (for reporting and refunds)
-    # Debug Query
-    all_appts = db.query(models.Appointment).filter(models.Appointment.trainer_id == trainer_id).all()
-    print(f"DEBUG: Total Appts for Trainer: {len(all_appts)}")
-    for a in all_appts:
-        print(f"   Appt: {a.id} Time: {a.start_time} Status: {a.status}")
-
     future_appts = db.query(models.Appointment).filter(
         models.Appointment.trainer_id == trainer_id,
-        models.Appointment.start_time >= now_iso,
+        models.Appointment.start_time >= now,
         models.Appointment.status != 'cancelled'
     ).all()
-    print(f"DEBUG: Future Appts Found: {len(future_appts)}")
+    logger.info(f"Firing trainer {trainer_id}: {len(future_appts)} future appointments to refund")
     
     affected_clients_report = []
     
-    # 2. Process Refunds & Notifications
-    for appt in future_appts:
-        client = db.query(models.User).filter(models.User.id == appt.client_id).first()
+    # 2. Process Refunds & Notifications (clients loaded in one query)
+    client_ids = {appt.client_id for appt in future_appts if appt.client_id}
+    clients_by_id = {
+        c.id: c for c in db.query(models.User).filter(models.User.id.in_(client_ids)).all()
+    } if client_ids else {}
+
+    for i, appt in enumerate(future_appts):
+        if progress:
+            progress(i, len(future_appts))
+        client = clients_by_id.get(appt.client_id)
         if client:
             client.workout_credits += 1
             # Add to report
@@ -349,11 +470,28 @@ def delete_trainer(trainer_id: int, db: Session = Depends(get_db)):
             db.delete(user)
     
     # Delete appointments and availabilities
+    for av in trainer.availabilities:
+        change_journal.record_shift(db, trainer_id, av.day_of_week, av.start_time, av.end_time)
+    touched_slots = [row[0] for row in db.query(models.Appointment.start_time).filter(
+        models.Appointment.trainer_id == trainer_id
+    ).distinct().all()]
+    touched_clients = [row[0] for row in db.query(models.Appointment.client_id).filter(
+        models.Appointment.trainer_id == trainer_id
+    ).distinct().all()]
     db.query(models.Appointment).filter(models.Appointment.trainer_id == trainer_id).delete()
     db.query(models.Availability).filter(models.Availability.trainer_id == trainer_id).delete()
+    occupancy.refresh(db, touched_slots)
+    client_usage.refresh_clients(db, touched_clients)
+    # Freed seats + refunded clients: the next incremental run re-plans them
+    change_journal.record_freed_slots(db, touched_slots)
+    for client_id in clients_by_id:
+        change_journal.record_client(db, client_id)
     
     db.delete(trainer)
     db.commit()
+    shift_index.remove_trainer(trainer_id)
+    if progress:
+        progress(len(future_appts), len(future_appts))
     
     return {
         "message": "Trainer fired successfully",
@@ -399,8 +537,11 @@ def add_full_week_availability(trainer_id: int, start_time: str = "09:00", end_t
         )
         db.add(slot)
         new_slots.append(slot)
+        change_journal.record_shift(db, trainer_id, day, start_time, end_time)
     
     db.commit()
+    for slot in new_slots:
+        shift_index.add(slot)
     return {"message": "Added full week availability", "slots_count": len(new_slots)}
 
 @app.post("/trainers/{trainer_id}/availability/", response_model=schemas.Availability)
@@ -435,12 +576,15 @@ def create_availability(trainer_id: int, availability: schemas.AvailabilityBase,
         raise HTTPException(status_code=400, detail="You already have this shift scheduled.")
 
     # 3. Validate Shift Capacity (Max 3 Trainers Per Shift)
-    # Check overlapping availabilities for this day
-    overlapping_trainers_count = db.query(models.Availability.trainer_id).filter(
+    # Check overlapping availabilities for this day. Read from the DB, not the
+    # process-local shift index: another worker may have added a shift since.
+    overlapping_trainers_count = db.query(func.count(func.distinct(models.Availability.trainer_id))).join(
+        models.Trainer, models.Trainer.id == models.Availability.trainer_id
+    ).filter(
         models.Availability.day_of_week == availability.day_of_week,
         models.Availability.start_time < availability.end_time,
         models.Availability.end_time > availability.start_time
-    ).distinct().count()
+    ).scalar()
 
     # Note: If this trainer is already scheduling for this slot (update scenario), 
     # we might self-count. But this is create endpoint (POST), so usually new.
@@ -469,8 +613,10 @@ def create_availability(trainer_id: int, availability: schemas.AvailabilityBase,
 
     db_availability = models.Availability(**availability.dict(), trainer_id=trainer_id)
     db.add(db_availability)
+    change_journal.record_shift(db, trainer_id, availability.day_of_week, availability.start_time, availability.end_time)
     db.commit()
     db.refresh(db_availability)
+    shift_index.add(db_availability)
     return db_availability
 
 @app.delete("/availability/{availability_id}", status_code=204)
@@ -479,180 +625,243 @@ def delete_availability(availability_id: int, db: Session = Depends(get_db)):
     if db_availability is None:
         raise HTTPException(status_code=404, detail="Availability not found")
     
+    change_journal.record_shift(
+        db, db_availability.trainer_id, db_availability.day_of_week,
+        db_availability.start_time, db_availability.end_time
+    )
     db.delete(db_availability)
     db.commit()
+    shift_index.remove(db_availability)
     return None
 
-# --- Appointment Endpoints ---
-
-@app.post("/appointments/", response_model=schemas.Appointment)
-def create_appointment(appointment: schemas.AppointmentCreate, db: Session = Depends(get_db)):
-    # 1. Duplicate Booking Check: User cannot book the same slot twice
-    # (Checking by email which is our current unique identifier mostly)
-    existing_appointment = db.query(models.Appointment).filter(
-        models.Appointment.client_email == appointment.client_email,
-        models.Appointment.start_time == appointment.start_time,
-        models.Appointment.status != "cancelled"
-    ).first()
-
-    if existing_appointment:
-        raise HTTPException(status_code=400, detail="You already have a booking at this time.")
-
-    # 2. Gym Capacity: Max 6 appointments total per slot
-    global_count = db.query(models.Appointment).filter(
-        models.Appointment.start_time == appointment.start_time,
-        models.Appointment.status != "cancelled"
-    ).count()
-    
-    if global_count >= 6:
-         raise HTTPException(status_code=400, detail="Gym capacity reached for this time slot (Max 6 clients).")
-
-    # 3. Trainer Capacity: Max 3 unique trainers per slot AND Max 2 clients per trainer
-    # Check if this trainer is already working
-    trainer_appointments = db.query(models.Appointment).filter(
-        models.Appointment.trainer_id == appointment.trainer_id,
-        models.Appointment.start_time == appointment.start_time,
-        models.Appointment.status != "cancelled"
-    )
-    trainer_client_count = trainer_appointments.count()
-
-    # Rule: Max 2 clients per trainer
-    if trainer_client_count >= 2:
-        raise HTTPException(status_code=400, detail="Trainer is fully booked for this time slot (Max 2 clients).")
-
-    if trainer_client_count == 0:
-        # If trainer is not yet working, check if adding them exceeds 3 trainers limit (Global Shift Limit)
-        active_trainers_count = db.query(models.Appointment.trainer_id).filter(
-            models.Appointment.start_time == appointment.start_time,
-            models.Appointment.status != "cancelled"
-        ).distinct().count()
+@app.post("/admin/shift-index/rebuild")
+def rebuild_shift_index(db: Session = Depends(get_db)):
+    # For scripts that write availabilities directly to the DB
+    shift_index.load(db)
+    return {"message": "Shift index rebuilt"}
 
-        if active_trainers_count >= 3:
-            raise HTTPException(status_code=400, detail="Shift capacity reached (Max 3 trainers per shift).")
+@app.post("/admin/occupancy/rebuild")
+def rebuild_occupancy(db: Session = Depends(get_db)):
+    # For scripts that write appointments directly to the DB
+    slots = occupancy.rebuild(db)
+    db.commit()
+    return {"message": "Slot occupancy rebuilt", "booked_slots": slots}
+
+@app.get("/admin/client-usage/audit", response_model=dict)
+def audit_client_usage(db: Session = Depends(get_db)):
+    # Weekly counters that disagree with appointments (fix with the rebuild below)
+    mismatches = client_usage.audit(db)
+    return {"mismatch_count": len(mismatches), "mismatches": mismatches[:100]}
+
+@app.post("/admin/client-usage/rebuild")
+def rebuild_client_usage(db: Session = Depends(get_db)):
+    # For scripts that write appointments directly to the DB
+    rows = client_usage.rebuild(db)
+    db.commit()
+    return {"message": "Client week usage rebuilt", "rows": rows}
+
+@app.get("/admin/outbox", response_model=dict)
+def read_outbox(db: Session = Depends(get_db)):
+    # Messages per status + the dead letters (failed OUTBOX_MAX_ATTEMPTS times) + Twilio send counters
+    dead = db.query(models.OutboxMessage).filter(
+        models.OutboxMessage.status == outbox.DEAD
+    ).order_by(models.OutboxMessage.id.desc()).limit(100).all()
+    return {
+        "counts": outbox.stats(db),
+        "sender": whatsapp_service.sender.stats(),
+        "dead": [
+            {"id": m.id, "to_number": m.to_number, "attempts": m.attempts, "last_error": m.last_error, "created_at": m.created_at}
+            for m in dead
+        ]
+    }
 
+@app.post("/admin/outbox/{message_id}/retry")
+def retry_outbox_message(message_id: int, db: Session = Depends(get_db)):
+    if not outbox.requeue(db, message_id):
+        raise HTTPException(status_code=404, detail="No dead outbox message with this id")
+    return {"message": "Message queued again"}
 
-    # 4. Weekly Workout Limit
-    from datetime import datetime, timedelta
-    
-    # Parse appointment date
-    try:
-        appt_date = datetime.fromisoformat(appointment.start_time)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format")
+@app.get("/admin/whatsapp/recent", response_model=dict)
+def read_recent_whatsapp(limit: int = 50, to: Optional[str] = None):
+    # Mock mode only: last messages from the in-memory ring buffer (whatsapp_mock.log has the rest)
+    log = whatsapp_service.mock_log
+    return {
+        "messages": log.recent(limit=max(limit, 0) or None, to_number=to),
+        "buffered": len(log.recent()),
+        "dropped_from_file": log.dropped
+    }
 
-    # Calculate start and end of the week (Monday to Sunday)
-    start_of_week = appt_date - timedelta(days=appt_date.weekday())
-    start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_of_week = start_of_week + timedelta(days=7)
+@app.get("/admin/metrics/queries", response_model=List[dict])
+def read_query_metrics():
+    # Per-route query counts, total SQL time and slowest statements since startup (or last reset)
+    return query_metrics.snapshot()
 
-    today = datetime.now().date()
-    # 0. Validate Date (Cannot book past) - Good practice to add here
-    if appt_date.date() < today:
-        raise HTTPException(status_code=400, detail="Cannot book appointments in the past.")
+@app.delete("/admin/metrics/queries", status_code=204)
+def reset_query_metrics():
+    query_metrics.reset()
+    return None
 
-    # Get user to check limit and restrictions
-    client_user = db.query(models.User).filter(models.User.email == appointment.client_email).first()
-    
-    if not client_user:
-        # Fallback or create? For now assume user exists if using the UI
-        user_limit = 3 # Default fallback
-    else:
-        user_limit = client_user.weekly_workout_limit
+# --- Appointment Endpoints ---
 
-        # --- NEW RESTRICTION: Clients Limited to Morning (7-12) and Evening (15-20) ---
-        if client_user.role == "client":
-            # Extract time part from ISO string "YYYY-MM-DDTHH:MM:SS"
-            try:
-                hour = int(appointment.start_time.split("T")[1].split(":")[0])
-                
-                is_morning = 7 <= hour <= 12
-                is_evening = 15 <= hour <= 20
-                
-                if not (is_morning or is_evening):
-                    raise HTTPException(
-                        status_code=400, 
-                        detail="Clients can only book between 07:00-12:00 or 15:00-20:00."
-                    )
-            except (IndexError, ValueError):
-                raise HTTPException(status_code=400, detail="Invalid time format.")
-
-
-    # Count user's appointments in this week
-    weekly_count = db.query(models.Appointment).filter(
-        models.Appointment.client_email == appointment.client_email,
-        models.Appointment.status != "cancelled",
-        models.Appointment.start_time >= start_of_week.isoformat(),
-        models.Appointment.start_time < end_of_week.isoformat()
-    ).count()
-
-    if weekly_count >= user_limit:
-        raise HTTPException(status_code=400, detail=f"Weekly workout limit reached ({user_limit} sessions/week).")
-
-    # 5. Check Workout Credits
-    if client_user:
-        if client_user.workout_credits <= 0:
-            raise HTTPException(status_code=400, detail="You have 0 workout credits remaining. Resupply via admin.")
-        
-        # Decrement credits
-        client_user.workout_credits -= 1
-        db.add(client_user) # Update user record
+@app.post("/appointments/", response_model=schemas.Appointment)
+async def create_appointment(
+    appointment: schemas.AppointmentCreate,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    # Capacity, weekly limit and credit checks + insert run atomically under the slot lock.
+    # A retry with the same Idempotency-Key gets the first response back without booking again.
+    # The WhatsApp confirmation is an outbox row in the same transaction, sent by the outbox workers.
+    async def book():
+        db_appointment = await booking.create_booking_async(db, appointment)
+        return schemas.Appointment.model_validate(db_appointment).model_dump()
+
+    return await idempotency.run_async(db, idempotency_key, "POST /appointments/", appointment.model_dump(), book)
+
+@app.post("/appointments/batch", response_model=dict)
+def create_appointments_batch(
+    batch: schemas.AppointmentBatch,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    # Checks every booking against one snapshot of the slots / clients involved and
+    # commits the accepted ones together. Failed items don't block the others.
+    return idempotency.run(
+        db, idempotency_key, "POST /appointments/batch", batch.model_dump(),
+        lambda: create_appointments_batch_internal(batch, db)
+    )
 
-    db_appointment = models.Appointment(**appointment.dict())
-    
-    # Ensure client_id is set if we found the user
-    if client_user and not db_appointment.client_id:
-        db_appointment.client_id = client_user.id
+def create_appointments_batch_internal(batch: schemas.AppointmentBatch, db: Session):
+    if not batch.appointments:
+        raise HTTPException(status_code=400, detail="No appointments to book.")
+    if len(batch.appointments) > booking.MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {booking.MAX_BATCH_SIZE} appointments per batch.")
 
-    db.add(db_appointment)
-    db.commit()
-    db.refresh(db_appointment)
+    results = booking.create_batch(db, batch.appointments)
 
-    # --- WhatsApp Notification ---
-    try:
-        # Lazy load trainer to get name
-        trainer_name = db_appointment.trainer.name if db_appointment.trainer else "Gym Trainer"
-        
-        # Parse connection string to get nice date/time
-        # start_time is ISO string
-        import whatsapp_service
-        
-        # Parsing ISO format safely
-        dt_str = db_appointment.start_time
-        # Example: 2023-10-27T10:00:00
-        date_part = dt_str.split("T")[0]
-        time_part = dt_str.split("T")[1][:5] # HH:MM
-        
-        whatsapp_service.notify_appointment_created(
-            client_name=db_appointment.client_name or "Client",
-            date=date_part,
-            time=time_part,
-            trainer_name=trainer_name
-        )
-    except Exception as e:
-        logger.error(f"Notification Error: {e}")
-        # Don't fail the request just because notification failed
+    report = []
+    for index, (db_appointment, detail) in enumerate(results):
+        report.append({
+            "index": index,
+            "success": db_appointment is not None,
+            "appointment": schemas.Appointment.model_validate(db_appointment).model_dump() if db_appointment else None,
+            "detail": detail
+        })
 
-    return db_appointment
+    created = sum(1 for r in report if r["success"])
+    return {"created_count": created, "failed_count": len(report) - created, "results": report}
 
 @app.put("/appointments/{appointment_id}/cancel", response_model=schemas.Appointment)
-def cancel_appointment(appointment_id: int, db: Session = Depends(get_db)):
+def cancel_appointment(
+    appointment_id: int,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    def cancel():
+        appointment = booking.run_with_retries(db, lambda: cancel_appointment_internal(db, appointment_id), f"cancel {appointment_id}")
+        db.refresh(appointment)
+        return schemas.Appointment.model_validate(appointment).model_dump()
+
+    return idempotency.run(db, idempotency_key, f"PUT /appointments/{appointment_id}/cancel", None, cancel)
+
+def cancel_appointment_internal(db: Session, appointment_id: int):
     appointment = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
-    
+
+    # Serialize with bookings / promotions / other cancellations of the slot, then re-read:
+    # a concurrent cancel may have won, and an already cancelled appointment is never refunded twice
+    occupancy.lock(db, appointment.start_time)
+    db.refresh(appointment)
+    if appointment.status == "cancelled":
+        return appointment
+
+    occupancy.add(db, appointment.start_time, appointment.trainer_id, -1)
+    client_usage.add(db, appointment.client_id, appointment.start_time, -1)
     appointment.status = "cancelled"
+    # The freed seat and the refunded client are re-planned by the next incremental run
+    change_journal.record_freed_slots(db, [appointment.start_time])
+    if appointment.client_id:
+        change_journal.record_client(db, appointment.client_id)
     
     # Refund Credit
     if appointment.client_email:
-         client_user = db.query(models.User).filter(models.User.email == appointment.client_email).first()
+         client_user = db.query(models.User).filter(models.User.email == appointment.client_email).with_for_update().first()
          if client_user:
              client_user.workout_credits += 1
              db.add(client_user)
 
-    db.commit()
-    db.refresh(appointment)
+    # Hand the freed seat to the slot's waitlist (same transaction)
+    db.flush()
+    waitlist.promote(db, appointment.start_time, appointment.trainer_id)
     return appointment
 
+@app.post("/appointments/waitlist", response_model=schemas.WaitlistEntry)
+def join_waitlist(request: schemas.WaitlistJoin, db: Session = Depends(get_db)):
+    # For full slots: the client is booked automatically (FIFO) when someone cancels.
+    client = db.query(models.User).filter(models.User.email == request.client_email).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+
+    try:
+        slot_dt = datetime.fromisoformat(request.start_time).replace(tzinfo=None)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    if slot_dt < datetime.now():
+        raise HTTPException(status_code=400, detail="Cannot join the waitlist of a past slot.")
+    start_time = slot_dt.isoformat() # Same key as bookings of the slot (booking.canonical)
+    booking.check_client(client, start_time) # Client hours: outside them the slot can never be booked
+
+    already_booked = db.query(models.Appointment.id).filter(
+        models.Appointment.client_id == client.id,
+        models.Appointment.start_time == slot_dt,
+        models.Appointment.status != "cancelled"
+    ).first()
+    if already_booked:
+        raise HTTPException(status_code=400, detail="You already have a booking at this time.")
+    if waitlist.find_waiting(db, client.id, start_time):
+        raise HTTPException(status_code=400, detail="You are already on the waitlist for this time.")
+
+    week_start = (slot_dt - timedelta(days=slot_dt.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    state = WeekState.load(db, week_start)
+    row = state.row(start_time, slot_dt.weekday(), slot_dt.strftime("%H:%M"))
+    if not state.on_shift[row].any():
+        raise HTTPException(status_code=400, detail="No trainer is on shift at this time.")
+    if state.seats_left([row])[0] > 0:
+        raise HTTPException(status_code=400, detail="This slot still has free seats, book it directly.")
+
+    entry = waitlist.join(db, client, start_time)
+    db.commit()
+    db.refresh(entry)
+    entry.position = waitlist.position(db, entry)
+    return entry
+
+@app.get("/appointments/waitlist", response_model=List[schemas.WaitlistEntry])
+def read_waitlist(start_time: str = None, client_id: int = None, db: Session = Depends(get_db)):
+    # Waiting entries in queue order, optionally for one slot / one client
+    query = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.status == waitlist.WAITING)
+    if start_time:
+        query = query.filter(models.WaitlistEntry.start_time == start_time)
+    if client_id:
+        query = query.filter(models.WaitlistEntry.client_id == client_id)
+    entries = query.order_by(models.WaitlistEntry.start_time, models.WaitlistEntry.id).all()
+
+    place = {}
+    for entry in entries:
+        place[entry.start_time] = place.get(entry.start_time, 0) + 1
+        entry.position = place[entry.start_time] if not client_id else waitlist.position(db, entry)
+    return entries
+
+@app.delete("/appointments/waitlist/{entry_id}", status_code=204)
+def leave_waitlist(entry_id: int, db: Session = Depends(get_db)):
+    entry = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.id == entry_id).first()
+    if not entry:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    if entry.status == waitlist.WAITING:
+        entry.status = waitlist.LEFT
+        db.commit()
+    return None
+
 @app.delete("/appointments/week/{week_start_date}", response_model=dict)
 def clear_week_appointments(week_start_date: str, db: Session = Depends(get_db)):
     from datetime import datetime, timedelta
@@ -667,16 +876,23 @@ def clear_week_appointments(week_start_date: str, db: Session = Depends(get_db))
     logger.info(f"Range: {start_date} to {end_date}")
     
     result = db.query(models.Appointment).filter(
-        models.Appointment.start_time >= start_date.isoformat(),
-        models.Appointment.start_time < end_date.isoformat()
+        models.Appointment.start_time >= start_date,
+        models.Appointment.start_time < end_date
     ).delete(synchronize_session=False)
     
     logger.info(f"Deleted {result} appointments.")
+    occupancy.refresh_range(db, start_date.isoformat(), end_date.isoformat())
+    client_usage.refresh_range(db, start_date.isoformat(), end_date.isoformat())
+    # Nothing of the week's plan is left: its next auto-schedule is a full run
+    change_journal.reset_runs(db, start_date, end_date)
     db.commit()
     return {"message": "Week cleared", "deleted_count": result}
 
 @app.post("/appointments/auto-schedule", response_model=dict)
 def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
+    return auto_schedule_internal(payload, db)
+
+def auto_schedule_internal(payload: dict, db: Session, progress=None):
     # Payload: { "week_start_date": "YYYY-MM-DD" }
     from datetime import datetime, timedelta
     
@@ -690,6 +906,24 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
     except (ValueError, TypeError):
         raise HTTPException(status_code=400, detail="Invalid week_start_date format. properly.")
 
+    # Ledger mode (default): load the week once, decide in memory, write in one transaction.
+    # "legacy" keeps the original query-per-check loop.
+    # "dry_run": true plans the week in memory and returns the proposal without writing.
+    # "incremental" re-plans only clients touched by the change journal since the last run.
+    # "trainer_selection": "load" (default) fills active trainers first; "lowest_id" is the original pick.
+    mode = payload.get("mode", "ledger")
+    if mode in ("ledger", "incremental"):
+        solver = payload.get("solver", "greedy")
+        if solver not in scheduler.SOLVERS:
+            raise HTTPException(status_code=400, detail=f"Unknown solver '{solver}'. Options: {', '.join(scheduler.SOLVERS)}")
+        trainer_selection = payload.get("trainer_selection", "load")
+        if trainer_selection not in scheduler.TRAINER_SELECTIONS:
+            raise HTTPException(status_code=400, detail=f"Unknown trainer_selection '{trainer_selection}'. Options: {', '.join(scheduler.TRAINER_SELECTIONS)}")
+        dry_run = bool(payload.get("dry_run", False))
+        if mode == "incremental":
+            return auto_schedule_incremental(db, week_start, solver, dry_run=dry_run, progress=progress, trainer_selection=trainer_selection)
+        return auto_schedule_ledger(db, week_start, solver, dry_run=dry_run, progress=progress, trainer_selection=trainer_selection)
+
     # 1. Get all clients with default slots
     clients = db.query(models.User).filter(models.User.role == "client").all()
     
@@ -699,16 +933,8 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
             
         # 1.1 Check Weekly Limit (Count existing bookings for this week first)
         # We need to know how many appts they ALREADY have in this week to enforce limit.
-        # Week range: week_start to week_start + 7 days
-        week_end = week_start + timedelta(days=7)
-        current_week_bookings = db.query(models.Appointment).filter(
-            models.Appointment.client_id == client.id,
-            models.Appointment.start_time >= week_start.isoformat(),
-            models.Appointment.start_time < week_end.isoformat(),
-            models.Appointment.status != 'cancelled'
-        ).count()
-        
-        bookings_this_week = current_week_bookings
+        # Weekly counter row of the client (weeks start Monday, like week_start)
+        bookings_this_week = client_usage.count(db, client.id, week_start)
 
         for slot in client.default_slots:
             # Check Limits BEFORE trying to book
@@ -736,11 +962,12 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
             
             target_date = week_start + timedelta(days=slot.day_of_week)   
             appointment_time_iso = f"{target_date.strftime('%Y-%m-%d')}T{slot.start_time}:00"
+            appointment_time = datetime.fromisoformat(appointment_time_iso)
             
             # Check if already booked
             existing = db.query(models.Appointment).filter(
                 models.Appointment.client_email == client.email,
-                models.Appointment.start_time == appointment_time_iso,
+                models.Appointment.start_time == appointment_time,
                 models.Appointment.status != 'cancelled'
             ).first()
             
@@ -751,7 +978,7 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
             
             # 1. Gym Capacity (Global: Max 3 trainers working simultaneously)
             active_trainers_count = db.query(models.Appointment.trainer_id).filter(
-                models.Appointment.start_time == appointment_time_iso,
+                models.Appointment.start_time == appointment_time,
                 models.Appointment.status != "cancelled"
             ).distinct().count()
             
@@ -769,27 +996,15 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
             
             available_trainers = []
             
-            # Get all trainers
-            all_trainers = db.query(models.Trainer).all()
-
-            for trainer in all_trainers:
-                # A. Check Shift Availability
-                is_working = False
-                for av in trainer.availabilities:
-                    if av.day_of_week == slot.day_of_week:
-                        # Check start time match
-                        if av.start_time <= slot.start_time and av.end_time > slot.start_time:
-                            is_working = True
-                            break
-                            
-                if not is_working:
-                    # with open("debug_auto_schedule.txt", "a") as f: f.write(f"[DEBUG] Trainer {trainer.id} not working/avail\n")
-                    continue
+            # A. Trainers on shift at this slot (shift index lookup)
+            shift_index.ensure_loaded(db)
+            working_trainer_ids = shift_index.trainers_at(slot.day_of_week, slot.start_time)
 
+            for trainer_id in working_trainer_ids:
                 # B. Check Capacity (Max 2 clients)
                 current_clients = db.query(models.Appointment).filter(
-                    models.Appointment.trainer_id == trainer.id,
-                    models.Appointment.start_time == appointment_time_iso,
+                    models.Appointment.trainer_id == trainer_id,
+                    models.Appointment.start_time == appointment_time,
                     models.Appointment.status != "cancelled"
                 ).count()
                 
@@ -807,7 +1022,7 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
 
                      continue
                     
-                available_trainers.append(trainer)
+                available_trainers.append(trainer_id)
             
 
             
@@ -832,11 +1047,11 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
                  continue
                  
             # Assign first available (Logic could be smarter, e.g., round robin)
-            selected_trainer = available_trainers[0]
+            selected_trainer_id = available_trainers[0]
             
             # Create Appointment
             new_appt = models.Appointment(
-                trainer_id=selected_trainer.id,
+                trainer_id=selected_trainer_id,
                 client_id=client.id,
                 client_name=client.email.split('@')[0], # Fallback name
                 client_email=client.email,
@@ -844,6 +1059,8 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
                 status="confirmed"
             )
             db.add(new_appt)
+            occupancy.add(db, appointment_time_iso, selected_trainer_id, 1)
+            client_usage.add(db, client.id, appointment_time_iso, 1)
             
             # Update State
             client.workout_credits -= 1
@@ -880,13 +1097,7 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
         if email not in temp_fail_map: continue
         
         # Check current status
-        week_end_date = week_start + timedelta(days=7)
-        final_count = db.query(models.Appointment).filter(
-            models.Appointment.client_id == client.id,
-            models.Appointment.start_time >= week_start.isoformat(),
-            models.Appointment.start_time < week_end_date.isoformat(),
-            models.Appointment.status != 'cancelled'
-        ).count()
+        final_count = client_usage.count(db, client.id, week_start)
         
         if final_count < client.weekly_workout_limit:
             # All failures for this client are critical (contributed to missing goal)
@@ -915,19 +1126,94 @@ def auto_schedule_week(payload: dict, db: Session = Depends(get_db)):
         "total_failures": len(failed_assignments)
     }
 
+@app.post("/appointments/auto-schedule/range", response_model=dict)
+def auto_schedule_range(payload: dict, db: Session = Depends(get_db)):
+    return auto_schedule_range_internal(payload, db)
+
+def auto_schedule_range_internal(payload: dict, db: Session, progress=None):
+    # Payload: { "week_start_date": "YYYY-MM-DD", "weeks": 4, "solver": "greedy", "trainer_selection": "load", "dry_run": false }
+    # Loads clients, shifts and the whole range of appointments once; credits carry forward.
+    from datetime import datetime, timedelta
+
+    try:
+        week_start = datetime.fromisoformat(payload.get("week_start_date"))
+        week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid week_start_date format.")
+
+    try:
+        weeks = int(payload.get("weeks", 4))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="weeks must be an integer.")
+    if not 1 <= weeks <= 12:
+        raise HTTPException(status_code=400, detail="weeks must be between 1 and 12.")
+
+    solver = payload.get("solver", "greedy")
+    if solver not in scheduler.SOLVERS:
+        raise HTTPException(status_code=400, detail=f"Unknown solver '{solver}'. Options: {', '.join(scheduler.SOLVERS)}")
+    solve, needs_repair = scheduler.SOLVERS[solver]
+
+    trainer_selection = payload.get("trainer_selection", "load")
+    if trainer_selection not in scheduler.TRAINER_SELECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown trainer_selection '{trainer_selection}'. Options: {', '.join(scheduler.TRAINER_SELECTIONS)}")
+
+    dry_run = bool(payload.get("dry_run", False))
+    timings = {}
+
+    total_steps = weeks + 2 # load, each week, write
+    journal_id = change_journal.latest_change_id(db)
+    phase_start = time.perf_counter()
+    ledgers = scheduler.WeekLedger.load_range(db, week_start, weeks)
+    timings["load_ms"] = round((time.perf_counter() - phase_start) * 1000, 2)
+    if progress:
+        progress(1, total_steps)
+
+    week_reports = []
+    for i, ledger in enumerate(ledgers):
+        ledger.trainer_selection = trainer_selection
+        report = plan_week(ledger, solve, needs_repair, timings)
+        report["week_start_date"] = ledger.week_start.strftime("%Y-%m-%d")
+        if dry_run:
+            report["proposed"] = scheduler.proposed_changes(ledger)
+        week_reports.append(report)
+        if progress:
+            progress(i + 2, total_steps)
+
+    if not dry_run:
+        phase_start = time.perf_counter()
+    report = {
+        "weeks": week_reports,
+        "success_count": sum(r["success_count"] for r in week_reports),
+        "total_failures": sum(r["total_failures"] for r in week_reports),
+        "dry_run": dry_run,
+        "timings_ms": timings
+    }
+
+    if not dry_run:
+        phase_start = time.perf_counter()
+        for ledger in ledgers:
+            change_journal.mark_run(db, ledger.week_start, journal_id)
+        report_write_conflicts(report, scheduler.write_ledgers(db, ledgers))
+        timings["write_ms"] = round((time.perf_counter() - phase_start) * 1000, 2)
+    if progress:
+        progress(total_steps, total_steps)
+    return report
+
 @app.get("/users/{user_id}/notifications", response_model=List[schemas.Notification])
-def read_notifications(user_id: int, db: Session = Depends(get_db)):
-    return db.query(models.Notification).filter(models.Notification.user_id == user_id).order_by(models.Notification.created_at.desc()).all()
+async def read_notifications(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(models.Notification).filter(models.Notification.user_id == user_id).order_by(models.Notification.created_at.desc(), models.Notification.id.desc())
+    )
+    return result.scalars().all()
 
 @app.put("/notifications/{notification_id}/read", response_model=schemas.Notification)
-def mark_notification_read(notification_id: int, db: Session = Depends(get_db)):
-    notif = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
+async def mark_notification_read(notification_id: int, db: AsyncSession = Depends(get_async_db)):
+    notif = await db.get(models.Notification, notification_id)
     if not notif:
          raise HTTPException(status_code=404, detail="Notification not found")
     
     notif.is_read = True
-    db.commit()
-    db.refresh(notif)
+    await db.commit()
     return notif
 
 # --- System Settings Endpoints ---
@@ -954,9 +1240,11 @@ def update_system_week(payload: schemas.SystemWeekUpdate, db: Session = Depends(
     return {"message": "System week updated", "date": payload.date}
 
 @app.get("/appointments/", response_model=List[schemas.Appointment])
-def read_appointments(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    appointments = db.query(models.Appointment).order_by(models.Appointment.start_time.asc()).offset(skip).limit(limit).all()
-    return appointments
+async def read_appointments(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(models.Appointment).order_by(models.Appointment.start_time.asc()).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 # Endpoint replaced by shared logic above
 # Force Reload
@@ -981,156 +1269,286 @@ def send_admin_message(request: schemas.AdminMessageRequest, db: Session = Depen
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
         
-    success = whatsapp_service.send_whatsapp_message(
-        to_number=os.getenv("TEST_WHATSAPP_TARGET", "+15550000000"),
-        body_text=full_message
-    )
-    
-    if success:
-        return {"message": "WhatsApp sent successfully"}
+    # 3. Queue the WhatsApp with the notification; the outbox workers send it
+    outbox.enqueue(db, whatsapp_service.default_target(), full_message)
+    db.commit()
+    return {"message": "WhatsApp queued"}
+
+
+def auto_schedule_ledger(db: Session, week_start: datetime, solver: str = "greedy", dry_run: bool = False, progress=None, trainer_selection: str = "load"):
+    solve, needs_repair = scheduler.SOLVERS[solver]
+    timings = {}
+    journal_id = change_journal.latest_change_id(db)
+
+    phase_start = time.perf_counter()
+    ledger = scheduler.WeekLedger.load(db, week_start)
+    ledger.trainer_selection = trainer_selection
+    timings["load_ms"] = round((time.perf_counter() - phase_start) * 1000, 2)
+    if progress:
+        progress(1, 3)
+
+    report = plan_week(ledger, solve, needs_repair, timings)
+    if progress:
+        progress(2, 3)
+
+    if dry_run:
+        report["dry_run"] = True
+        report["proposed"] = scheduler.proposed_changes(ledger)
+    else:
+        phase_start = time.perf_counter()
+        change_journal.mark_run(db, week_start, journal_id)
+        report_write_conflicts(report, ledger.write(db))
+        timings["write_ms"] = round((time.perf_counter() - phase_start) * 1000, 2)
+
+    report["timings_ms"] = timings
+    if progress:
+        progress(3, 3)
+    return report
+
+
+def auto_schedule_incremental(db: Session, week_start: datetime, solver: str = "greedy", dry_run: bool = False, progress=None, trainer_selection: str = "load"):
+    """
+    Re-plans only what changed since the last successful run of this week:
+    clients touched by the change journal and clients whose default slots
+    fall on a changed slot or trainer shift. Falls back to a full ledger run
+    when the week has never been planned.
+    """
+    run = change_journal.last_run(db, week_start)
+    if run is None:
+        report = auto_schedule_ledger(db, week_start, solver, dry_run=dry_run, progress=progress, trainer_selection=trainer_selection)
+        report["incremental"] = {"full_run": True}
+        return report
+
+    solve, needs_repair = scheduler.SOLVERS[solver]
+    timings = {}
+
+    phase_start = time.perf_counter()
+    journal_id = change_journal.latest_change_id(db)
+    changes = change_journal.changes_since(db, run.last_change_id, journal_id)
+    client_ids = change_journal.affected_clients(db, changes)
+    ledger = scheduler.WeekLedger.load_clients(db, week_start, client_ids)
+    ledger.trainer_selection = trainer_selection
+    timings["load_ms"] = round((time.perf_counter() - phase_start) * 1000, 2)
+    if progress:
+        progress(1, 3)
+
+    report = plan_week(ledger, solve, needs_repair, timings)
+    if progress:
+        progress(2, 3)
+
+    if dry_run:
+        report["dry_run"] = True
+        report["proposed"] = scheduler.proposed_changes(ledger)
     else:
-        raise HTTPException(status_code=500, detail="Failed to send WhatsApp")
+        phase_start = time.perf_counter()
+        change_journal.mark_run(db, week_start, journal_id)
+        change_journal.prune(db, datetime.now() - timedelta(days=datetime.now().weekday()))
+        report_write_conflicts(report, ledger.write(db))
+        timings["write_ms"] = round((time.perf_counter() - phase_start) * 1000, 2)
 
+    report["timings_ms"] = timings
+    report["incremental"] = {"full_run": False, "changes": len(changes), "clients": len(ledger.clients)}
+    if progress:
+        progress(3, 3)
+    return report
 
-def resolve_conflicts_internal(db: Session, week_start: datetime):
+
+def plan_week(ledger: scheduler.WeekLedger, solve, needs_repair: bool, timings: dict):
+    """Solve + repair one week entirely in memory; nothing is written here."""
+    phase_start = time.perf_counter()
+    result = solve(ledger)
+    timings["solve_ms"] = round(timings.get("solve_ms", 0) + (time.perf_counter() - phase_start) * 1000, 2)
+
+    failed_assignments = result['failed_assignments']
+    critical_failures, non_critical_failures = scheduler.split_failures(ledger, failed_assignments)
+
+    # --- AUTOMATIC SMART RESOLUTION ---
+    # Only the greedy solver leaves repairable failures; matching already found the best cover.
+    phase_start = time.perf_counter()
+    if needs_repair:
+        resolution_result = scheduler.resolve_blockers(ledger)
+    else:
+        resolution_result = {"resolved_count": result['resolved_count'], "details": result['resolution_details']}
+    timings["resolve_ms"] = round(timings.get("resolve_ms", 0) + (time.perf_counter() - phase_start) * 1000, 2)
+
+    total_success = result['success_count'] + resolution_result['resolved_count']
+
+    return {
+        "success_count": total_success,
+        "initial_success_count": result['success_count'],
+        "resolved_count": resolution_result['resolved_count'],
+        "failed_assignments": critical_failures,
+        "resolution_details": resolution_result['details'],
+        "non_critical_failures": non_critical_failures,
+        "total_failures": len(failed_assignments)
+    }
+
+
+def report_write_conflicts(report: dict, conflicts: list, count_key: str = "success_count"):
+    """Adds what the ledger write dropped (the week changed while it was planned) to a run report."""
+    report["write_conflicts"] = conflicts
+    report[count_key] -= sum(1 for c in conflicts if c["kind"] == "booking")
+
+
+def resolve_conflicts_internal(db: Session, week_start: datetime, progress=None, max_depth: int = scheduler.RESOLVE_MAX_DEPTH):
+    """
+    Loads the week into a ledger, searches blocker chains in memory
+    (scheduler.resolve_blockers) and writes every move and new booking in
+    one transaction.
+    """
+    ledger = scheduler.WeekLedger.load(db, week_start)
+    result = scheduler.resolve_blockers(ledger, max_depth=max_depth, progress=progress)
+    report_write_conflicts(result, ledger.write(db), count_key="resolved_count")
+    return result
+
+@app.post("/schedule/feasibility", response_model=dict)
+def check_feasibility(payload: dict, db: Session = Depends(get_db)):
+    # Payload: { "week_start_date": "YYYY-MM-DD", "client_id": 12 (optional), "slots": ["YYYY-MM-DDTHH:MM:00", ...] }
+    # Without "slots", the client's default slots in that week are checked.
+    # Answers "which trainers can take this client at these slots" for the whole list at once.
+    try:
+        week_start = datetime.fromisoformat(payload.get("week_start_date"))
+        week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid week_start_date format.")
     week_end = week_start + timedelta(days=7)
-    clients = db.query(models.User).filter(models.User.role == "client").all()
-    
-    resolved_count = 0
-    resolved_details = []
 
-    for client in clients:
-        if client.workout_credits <= 0:
-            continue
-            
-        current_bookings_count = db.query(models.Appointment).filter(
-            models.Appointment.client_id == client.id,
-            models.Appointment.start_time >= week_start.isoformat(),
-            models.Appointment.start_time < week_end.isoformat(),
-            models.Appointment.status != 'cancelled'
-        ).count()
-        
-        missing_slots = client.weekly_workout_limit - current_bookings_count
-        
-        if missing_slots <= 0:
-            continue
-            
-        if not client.default_slots:
-            continue
-            
-        booked_appts = db.query(models.Appointment).filter(
-            models.Appointment.client_id == client.id,
-            models.Appointment.start_time >= week_start.isoformat(),
-            models.Appointment.start_time < week_end.isoformat(),
-            models.Appointment.status != 'cancelled'
-        ).all()
-        booked_times = [datetime.fromisoformat(a.start_time) for a in booked_appts]
+    client = None
+    if payload.get("client_id") is not None:
+        client = db.query(models.User).filter(models.User.id == payload["client_id"]).first()
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
 
-        for slot in client.default_slots:
-            if missing_slots <= 0 or client.workout_credits <= 0:
-                break
-                
-            target_date = week_start + timedelta(days=slot.day_of_week)
-            slot_iso = f"{target_date.strftime('%Y-%m-%d')}T{slot.start_time}:00"
-            slot_dt = datetime.fromisoformat(slot_iso)
-            
-            if any(bt == slot_dt for bt in booked_times):
-                continue
-                
-            blockers = db.query(models.Appointment).filter(
-                models.Appointment.start_time == slot_iso,
-                models.Appointment.status != 'cancelled'
+    slots = payload.get("slots")
+    if slots is None:
+        if client is None:
+            raise HTTPException(status_code=400, detail="Provide slots or a client_id with default slots.")
+        slots = [scheduler.slot_iso(week_start, s.day_of_week, s.start_time) for s in client.default_slots]
+
+    slot_times = []
+    for slot in slots:
+        try:
+            slot_dt = datetime.fromisoformat(slot).replace(tzinfo=None) # Naive, like booking.parse_slot
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail=f"Invalid slot '{slot}'")
+        if not week_start <= slot_dt < week_end:
+            raise HTTPException(status_code=400, detail=f"Slot '{slot}' is outside the week")
+        slot_times.append(slot_dt)
+
+    # 1. Week state: two grouped queries + shift index
+    state = WeekState.load(db, week_start)
+    isos = [dt.strftime("%Y-%m-%dT%H:%M:00") for dt in slot_times]
+    rows = [state.row(iso, dt.weekday(), dt.strftime("%H:%M")) for iso, dt in zip(isos, slot_times)]
+
+    # 2. Whole list in one masked operation
+    available = state.available_mask(rows)
+    seats = state.seats_left(rows)
+
+    # 3. Client-level limits
+    client_report = None
+    client_reason = None
+    booked = set()
+    if client:
+        weekly_count = state.client_count(client.id)
+        if weekly_count >= client.weekly_workout_limit:
+            client_reason = f"Weekly limit reached ({client.weekly_workout_limit})"
+        elif client.workout_credits <= 0:
+            client_reason = "Insufficient credits"
+        booked = {
+            row[0] for row in db.query(models.Appointment.start_time).filter(
+                models.Appointment.client_id == client.id,
+                models.Appointment.start_time.in_([dt.replace(second=0, microsecond=0) for dt in slot_times]),
+                models.Appointment.status != "cancelled"
             ).all()
-            
-            slot_resolved = False
-            for blocker_appt in blockers:
-                blocker_user = db.query(models.User).filter(models.User.id == blocker_appt.client_id).first()
-                if not blocker_user or not blocker_user.default_slots:
-                    continue
-                
-                for b_slot in blocker_user.default_slots:
-                    b_target_date = week_start + timedelta(days=b_slot.day_of_week)
-                    b_slot_iso = f"{b_target_date.strftime('%Y-%m-%d')}T{b_slot.start_time}:00"
-                    
-                    if b_slot_iso == slot_iso:
-                        continue
-                        
-                    is_blocker_busy = db.query(models.Appointment).filter(
-                        models.Appointment.client_id == blocker_user.id,
-                        models.Appointment.start_time == b_slot_iso,
-                        models.Appointment.status != 'cancelled'
-                    ).count() > 0
-                    if is_blocker_busy:
-                        continue
-                        
-                    active_trainers_count = db.query(models.Appointment.trainer_id).filter(
-                        models.Appointment.start_time == b_slot_iso,
-                        models.Appointment.status != "cancelled"
-                    ).distinct().count()
-                    
-                    available_trainers = []
-                    all_trainers = db.query(models.Trainer).all()
-                    b_alt_dt = datetime.fromisoformat(b_slot_iso)
-                    b_alt_doy = b_alt_dt.weekday()
-                    b_alt_time_str = b_alt_dt.strftime("%H:%M")
-                    
-                    for trainer in all_trainers:
-                        is_working = False
-                        for av in trainer.availabilities:
-                            if av.day_of_week == b_alt_doy:
-                                if av.start_time <= b_alt_time_str and av.end_time > b_alt_time_str:
-                                    is_working = True
-                                    break
-                        if not is_working: continue
-                        
-                        current_clients = db.query(models.Appointment).filter(
-                            models.Appointment.trainer_id == trainer.id,
-                            models.Appointment.start_time == b_slot_iso,
-                            models.Appointment.status != "cancelled"
-                        ).count()
-                        if current_clients >= 2: continue
-                        
-                        is_active = current_clients > 0
-                        if not is_active and active_trainers_count >= 3: continue
-                        
-                        available_trainers.append(trainer)
-
-                    if available_trainers:
-                        new_trainer = available_trainers[0]
-                        vacated_trainer_id = blocker_appt.trainer_id # Capture BEFORE update
-                        
-                        # Move Blocker
-                        blocker_appt.start_time = b_slot_iso
-                        blocker_appt.trainer_id = new_trainer.id
-                        
-                        # Book Victim
-                        victim_appt = models.Appointment(
-                            trainer_id=vacated_trainer_id, # Take the spot!
-                            client_id=client.id,
-                            client_name=client.first_name,
-                            client_email=client.email,
-                            start_time=slot_iso,
-                            status="confirmed"
-                        )
-                        db.add(victim_appt)
-                        client.workout_credits -= 1
-                        
-                        resolved_count += 1
-                        missing_slots -= 1
-                        resolved_details.append({
-                            "client": client.email,
-                            "original_slot": f"Blocked by {blocker_user.email}",
-                            "new_slot": f"{target_date.strftime('%A')} {slot.start_time}",
-                            "trainer": "Swapped w/ Blocker",
-                            "notes": f"Moved {blocker_user.email} to {b_target_date.strftime('%A')} {b_slot.start_time}"
-                        })
-                        
-                        db.commit()
-                        slot_resolved = True
-                        break 
-                if slot_resolved: break
-
-    return {"resolved_count": resolved_count, "details": resolved_details}
+        }
+        client_report = {
+            "id": client.id,
+            "weekly_count": weekly_count,
+            "weekly_limit": client.weekly_workout_limit,
+            "credits": client.workout_credits,
+            "reason": client_reason
+        }
+
+    results = []
+    for i, iso in enumerate(isos):
+        trainers = sorted(state.trainer_ids[c] for c in available[i].nonzero()[0])
+        if iso in booked:
+            reason = "Already booked"
+        elif client_reason:
+            reason = client_reason
+        elif not trainers or seats[i] <= 0:
+            reason = "No available trainer / Gym busy"
+        else:
+            reason = None
+        results.append({
+            "start_time": iso,
+            "feasible": reason is None,
+            "seats_left": int(seats[i]),
+            "trainers": trainers,
+            "reason": reason
+        })
+
+    return {"week_start_date": week_start.strftime("%Y-%m-%d"), "client": client_report, "slots": results}
+
+# Seconds a browser may reuse a capacity response before revalidating it (ETag)
+CAPACITY_MAX_AGE = 10
+
+@app.get("/schedule/capacity", response_model=dict)
+def read_week_capacity(week_start: str, request: Request, db: Session = Depends(get_db)):
+    # Bookable slots of the 7 days from week_start (client hours, >= 1 trainer on shift):
+    # gym seats left, trainers on shift and seats left per trainer.
+    # One grouped query over the week's bookings + the shift index.
+    try:
+        start = datetime.fromisoformat(week_start).replace(hour=0, minute=0, second=0, microsecond=0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid week_start format.")
+
+    # 1. Slots with someone on shift
+    state = WeekState.load(db, start, clients=False)
+    slots = []
+    for day in range(7):
+        day_dt = start + timedelta(days=day)
+        for hour in booking.CLIENT_HOURS:
+            slot_time = f"{hour:02d}:00"
+            trainers = shift_index.trainers_at(day_dt.weekday(), slot_time)
+            if trainers:
+                iso = f"{day_dt.strftime('%Y-%m-%d')}T{slot_time}:00"
+                slots.append((iso, trainers, state.row(iso, day_dt.weekday(), slot_time)))
+
+    # 2. Seats for every slot at once
+    rows = [row for _, _, row in slots]
+    seats = state.seats_left(rows)
+    trainer_seats = state.trainer_seats(rows)
+
+    body = {
+        "week_start": start.strftime("%Y-%m-%d"),
+        "slots": [
+            {
+                "start_time": iso,
+                "seats_left": int(seats[i]),
+                "trainers_on_shift": list(trainers),
+                "trainer_seats": {str(t): int(trainer_seats[i, state.column(t)]) for t in trainers}
+            }
+            for i, (iso, trainers, _) in enumerate(slots)
+        ]
+    }
+
+    # 3. Cacheable: ETag of the content, 304 when the client's copy is current
+    etag = '"' + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={CAPACITY_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=body, headers=headers)
+
+def parse_max_depth(payload: dict) -> int:
+    # "max_depth": longest chain of moved clients (1 = the original single swap)
+    try:
+        max_depth = int(payload.get("max_depth", scheduler.RESOLVE_MAX_DEPTH))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="max_depth must be an integer.")
+    if not 1 <= max_depth <= 6:
+        raise HTTPException(status_code=400, detail="max_depth must be between 1 and 6.")
+    return max_depth
 
 @app.post("/appointments/auto-resolve", response_model=dict)
 def auto_resolve_conflicts(payload: dict, db: Session = Depends(get_db)):
@@ -1140,5 +1558,73 @@ def auto_resolve_conflicts(payload: dict, db: Session = Depends(get_db)):
         week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
     except (ValueError, TypeError):
         raise HTTPException(status_code=400, detail="Invalid week_start_date format.")
+
+    max_depth = parse_max_depth(payload)
+
+    if payload.get("dry_run"):
+        # Preview the swaps against an in-memory copy of the week
+        phase_start = time.perf_counter()
+        ledger = scheduler.WeekLedger.load(db, week_start)
+        load_ms = round((time.perf_counter() - phase_start) * 1000, 2)
+
+        phase_start = time.perf_counter()
+        result = scheduler.resolve_blockers(ledger, max_depth=max_depth)
+        resolve_ms = round((time.perf_counter() - phase_start) * 1000, 2)
+
+        result["dry_run"] = True
+        result["proposed"] = scheduler.proposed_changes(ledger)
+        result["timings_ms"] = {"load_ms": load_ms, "resolve_ms": resolve_ms}
+        return result
         
-    return resolve_conflicts_internal(db, week_start)
+    return resolve_conflicts_internal(db, week_start, max_depth=max_depth)
+
+# --- Background Jobs ---
+# Long admin operations can be submitted with POST /jobs/{kind} and polled with GET /jobs/{job_id}.
+
+@jobs.register("auto-schedule")
+def auto_schedule_job(db: Session, params: dict, progress):
+    return auto_schedule_internal(params, db, progress=progress)
+
+@jobs.register("auto-schedule-range")
+def auto_schedule_range_job(db: Session, params: dict, progress):
+    return auto_schedule_range_internal(params, db, progress=progress)
+
+@jobs.register("auto-resolve")
+def auto_resolve_job(db: Session, params: dict, progress):
+    try:
+        week_start = datetime.fromisoformat(params.get("week_start_date"))
+        week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid week_start_date format.")
+    max_depth = parse_max_depth(params)
+    return resolve_conflicts_internal(db, week_start, progress=progress, max_depth=max_depth)
+
+@jobs.register("fire-trainer")
+def fire_trainer_job(db: Session, params: dict, progress):
+    return fire_trainer_internal(int(params.get("trainer_id")), db, progress=progress)
+
+@jobs.register("clear-week")
+def clear_week_job(db: Session, params: dict, progress):
+    return clear_week_appointments(params.get("week_start_date"), db)
+
+@app.post("/jobs/{kind}", response_model=dict)
+def submit_job(kind: str, payload: dict, db: Session = Depends(get_db)):
+    # Payload: the same params as the synchronous endpoint, e.g. { "week_start_date": "YYYY-MM-DD" }
+    if kind == "auto-resolve":
+        parse_max_depth(payload) # Reject a bad max_depth now, not when the job runs
+    job = jobs.submit(db, kind, payload)
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs/", response_model=List[dict])
+def read_jobs(status: str = None, limit: int = 50, db: Session = Depends(get_db)):
+    query = db.query(models.Job)
+    if status:
+        query = query.filter(models.Job.status == status)
+    return [jobs.serialize(j) for j in query.order_by(models.Job.created_at.desc()).limit(limit).all()]
+
+@app.get("/jobs/{job_id}", response_model=dict)
+def read_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.serialize(job)
@@ -1,7 +1,32 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Index, DateTime
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from database import Base
 
+
+class IsoDateTime(TypeDecorator):
+    """
+    Native DateTime column (TIMESTAMP on Postgres) that the rest of the code
+    still reads as ISO 8601 text: filters accept datetimes or ISO strings,
+    results come back as datetime.isoformat() ('2025-01-06T09:00:00'), the
+    same text the slot keys (occupancy, waitlist, usage) are built from.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value is not None and value.tzinfo is not None:
+            value = value.replace(tzinfo=None) # Naive local time throughout, as before
+        return value
+
+    def process_result_value(self, value, dialect):
+        return value.isoformat() if value is not None else None
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -63,13 +88,19 @@ class Availability(Base):
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        # Slot capacity / week ranges, a client's week, a trainer's schedule
+        Index("ix_appointments_start_status", "start_time", "status"),
+        Index("ix_appointments_client_start", "client_id", "start_time"),
+        Index("ix_appointments_trainer_start", "trainer_id", "start_time"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     trainer_id = Column(Integer, ForeignKey("trainers.id"))
     client_id = Column(Integer, ForeignKey("users.id"))
     client_name = Column(String)
     client_email = Column(String)
-    start_time = Column(String)  # ISO 8601
+    start_time = Column(IsoDateTime)  # Slot start (read as ISO 8601 text)
     status = Column(String, default="confirmed")
 
     trainer = relationship("Trainer", back_populates="appointments")
@@ -78,12 +109,16 @@ class Appointment(Base):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        # A user's notifications, newest first
+        Index("ix_notifications_user_created", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     message = Column(String)
     is_read = Column(Boolean, default=False)
-    created_at = Column(String) # ISO format
+    created_at = Column(IsoDateTime) # Read as ISO 8601 text
 
     user = relationship("User", back_populates="notifications")
 
@@ -93,3 +128,112 @@ class SystemSetting(Base):
 
     key = Column(String, primary_key=True, index=True)
     value = Column(String)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True, index=True) # uuid hex
+    kind = Column(String, index=True) # 'auto-schedule', 'fire-trainer', ...
+    status = Column(String, default="queued", index=True) # 'queued', 'running', 'succeeded', 'failed'
+    params = Column(String) # JSON
+    progress_done = Column(Integer, default=0)
+    progress_total = Column(Integer, default=0)
+    result = Column(String, nullable=True) # JSON
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(String) # ISO format
+    updated_at = Column(String) # ISO format
+
+
+class ScheduleChange(Base):
+    __tablename__ = "schedule_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String) # 'client', 'default_slot', 'shift'
+    user_id = Column(Integer, nullable=True, index=True)
+    trainer_id = Column(Integer, nullable=True)
+    day_of_week = Column(Integer, nullable=True) # 0-6
+    start_time = Column(String, nullable=True) # HH:MM
+    end_time = Column(String, nullable=True) # HH:MM (shifts only)
+    created_at = Column(String) # ISO format
+
+
+class ScheduleRun(Base):
+    __tablename__ = "schedule_runs"
+
+    week_start = Column(String, primary_key=True, index=True) # YYYY-MM-DD
+    last_change_id = Column(Integer, default=0) # Journal entries up to this id are planned
+    completed_at = Column(String) # ISO format
+
+
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist_entries"
+    __table_args__ = (
+        # Next waiter of a slot = first row of (start_time, status) in id order
+        Index("ix_waitlist_slot_status", "start_time", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("users.id"), index=True)
+    start_time = Column(String) # ISO 8601 slot
+    status = Column(String, default="waiting") # 'waiting', 'promoted', 'left'
+    appointment_id = Column(Integer, nullable=True) # Booking made on promotion
+    created_at = Column(String) # ISO format
+    promoted_at = Column(String, nullable=True) # ISO format
+
+
+class SlotOccupancy(Base):
+    __tablename__ = "slot_occupancy"
+
+    start_time = Column(String, primary_key=True) # ISO 8601 slot
+    total_clients = Column(Integer, default=0)
+    active_trainers = Column(Integer, default=0) # Trainers with >= 1 client
+    version = Column(Integer, default=0) # Bumped by every locked booking / cancellation (row doubles as the slot lock)
+
+
+class SlotTrainerOccupancy(Base):
+    __tablename__ = "slot_trainer_occupancy"
+
+    start_time = Column(String, primary_key=True) # ISO 8601 slot
+    trainer_id = Column(Integer, primary_key=True)
+    clients = Column(Integer, default=0)
+
+
+class ClientWeekUsage(Base):
+    __tablename__ = "client_week_usage"
+
+    client_id = Column(Integer, primary_key=True)
+    week_start = Column(String, primary_key=True) # YYYY-MM-DD (Monday)
+    bookings = Column(Integer, default=0) # Active (not cancelled) appointments that week
+
+
+class OutboxMessage(Base):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # Worker poll: due messages of a status in id order
+        Index("ix_outbox_status_due", "status", "next_attempt_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String, default="whatsapp")
+    to_number = Column(String)
+    body = Column(String)
+    status = Column(String, default="pending") # 'pending', 'sending', 'sent', 'dead'
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(String) # ISO format
+    claimed_at = Column(String, nullable=True) # ISO format, set while 'sending'
+    last_error = Column(String, nullable=True)
+    created_at = Column(String) # ISO format
+    sent_at = Column(String, nullable=True) # ISO format
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True) # Client-supplied Idempotency-Key header
+    route = Column(String) # 'POST /appointments/', ...
+    request_hash = Column(String) # sha256 of route + request body
+    status_code = Column(Integer, nullable=True) # NULL while the first request is running
+    response = Column(String, nullable=True) # JSON body replayed to retries
+    created_at = Column(String, index=True) # ISO format, drives expiry
@@ -0,0 +1,186 @@
+"""
+Materialized slot occupancy.
+
+slot_occupancy keeps one row per booked slot (total clients, active
+trainers) and slot_trainer_occupancy one row per (slot, trainer) with the
+trainer's client count, so admission checks are primary-key reads instead
+of COUNT / COUNT DISTINCT scans over appointments.
+
+Every write path keeps them in step inside its own transaction:
+single bookings / cancellations apply a delta (add), bulk writes recount
+the slots they touched (refresh / refresh_range). rebuild() recomputes
+everything, e.g. after appointments were written outside the app:
+
+    python occupancy.py --rebuild
+"""
+import argparse
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Keeps IN (...) lists well below SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def _insert(db: Session):
+    """Dialect insert with ON CONFLICT support (Postgres / SQLite)."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+# --- Slot Lock ---
+
+def lock(db: Session, start_time: str):
+    """
+    Takes the slot's occupancy row (upserting it and bumping its version) so
+    the checks that follow see every earlier booking of the slot.
+
+    Postgres: the row stays locked until commit, so only bookings of the
+    same slot wait. SQLite: the write takes the database write lock (the
+    same effect as BEGIN IMMEDIATE), so it must be the first statement of
+    the transaction.
+    """
+    insert = _insert(db)
+    stmt = insert(models.SlotOccupancy).values(start_time=start_time, version=1, total_clients=0, active_trainers=0)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.SlotOccupancy.start_time],
+        set_={"version": models.SlotOccupancy.version + 1}
+    )
+    db.execute(stmt)
+
+
+# --- Reads ---
+
+def slot(db: Session, start_time: str):
+    """The slot's row (None if nothing was ever booked there)."""
+    return db.get(models.SlotOccupancy, start_time, populate_existing=True)
+
+
+def trainer_clients(db: Session, start_time: str, trainer_id: int) -> int:
+    row = db.get(models.SlotTrainerOccupancy, (start_time, trainer_id), populate_existing=True)
+    return row.clients if row else 0
+
+
+# --- Maintenance ---
+
+def add(db: Session, start_time: str, trainer_id: int, delta: int):
+    """
+    Applies one booking (+1) or cancellation (-1) of `trainer_id` at the slot.
+    Call under lock() so the read-modify-write can't interleave.
+    """
+    slot_row = slot(db, start_time)
+    if slot_row is None:
+        slot_row = models.SlotOccupancy(start_time=start_time, version=1, total_clients=0, active_trainers=0)
+        db.add(slot_row)
+
+    trainer_row = db.get(models.SlotTrainerOccupancy, (start_time, trainer_id), populate_existing=True)
+    if trainer_row is None:
+        trainer_row = models.SlotTrainerOccupancy(start_time=start_time, trainer_id=trainer_id, clients=0)
+        db.add(trainer_row)
+
+    before = trainer_row.clients
+    trainer_row.clients = max(before + delta, 0)
+    slot_row.total_clients = max(slot_row.total_clients + delta, 0)
+    if before == 0 and trainer_row.clients > 0:
+        slot_row.active_trainers += 1
+    elif before > 0 and trainer_row.clients == 0:
+        slot_row.active_trainers -= 1
+    db.flush()
+
+
+def refresh(db: Session, start_times):
+    """Recounts the given slots from appointments (after bulk writes / deletes)."""
+    start_times = sorted(set(start_times))
+    for i in range(0, len(start_times), CHUNK_SIZE):
+        chunk = start_times[i:i + CHUNK_SIZE]
+        _recount(db, lambda column: [column.in_(chunk)])
+
+
+def refresh_range(db: Session, start_iso: str, end_iso: str):
+    """Recounts every slot in [start_iso, end_iso), e.g. a scheduled or cleared week."""
+    _recount(db, lambda column: [column >= start_iso, column < end_iso])
+
+
+def rebuild(db: Session) -> int:
+    """Recomputes both tables from appointments (committed by the caller). Returns booked slots."""
+    return _recount(db, lambda column: [])
+
+
+def _recount(db: Session, match) -> int:
+    """
+    Recounts the slots selected by match(start_time column) -> filter list.
+    Slot rows are zeroed and upserted rather than deleted, so lock versions survive.
+    """
+    per_trainer = db.query(
+        models.Appointment.start_time,
+        models.Appointment.trainer_id,
+        func.count(models.Appointment.id)
+    ).filter(
+        models.Appointment.status != "cancelled",
+        *match(models.Appointment.start_time)
+    ).group_by(models.Appointment.start_time, models.Appointment.trainer_id).all()
+
+    # 1. Per-trainer rows: replace
+    db.query(models.SlotTrainerOccupancy).filter(
+        *match(models.SlotTrainerOccupancy.start_time)
+    ).delete(synchronize_session=False)
+
+    totals = {}
+    if per_trainer:
+        db.execute(_insert(db)(models.SlotTrainerOccupancy), [
+            {"start_time": start_time, "trainer_id": trainer_id, "clients": count}
+            for start_time, trainer_id, count in per_trainer
+        ])
+        for start_time, _, count in per_trainer:
+            clients, trainers = totals.get(start_time, (0, 0))
+            totals[start_time] = (clients + count, trainers + 1)
+
+    # 2. Slot rows: zero, then upsert the counted slots
+    db.query(models.SlotOccupancy).filter(
+        *match(models.SlotOccupancy.start_time)
+    ).update({"total_clients": 0, "active_trainers": 0}, synchronize_session=False)
+
+    if totals:
+        stmt = _insert(db)(models.SlotOccupancy)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.SlotOccupancy.start_time],
+            set_={"total_clients": stmt.excluded.total_clients, "active_trainers": stmt.excluded.active_trainers}
+        )
+        db.execute(stmt, [
+            {"start_time": start_time, "version": 1, "total_clients": clients, "active_trainers": trainers}
+            for start_time, (clients, trainers) in totals.items()
+        ])
+    db.flush()
+    return len(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the slot occupancy tables.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute occupancy from appointments")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    from database import SessionLocal, engine
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        slots = rebuild(db)
+        db.commit()
+        logger.info(f"Slot occupancy rebuilt: {slots} booked slots")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,265 @@
+"""
+Notification outbox: WhatsApp messages are written to notification_outbox in
+the transaction that causes them (a booking, an admin message) and sent
+later by a background worker pool, so request latency never depends on
+Twilio and a message is never lost to a crash between commit and send.
+
+Workers claim due messages, send them through `sender` under a shared rate
+limit, and on failure retry with exponential backoff; after
+OUTBOX_MAX_ATTEMPTS a message is marked 'dead' (dead letter) and can be
+re-queued from the admin API. A claim left 'sending' by a crashed worker
+is picked up again after CLAIM_TIMEOUT.
+
+The pool starts with the app (OUTBOX_WORKERS=0 disables it, e.g. when a
+separate process runs `python outbox.py`).
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+import models
+import whatsapp_service
+from database import SessionLocal, current_route
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_RATE_PER_SECOND = float(os.getenv("OUTBOX_RATE_PER_SECOND", "5"))   # sends per second, all workers together
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))           # sends before a message is dead-lettered
+BACKOFF_BASE = 2.0        # seconds before the first retry, doubled per attempt
+BACKOFF_MAX = 600.0       # longest wait between retries
+POLL_INTERVAL = 1.0       # seconds an idle worker waits before looking again
+BATCH_SIZE = 20           # messages claimed per poll
+CLAIM_TIMEOUT = 300       # seconds before a 'sending' claim counts as abandoned
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+
+
+# --- Writing ---
+
+def enqueue(db: Session, to_number: str, body: str, channel: str = "whatsapp") -> models.OutboxMessage:
+    """Adds a message to the caller's transaction; it is sent once that commits."""
+    now_iso = datetime.now().isoformat()
+    message = models.OutboxMessage(
+        channel=channel,
+        to_number=to_number,
+        body=body,
+        status=PENDING,
+        attempts=0,
+        next_attempt_at=now_iso,
+        created_at=now_iso
+    )
+    db.add(message)
+    return message
+
+
+def enqueue_appointment_created(db: Session, appointment: models.Appointment, trainer_name: str = None):
+    """Booking confirmation for a new appointment (same transaction as the booking)."""
+    if trainer_name is None:
+        trainer = db.get(models.Trainer, appointment.trainer_id)
+        trainer_name = trainer.name if trainer else "Gym Trainer"
+    date_part, _, time_part = appointment.start_time.partition("T")
+    body = whatsapp_service.appointment_created_message(
+        client_name=appointment.client_name or "Client",
+        date=date_part,
+        time=time_part[:5],
+        trainer_name=trainer_name
+    )
+    return enqueue(db, whatsapp_service.default_target(), body)
+
+
+def backoff(attempts: int) -> float:
+    """Seconds to wait after the given number of failed sends."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+# --- Delivery ---
+
+class RateLimiter:
+    """Token bucket shared by the workers: at most `rate` sends per second (bursts up to `rate`)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class OutboxWorker:
+    """
+    Pool of threads draining the outbox. `sender(to_number, body)` does the
+    send and raises on failure (whatsapp_service.deliver by default; tests
+    pass a stub).
+    """
+
+    def __init__(self, sender=None, workers: int = OUTBOX_WORKERS, rate: float = OUTBOX_RATE_PER_SECOND, session_factory=SessionLocal):
+        self.sender = sender or whatsapp_service.deliver
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.session_factory = session_factory
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Outbox worker pool started ({self.workers} workers, {self.limiter.rate}/s)")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _loop(self):
+        current_route.set("OUTBOX") # Tag the worker's queries in the query metrics
+        while not self._stop.is_set():
+            try:
+                sent = self.drain_once()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                sent = 0
+            if not sent:
+                self._stop.wait(POLL_INTERVAL)
+
+    def drain_once(self, limit: int = BATCH_SIZE) -> int:
+        """Claims up to `limit` due messages and attempts each once. Returns messages attempted."""
+        db = self.session_factory()
+        try:
+            claimed = claim(db, limit)
+            for message in claimed:
+                self.limiter.acquire()
+                try:
+                    self.sender(message.to_number, message.body)
+                except Exception as e:
+                    mark_failed(db, message, e)
+                else:
+                    mark_sent(db, message)
+            return len(claimed)
+        finally:
+            db.close()
+
+
+def claim(db: Session, limit: int):
+    """
+    Marks up to `limit` due messages 'sending' for this worker and returns
+    them. Each claim is a conditional UPDATE, so two workers never get the
+    same message (Postgres also skips rows another worker has locked).
+    """
+    now = datetime.now()
+    now_iso = now.isoformat()
+    stale_iso = (now - timedelta(seconds=CLAIM_TIMEOUT)).isoformat()
+    claimable = or_(
+        and_(models.OutboxMessage.status == PENDING, models.OutboxMessage.next_attempt_at <= now_iso),
+        and_(models.OutboxMessage.status == SENDING, models.OutboxMessage.claimed_at < stale_iso)
+    )
+
+    candidates = db.query(models.OutboxMessage.id).filter(claimable).order_by(
+        models.OutboxMessage.id
+    ).limit(limit).with_for_update(skip_locked=True).all()
+
+    claimed_ids = []
+    for (message_id,) in candidates:
+        taken = db.execute(
+            update(models.OutboxMessage)
+            .where(models.OutboxMessage.id == message_id, claimable)
+            .values(status=SENDING, claimed_at=now_iso, attempts=models.OutboxMessage.attempts + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if taken:
+            claimed_ids.append(message_id)
+    db.commit()
+
+    if not claimed_ids:
+        return []
+    return db.query(models.OutboxMessage).filter(
+        models.OutboxMessage.id.in_(claimed_ids)
+    ).order_by(models.OutboxMessage.id).all()
+
+
+def mark_sent(db: Session, message: models.OutboxMessage):
+    message.status = SENT
+    message.sent_at = datetime.now().isoformat()
+    message.last_error = None
+    db.commit()
+
+
+def mark_failed(db: Session, message: models.OutboxMessage, error: Exception):
+    message.last_error = str(error)[:500]
+    if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+        message.status = DEAD
+        logger.error(f"Outbox message {message.id} dead after {message.attempts} attempts: {error}")
+    else:
+        message.status = PENDING
+        message.next_attempt_at = (datetime.now() + timedelta(seconds=backoff(message.attempts))).isoformat()
+        logger.warning(f"Outbox message {message.id} failed (attempt {message.attempts}/{OUTBOX_MAX_ATTEMPTS}): {error}")
+    db.commit()
+
+
+# --- Admin ---
+
+def stats(db: Session) -> dict:
+    """Messages per status."""
+    counts = dict(db.query(models.OutboxMessage.status, func.count(models.OutboxMessage.id)).group_by(models.OutboxMessage.status).all())
+    return {status: counts.get(status, 0) for status in (PENDING, SENDING, SENT, DEAD)}
+
+
+def requeue(db: Session, message_id: int) -> bool:
+    """Gives a dead message a fresh set of attempts. Returns False if it isn't dead."""
+    requeued = db.query(models.OutboxMessage).filter(
+        models.OutboxMessage.id == message_id,
+        models.OutboxMessage.status == DEAD
+    ).update({
+        "status": PENDING,
+        "attempts": 0,
+        "next_attempt_at": datetime.now().isoformat()
+    }, synchronize_session=False)
+    db.commit()
+    return bool(requeued)
+
+
+worker = OutboxWorker()
+
+
+def main():
+    from database import engine
+    models.Base.metadata.create_all(bind=engine)
+    pool = OutboxWorker(workers=max(OUTBOX_WORKERS, 1))
+    pool.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
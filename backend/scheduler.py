@@ -0,0 +1,961 @@
+import heapq
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update, or_
+from sqlalchemy.orm import Session, selectinload
+
+import client_usage
+import models
+import occupancy
+from shift_index import ShiftIndex, shift_index
+from week_state import WeekState, MAX_CLIENTS_PER_SLOT, MAX_CLIENTS_PER_TRAINER, MAX_TRAINERS_PER_SLOT
+
+logger = logging.getLogger(__name__)
+
+# How a trainer is picked for a new booking at a slot:
+# "load"      - per-slot heap: active trainers with spare seats first, then idle ones (default)
+# "lowest_id" - first available trainer by id (original behaviour)
+TRAINER_SELECTIONS = ("load", "lowest_id")
+
+# Longest chain of moved clients the conflict resolver may build (1 = single swap)
+RESOLVE_MAX_DEPTH = 3
+
+
+def slot_iso(week_start: datetime, day_of_week: int, start_time: str) -> str:
+    """
+    Builds the ISO start time of a default slot inside the given week.
+    e.g. (Monday 2026-02-02, 1, "09:00") -> "2026-02-03T09:00:00"
+    """
+    target_date = week_start + timedelta(days=day_of_week)
+    return f"{target_date.strftime('%Y-%m-%d')}T{start_time}:00"
+
+
+class Booking:
+    """
+    A booking tracked by the ledger. Existing appointments carry their DB id,
+    bookings decided during this run have appointment_id = None.
+    `seq` orders bookings like the DB would (by id, new bookings last).
+    """
+    __slots__ = ("appointment_id", "seq", "trainer_id", "client_id", "client_name", "client_email", "start_time")
+
+    def __init__(self, trainer_id, client_id, client_name, client_email, start_time, appointment_id=None, seq=0):
+        self.appointment_id = appointment_id
+        self.seq = seq
+        self.trainer_id = trainer_id
+        self.client_id = client_id
+        self.client_name = client_name
+        self.client_email = client_email
+        self.start_time = start_time
+
+
+class WeekLedger:
+    """
+    In-memory view of one week of the schedule.
+
+    Everything the auto-scheduler needs (per-slot totals, per-trainer counts,
+    active trainers, per-client weekly counts and credits) is loaded once,
+    updated in memory as bookings are decided, and written back with write().
+    Capacity counts live in a WeekState (NumPy arrays), shared with the
+    bulk feasibility endpoint.
+    """
+
+    def __init__(self, week_start: datetime, clients, shifts: ShiftIndex, appointments, credits=None, trainer_selection: str = "load"):
+        self.week_start = week_start
+        self.week_end = week_start + timedelta(days=7)
+        self.clients = clients
+        self.shifts = shifts
+        self.trainer_selection = trainer_selection
+
+        self.state = WeekState(shifts, shifts.trainer_ids())        # slot x trainer counts, weekly counts
+        self.booked = set()                                         # (client_email, slot)
+        # Shared between ledgers when several weeks are planned in one run
+        self.credits = credits if credits is not None else {c.id: c.workout_credits for c in clients}
+
+        self.slot_bookings = defaultdict(list)                      # slot -> [Booking]
+        self.client_slots = set()                                   # (client_id, slot)
+        self.new_bookings = []
+        self.moved_bookings = {}                                    # appointment_id -> Booking
+        self.moved_from = {}                                        # appointment_id -> (slot, trainer_id) as loaded
+        self.notifications = []
+        # slot -> (heap of (-clients, trainer_id), trainer ids on shift); built on first pick,
+        # stale entries are skipped when they reach the top (lazy deletion)
+        self._trainer_heaps = {}
+
+        for appt in appointments:
+            self._track(Booking(
+                trainer_id=appt.trainer_id,
+                client_id=appt.client_id,
+                client_name=appt.client_name,
+                client_email=appt.client_email,
+                start_time=appt.start_time,
+                appointment_id=appt.id,
+                seq=appt.id
+            ))
+        self._next_seq = max((a.id for a in appointments), default=0) + 1
+
+    @classmethod
+    def load(cls, db: Session, week_start: datetime):
+        """
+        Loads the week with two queries: clients (+ default slots) and the
+        week's active appointments. Trainer shifts come from the shift index.
+        """
+        week_end = week_start + timedelta(days=7)
+        shift_index.ensure_loaded(db)
+
+        clients = db.query(models.User).options(
+            selectinload(models.User.default_slots)
+        ).filter(models.User.role == "client").order_by(models.User.id).all()
+
+        appointments = db.query(models.Appointment).filter(
+            models.Appointment.start_time >= week_start,
+            models.Appointment.start_time < week_end,
+            models.Appointment.status != "cancelled"
+        ).order_by(models.Appointment.id).all()
+
+        return cls(week_start, clients, shift_index, appointments)
+
+    @classmethod
+    def load_clients(cls, db: Session, week_start: datetime, client_ids):
+        """
+        Partial load for incremental runs: only the given clients, every
+        appointment at one of their default slots, and their own bookings
+        this week. Counts are exact for every slot those clients can book.
+        """
+        week_end = week_start + timedelta(days=7)
+        shift_index.ensure_loaded(db)
+
+        clients = db.query(models.User).options(
+            selectinload(models.User.default_slots)
+        ).filter(
+            models.User.role == "client",
+            models.User.id.in_(client_ids)
+        ).order_by(models.User.id).all()
+
+        slot_times = {
+            slot_iso(week_start, slot.day_of_week, slot.start_time)
+            for client in clients for slot in client.default_slots
+        }
+        appointments = db.query(models.Appointment).filter(
+            models.Appointment.start_time >= week_start,
+            models.Appointment.start_time < week_end,
+            models.Appointment.status != "cancelled",
+            or_(
+                models.Appointment.start_time.in_(slot_times),
+                models.Appointment.client_id.in_([c.id for c in clients])
+            )
+        ).order_by(models.Appointment.id).all()
+
+        return cls(week_start, clients, shift_index, appointments)
+
+    @classmethod
+    def load_range(cls, db: Session, week_start: datetime, weeks: int):
+        """
+        Loads `weeks` consecutive weeks with the same two queries as load().
+        The ledgers share one credits dict so balances carry forward week to week.
+        """
+        range_end = week_start + timedelta(days=7 * weeks)
+        shift_index.ensure_loaded(db)
+
+        clients = db.query(models.User).options(
+            selectinload(models.User.default_slots)
+        ).filter(models.User.role == "client").order_by(models.User.id).all()
+
+        appointments = db.query(models.Appointment).filter(
+            models.Appointment.start_time >= week_start,
+            models.Appointment.start_time < range_end,
+            models.Appointment.status != "cancelled"
+        ).order_by(models.Appointment.id).all()
+
+        credits = {c.id: c.workout_credits for c in clients}
+        ledgers = []
+        for i in range(weeks):
+            start = week_start + timedelta(days=7 * i)
+            lower, upper = start.isoformat(), (start + timedelta(days=7)).isoformat()
+            week_appointments = [a for a in appointments if lower <= a.start_time < upper]
+            ledgers.append(cls(start, clients, shift_index, week_appointments, credits=credits))
+        return ledgers
+
+    # --- State ---
+
+    def _track(self, booking: Booking):
+        self._place(booking)
+        self.state.add_client(booking.client_id)
+
+    def slot_row(self, slot: str, day_of_week: int = None, start_time: str = None) -> int:
+        row = self.state.slot_index.get(slot)
+        if row is None:
+            if day_of_week is None:
+                slot_dt = datetime.fromisoformat(slot)
+                day_of_week, start_time = slot_dt.weekday(), slot_dt.strftime("%H:%M")
+            row = self.state.row(slot, day_of_week, start_time)
+        return row
+
+    def _place(self, booking: Booking):
+        slot = booking.start_time
+        self.slot_bookings[slot].append(booking)
+        self.state.add(self.slot_row(slot), booking.trainer_id, 1)
+        self.booked.add((booking.client_email, slot))
+        self.client_slots.add((booking.client_id, slot))
+        self._push_trainer(slot, booking.trainer_id)
+
+    def _unplace(self, booking: Booking):
+        slot = booking.start_time
+        self.slot_bookings[slot].remove(booking)
+        self.state.add(self.slot_row(slot), booking.trainer_id, -1)
+        self.booked.discard((booking.client_email, slot))
+        self.client_slots.discard((booking.client_id, slot))
+        self._push_trainer(slot, booking.trainer_id)
+
+    def bookings_at(self, slot: str):
+        return sorted(self.slot_bookings.get(slot, []), key=lambda b: b.seq)
+
+    def client_booked_at(self, client_id: int, slot: str) -> bool:
+        return (client_id, slot) in self.client_slots
+
+    def weekly_count(self, client_id: int) -> int:
+        return self.state.client_count(client_id)
+
+    def active_trainers(self, slot: str) -> int:
+        row = self.state.slot_index.get(slot)
+        return 0 if row is None else int(self.state.active[row])
+
+    def working_trainers(self, day_of_week: int, start_time: str):
+        """Trainer ids whose shift covers start_time on day_of_week, lowest id first."""
+        return self.shifts.trainers_at(day_of_week, start_time)
+
+    def available_trainers(self, slot: str, day_of_week: int, start_time: str):
+        """
+        Trainers that can take one more client at this slot:
+        on shift, below 2 clients, and not a 4th trainer for the slot.
+        """
+        return self.state.available_trainers(self.slot_row(slot, day_of_week, start_time))
+
+    def pick_trainer(self, slot: str, day_of_week: int, start_time: str):
+        """
+        Trainer for one more client at this slot, or None if the slot is full.
+
+        "load" keeps a heap per slot ordered by current clients (most first),
+        so an active trainer's spare seat is used before a new trainer is
+        activated against the 3-trainer cap. Bookings push the trainer's new
+        load in O(log n); outdated entries are dropped when they surface.
+        """
+        if self.trainer_selection == "lowest_id":
+            available = self.available_trainers(slot, day_of_week, start_time)
+            return available[0] if available else None
+
+        row = self.slot_row(slot, day_of_week, start_time)
+        entry = self._trainer_heaps.get(slot)
+        if entry is None:
+            working = self.working_trainers(day_of_week, start_time)
+            loads = [(self.state.trainer_clients(row, t), t) for t in working]
+            heap = [(-clients, t) for clients, t in loads if clients < MAX_CLIENTS_PER_TRAINER]
+            heapq.heapify(heap)
+            entry = self._trainer_heaps[slot] = (heap, set(working))
+
+        heap = entry[0]
+        while heap:
+            neg_clients, trainer_id = heap[0]
+            current_clients = self.state.trainer_clients(row, trainer_id)
+            if current_clients != -neg_clients or current_clients >= MAX_CLIENTS_PER_TRAINER:
+                heapq.heappop(heap) # Stale: the trainer's load changed since this entry
+                continue
+            if current_clients == 0 and self.state.active[row] >= MAX_TRAINERS_PER_SLOT:
+                return None # Only idle trainers left and no room to activate one
+            return trainer_id
+        return None
+
+    def _push_trainer(self, slot: str, trainer_id: int):
+        entry = self._trainer_heaps.get(slot)
+        if entry is None or trainer_id not in entry[1]:
+            return
+        current_clients = self.state.trainer_clients(self.state.slot_index[slot], trainer_id)
+        if current_clients < MAX_CLIENTS_PER_TRAINER:
+            heapq.heappush(entry[0], (-current_clients, trainer_id))
+
+    def seats_left(self, slot: str, day_of_week: int, start_time: str) -> int:
+        """
+        How many more clients the slot can take: spare seats of active trainers
+        on shift, plus 2 seats for each trainer that can still be activated.
+        """
+        return int(self.state.seats_left([self.slot_row(slot, day_of_week, start_time)])[0])
+
+    def book(self, client, trainer_id: int, slot: str, client_name: str = None) -> Booking:
+        booking = Booking(
+            trainer_id=trainer_id,
+            client_id=client.id,
+            client_name=client_name or client.email.split('@')[0], # Fallback name
+            client_email=client.email,
+            start_time=slot,
+            seq=self._next_seq
+        )
+        self._next_seq += 1
+        self._track(booking)
+        self.new_bookings.append(booking)
+        self.credits[client.id] -= 1
+        return booking
+
+    def move(self, booking: Booking, slot: str, trainer_id: int):
+        if booking.appointment_id is not None:
+            self.moved_from.setdefault(booking.appointment_id, (booking.start_time, booking.trainer_id))
+        self._unplace(booking)
+        booking.start_time = slot
+        booking.trainer_id = trainer_id
+        self._place(booking)
+        if booking.appointment_id is not None:
+            self.moved_bookings[booking.appointment_id] = booking
+
+    def notify(self, client_id: int, message: str):
+        self.notifications.append({"user_id": client_id, "message": message})
+
+    # --- Persistence ---
+
+    def write(self, db: Session):
+        return write_ledgers(db, [self])
+
+
+def write_ledgers(db: Session, ledgers):
+    """
+    Writes all new appointments, credit changes and notifications of the
+    given ledgers in one transaction.
+
+    Ledgers are planned from a snapshot, so the write re-checks what may have
+    changed since: planned bookings / moves that no longer fit their slot
+    (checked under the slot locks) and bookings a client can no longer pay
+    for are dropped (not written). Returns one failure entry per dropped item.
+    """
+    new_bookings = [b for ledger in ledgers for b in ledger.new_bookings]
+    moved_bookings = [b for ledger in ledgers for b in ledger.moved_bookings.values()]
+    moved_from = {}
+    for ledger in ledgers:
+        moved_from.update(ledger.moved_from)
+    notifications = [n for ledger in ledgers for n in ledger.notifications]
+    dropped = []
+
+    # 1. Capacity: lock the touched slots and replay the plan on their current occupancy
+    new_bookings, moved_bookings, unfit = _fit_locked_slots(db, new_bookings, moved_bookings, moved_from)
+    for booking, kind, reason in unfit:
+        _drop(booking, kind, reason, dropped, notifications)
+
+    # 2. Credits: one guarded decrement per client, so balance changes since the load are kept
+    new_bookings, short = _take_credits(db, new_bookings)
+    for booking in short:
+        _drop(booking, "booking", "Insufficient credits", dropped, notifications)
+
+    # 3. Appointments: new bookings and moves
+    if new_bookings:
+        db.execute(insert(models.Appointment), [
+            {
+                "trainer_id": b.trainer_id,
+                "client_id": b.client_id,
+                "client_name": b.client_name,
+                "client_email": b.client_email,
+                "start_time": b.start_time,
+                "status": "confirmed"
+            }
+            for b in new_bookings
+        ])
+
+    if moved_bookings:
+        db.execute(update(models.Appointment), [
+            {"id": b.appointment_id, "start_time": b.start_time, "trainer_id": b.trainer_id}
+            for b in moved_bookings
+        ])
+
+    # 4. Notifications (failures of the plan and of this write)
+    if notifications:
+        now_iso = datetime.now().isoformat()
+        db.execute(insert(models.Notification), [
+            {**n, "created_at": now_iso, "is_read": False} for n in notifications
+        ])
+
+    # Occupancy and weekly counters of the written weeks, recounted in the same transaction
+    for ledger in ledgers:
+        occupancy.refresh_range(db, ledger.week_start.isoformat(), ledger.week_end.isoformat())
+        client_usage.refresh_range(db, ledger.week_start.isoformat(), ledger.week_end.isoformat())
+
+    db.commit()
+    logger.info(
+        f"Ledger write: {len(new_bookings)} appointments, {len(moved_bookings)} moves, "
+        f"{len(notifications)} notifications, {len(dropped)} dropped"
+    )
+    return dropped
+
+
+def _fit_locked_slots(db: Session, new_bookings, moved_bookings, moved_from):
+    """
+    Locks every slot the write touches (sorted, like booking._book_batch) and
+    replays the planned moves and bookings on top of the locked occupancy
+    rows, so bookings committed since the load count first. While a slot is
+    over a cap, one of its planned items is dropped: the latest booking
+    first, moves last (a dropped move puts its client back at the original
+    slot). Items for a client already booked at the slot meanwhile, and moves
+    of appointments cancelled or changed meanwhile, are dropped as well.
+    Returns (kept bookings, kept moves, [(booking, kind, reason)]).
+    """
+    if not new_bookings and not moved_bookings:
+        return new_bookings, moved_bookings, []
+
+    slots = sorted(
+        {b.start_time for b in new_bookings}
+        | {b.start_time for b in moved_bookings}
+        | {moved_from[b.appointment_id][0] for b in moved_bookings}
+    )
+    for slot in slots:
+        occupancy.lock(db, slot)
+
+    clients = defaultdict(lambda: defaultdict(int)) # slot -> trainer_id -> clients (locked rows)
+    seats = set()                                   # (client_id, slot) booked in the DB, moved ones aside
+    current = {}                                    # moved appointment id -> (slot, trainer_id) now
+    for i in range(0, len(slots), occupancy.CHUNK_SIZE):
+        chunk = slots[i:i + occupancy.CHUNK_SIZE]
+        for row in db.query(models.SlotTrainerOccupancy).filter(
+            models.SlotTrainerOccupancy.start_time.in_(chunk)
+        ).populate_existing().all():
+            clients[row.start_time][row.trainer_id] = row.clients
+        for appointment_id, client_id, start_time, trainer_id in db.query(
+            models.Appointment.id,
+            models.Appointment.client_id,
+            models.Appointment.start_time,
+            models.Appointment.trainer_id
+        ).filter(
+            models.Appointment.start_time.in_(chunk),
+            models.Appointment.status != "cancelled"
+        ).all():
+            if appointment_id in moved_from:
+                current[appointment_id] = (start_time, trainer_id)
+            else:
+                seats.add((client_id, start_time))
+
+    def excess(slot):
+        counts = [n for n in clients[slot].values() if n > 0]
+        return (
+            max(sum(counts) - MAX_CLIENTS_PER_SLOT, 0)
+            + sum(max(n - MAX_CLIENTS_PER_TRAINER, 0) for n in counts)
+            + max(len(counts) - MAX_TRAINERS_PER_SLOT, 0)
+        )
+
+    def apply(item, sign):
+        booking, kind = item
+        clients[booking.start_time][booking.trainer_id] += sign
+        if kind == "move":
+            origin_slot, origin_trainer = moved_from[booking.appointment_id]
+            clients[origin_slot][origin_trainer] -= sign
+
+    # 1. Replay the plan: moves, then new bookings
+    unfit = []
+    placed = defaultdict(list) # slot -> planned items landing there
+    items = [(b, "move") for b in moved_bookings] + [(b, "booking") for b in new_bookings]
+    for booking, kind in items:
+        if kind == "move" and current.get(booking.appointment_id) != moved_from[booking.appointment_id]:
+            unfit.append((booking, kind, "Appointment changed while scheduling"))
+            continue
+        if (booking.client_id, booking.start_time) in seats:
+            unfit.append((booking, kind, "Already booked at this time"))
+            continue
+        apply((booking, kind), 1)
+        placed[booking.start_time].append((booking, kind))
+
+    # 2. Drop items until every slot is within its caps
+    over = [slot for slot in placed if excess(slot)]
+    while over:
+        slot = over.pop()
+        while excess(slot) and placed[slot]:
+            candidates = sorted(placed[slot], key=lambda item: (item[1] == "booking", item[0].seq), reverse=True)
+            # The item whose removal lowers the excess most (e.g. one of an overbooked trainer's), first in order on ties
+            choice, best = candidates[0], None
+            for item in candidates:
+                apply(item, -1)
+                remaining = excess(slot)
+                apply(item, 1)
+                if best is None or remaining < best:
+                    choice, best = item, remaining
+            apply(choice, -1)
+            placed[slot].remove(choice)
+            booking, kind = choice
+            unfit.append((booking, kind, "No available trainer / Gym busy"))
+            if kind == "move":
+                origin_slot = moved_from[booking.appointment_id][0]
+                if excess(origin_slot) and origin_slot not in over:
+                    over.append(origin_slot)
+
+    if unfit:
+        gone = {booking for booking, _, _ in unfit}
+        new_bookings = [b for b in new_bookings if b not in gone]
+        moved_bookings = [b for b in moved_bookings if b not in gone]
+    return new_bookings, moved_bookings, unfit
+
+
+def _take_credits(db: Session, new_bookings):
+    """
+    Takes one credit per planned booking with a guarded decrement per client
+    (clients in id order). A client whose current balance no longer covers
+    every booking keeps the earliest planned ones they can pay for.
+    Returns (kept bookings, dropped bookings).
+    """
+    by_client = defaultdict(list)
+    for booking in new_bookings:
+        by_client[booking.client_id].append(booking)
+
+    kept, short = [], []
+    for client_id in sorted(by_client):
+        bookings = sorted(by_client[client_id], key=lambda b: b.seq)
+        count = len(bookings)
+        if not _decrement_credits(db, client_id, count):
+            # Spent meanwhile: pay for as many as the (now locked) balance allows
+            balance = db.query(models.User.workout_credits).filter(
+                models.User.id == client_id
+            ).with_for_update().scalar() or 0
+            count = max(min(balance, count), 0)
+            if count and not _decrement_credits(db, client_id, count):
+                count = 0
+        kept.extend(bookings[:count])
+        short.extend(bookings[count:])
+    kept.sort(key=lambda b: b.seq)
+    return kept, short
+
+
+def _decrement_credits(db: Session, client_id: int, count: int) -> bool:
+    return db.execute(
+        update(models.User)
+        .where(models.User.id == client_id, models.User.workout_credits >= count)
+        .values(workout_credits=models.User.workout_credits - count)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def _drop(booking: Booking, kind: str, reason: str, dropped: list, notifications: list):
+    """Records a planned booking / move the write could not apply; a dropped booking is notified."""
+    slot_dt = datetime.fromisoformat(booking.start_time)
+    day_name, start_time = slot_dt.strftime('%A'), slot_dt.strftime('%H:%M')
+    dropped.append({"kind": kind, "client": booking.client_email, "slot": f"{day_name} {start_time}", "reason": reason})
+    if kind == "booking":
+        notifications.append({
+            "user_id": booking.client_id,
+            "message": f"Could not auto-schedule {day_name} at {start_time}: {reason}."
+        })
+
+
+def schedule_greedy(ledger: WeekLedger):
+    """
+    Same greedy pass as the original auto_schedule_week loop:
+    clients in id order, default slots in order, trainer from ledger.pick_trainer.
+    Failures are left for the repair phase (resolve_blockers).
+    """
+    failed_assignments = []
+    success_count = 0
+
+    for client in ledger.clients:
+        if not client.default_slots:
+            continue
+
+        for slot in client.default_slots:
+            # Check Limits BEFORE trying to book
+            if ledger.weekly_count(client.id) >= client.weekly_workout_limit:
+                failed_assignments.append({
+                    "client": client.email,
+                    "slot": f"Slot {slot.day_of_week}",
+                    "reason": f"Weekly limit reached ({client.weekly_workout_limit})"
+                })
+                continue
+
+            if ledger.credits[client.id] <= 0:
+                failed_assignments.append({
+                    "client": client.email,
+                    "slot": f"Slot {slot.day_of_week}",
+                    "reason": "Insufficient credits"
+                })
+                continue
+
+            target_date = ledger.week_start + timedelta(days=slot.day_of_week)
+            appointment_time_iso = slot_iso(ledger.week_start, slot.day_of_week, slot.start_time)
+
+            if (client.email, appointment_time_iso) in ledger.booked:
+                continue # Already scheduled
+
+            trainer_id = ledger.pick_trainer(appointment_time_iso, slot.day_of_week, slot.start_time)
+
+            if trainer_id is None:
+                failed_assignments.append({
+                    "client": client.email,
+                    "slot": f"{target_date.strftime('%A')} {slot.start_time}",
+                    "reason": "No available trainer / Gym busy"
+                })
+                ledger.notify(
+                    client.id,
+                    f"Could not auto-schedule {target_date.strftime('%A')} at {slot.start_time}: No available trainer or gym full."
+                )
+                continue
+
+            ledger.book(client, trainer_id, appointment_time_iso)
+            success_count += 1
+
+    return {
+        "success_count": success_count,
+        "failed_assignments": failed_assignments,
+        "resolved_count": 0,
+        "resolution_details": []
+    }
+
+
+def resolve_blockers(ledger: WeekLedger, max_depth: int = RESOLVE_MAX_DEPTH, progress=None):
+    """
+    Conflict resolution (Blocker Shifting) with bounded-depth augmenting paths.
+
+    For each client still below their weekly limit, search from every wanted
+    slot for the shortest chain that frees a seat there: the client takes a
+    seat from blocker B1, B1 moves to another of B1's default slots, where B2
+    makes room by moving on, ... until a slot with a free trainer is reached
+    (at most `max_depth` moves). A chain is applied as one step: every moved
+    client takes the trainer seat vacated by the next one, the last one gets
+    ledger.pick_trainer, so capacity rules hold. max_depth=1 is the original
+    single-hop swap.
+    """
+    week_start = ledger.week_start
+    clients_by_id = {c.id: c for c in ledger.clients}
+    alt_slots = {} # client_id -> [(iso, day_of_week, start_time)] of their default slots
+
+    def default_slots_of(user):
+        slots = alt_slots.get(user.id)
+        if slots is None:
+            slots = []
+            for b_slot in user.default_slots:
+                b_iso = slot_iso(week_start, b_slot.day_of_week, b_slot.start_time)
+                # Same shift lookup as the original resolver (weekday of the slot's date)
+                b_dt = datetime.fromisoformat(b_iso)
+                slots.append((b_iso, b_dt.weekday(), b_dt.strftime("%H:%M")))
+            slots = alt_slots[user.id] = slots
+        return slots
+
+    def chain_clients(parent, iso):
+        ids = set()
+        while parent[iso] is not None:
+            iso, booking = parent[iso]
+            ids.add(booking.client_id)
+        return ids
+
+    def find_chain(client, iso, day_of_week, start_time):
+        """BFS over slots; returns (end_slot, end_trainer_id, parent) or None."""
+        parent = {iso: None}
+        frontier = [(iso, day_of_week, start_time)]
+        for depth in range(max_depth + 1):
+            next_frontier = []
+            for x_iso, x_day, x_time in frontier:
+                if depth > 0:
+                    trainer_id = ledger.pick_trainer(x_iso, x_day, x_time)
+                    if trainer_id is not None:
+                        return x_iso, trainer_id, parent
+                if depth == max_depth:
+                    continue
+                in_chain = chain_clients(parent, x_iso)
+                for blocker in ledger.bookings_at(x_iso):
+                    if blocker.client_id == client.id or blocker.client_id in in_chain:
+                        continue
+                    blocker_user = clients_by_id.get(blocker.client_id)
+                    if not blocker_user or not blocker_user.default_slots:
+                        continue
+                    for y_iso, y_day, y_time in default_slots_of(blocker_user):
+                        if y_iso in parent or ledger.client_booked_at(blocker_user.id, y_iso):
+                            continue
+                        parent[y_iso] = (x_iso, blocker)
+                        next_frontier.append((y_iso, y_day, y_time))
+            frontier = next_frontier
+            if not frontier:
+                break
+        return None
+
+    def label(iso):
+        dt = datetime.fromisoformat(iso)
+        return f"{dt.strftime('%A')} {dt.strftime('%H:%M')}"
+
+    resolved_count = 0
+    resolved_details = []
+
+    for i, client in enumerate(ledger.clients):
+        if progress:
+            progress(i, len(ledger.clients))
+        if ledger.credits[client.id] <= 0:
+            continue
+
+        missing_slots = client.weekly_workout_limit - ledger.weekly_count(client.id)
+        if missing_slots <= 0 or not client.default_slots:
+            continue
+
+        for iso, day_of_week, start_time in default_slots_of(client):
+            if missing_slots <= 0 or ledger.credits[client.id] <= 0:
+                break
+            if ledger.client_booked_at(client.id, iso):
+                continue
+
+            # A free seat at the wanted slot itself needs no chain
+            trainer_id = ledger.pick_trainer(iso, day_of_week, start_time)
+            if trainer_id is not None:
+                ledger.book(client, trainer_id, iso, client_name=client.first_name)
+                resolved_count += 1
+                missing_slots -= 1
+                resolved_details.append({
+                    "client": client.email,
+                    "original_slot": "Free seat",
+                    "new_slot": label(iso),
+                    "trainer": "Free seat",
+                    "notes": "Seat was available"
+                })
+                continue
+
+            found = find_chain(client, iso, day_of_week, start_time)
+            if found is None:
+                continue
+            end_slot, trainer_id, parent = found
+
+            # Apply from the free end back to the wanted slot: each mover takes the seat the next one left
+            moves = []
+            y_iso = end_slot
+            while parent[y_iso] is not None:
+                x_iso, blocker = parent[y_iso]
+                vacated_trainer_id = blocker.trainer_id
+                ledger.move(blocker, y_iso, trainer_id)
+                moves.append((blocker, y_iso))
+                trainer_id = vacated_trainer_id
+                y_iso = x_iso
+            ledger.book(client, trainer_id, iso, client_name=client.first_name)
+
+            moves.reverse()
+            resolved_count += 1
+            missing_slots -= 1
+            resolved_details.append({
+                "client": client.email,
+                "original_slot": f"Blocked by {moves[0][0].client_email}",
+                "new_slot": label(iso),
+                "trainer": "Swapped w/ Blocker",
+                "notes": ", ".join(f"Moved {b.client_email} to {label(to_iso)}" for b, to_iso in moves)
+            })
+
+    if progress:
+        progress(len(ledger.clients), len(ledger.clients))
+    return {"resolved_count": resolved_count, "details": resolved_details}
+
+
+def proposed_changes(ledger: WeekLedger):
+    """New bookings and moves decided in memory (what write() would persist)."""
+    return {
+        "assignments": [
+            {"client": b.client_email, "trainer_id": b.trainer_id, "start_time": b.start_time}
+            for b in ledger.new_bookings
+        ],
+        "moves": [
+            {"appointment_id": b.appointment_id, "client": b.client_email, "trainer_id": b.trainer_id, "start_time": b.start_time}
+            for b in ledger.moved_bookings.values()
+        ],
+        "notifications": len(ledger.notifications)
+    }
+
+
+def split_failures(ledger: WeekLedger, failed_assignments):
+    """
+    Critical = client ends the week below weekly_workout_limit (gets 'missing_count').
+    Non-Critical = client met the limit despite some slot failures.
+    """
+    critical_failures = []
+    non_critical_failures = []
+
+    fail_map = defaultdict(list) # email -> failures
+    for f in failed_assignments:
+        fail_map[f['client']].append(f)
+
+    for client in ledger.clients:
+        if client.email not in fail_map:
+            continue
+
+        final_count = ledger.weekly_count(client.id)
+        if final_count < client.weekly_workout_limit:
+            missing = client.weekly_workout_limit - final_count
+            for fail in fail_map[client.email]:
+                fail['missing_count'] = missing
+                critical_failures.append(fail)
+        else:
+            non_critical_failures.extend(fail_map[client.email])
+
+    return critical_failures, non_critical_failures
+
+
+def schedule_matching(ledger: WeekLedger):
+    """
+    Maximum-coverage assignment of the week, computed in memory.
+
+    The week is a bipartite graph: clients (demand = min(remaining weekly
+    limit, credits)) on one side, slots (capacity = seats_left) on the other,
+    with an edge for every default slot. A first greedy pass is completed with
+    augmenting paths (A takes B's seat, B moves to another of B's default
+    slots, ...) until no client can gain a booking. Trainers are assigned per
+    slot at the end with ledger.pick_trainer, so the 3-trainer and
+    2-per-trainer rules hold by construction. No repair phase is needed.
+    """
+    week_start = ledger.week_start
+
+    # 1. Build demand and candidate slots
+    slot_info = {}   # slot -> (day_of_week, start_time)
+    capacity = {}    # slot -> seats left
+    need = {}        # client_id -> bookings still wanted
+    candidates = {}  # client_id -> [slot]
+    clients = [c for c in ledger.clients if c.default_slots]
+
+    for client in clients:
+        need[client.id] = max(min(
+            client.weekly_workout_limit - ledger.weekly_count(client.id),
+            ledger.credits[client.id]
+        ), 0)
+        client_slots = []
+        for slot in client.default_slots:
+            iso = slot_iso(week_start, slot.day_of_week, slot.start_time)
+            if iso in client_slots or (client.email, iso) in ledger.booked:
+                continue
+            if iso not in slot_info:
+                slot_info[iso] = (slot.day_of_week, slot.start_time)
+            client_slots.append(iso)
+        candidates[client.id] = client_slots
+
+    # Seats left at every candidate slot in one array operation
+    slot_list = list(slot_info)
+    rows = [ledger.slot_row(iso, *slot_info[iso]) for iso in slot_list]
+    capacity.update(zip(slot_list, ledger.state.seats_left(rows).tolist()))
+
+    assigned = defaultdict(list)   # slot -> [client_id] (in assignment order)
+    client_assigned = defaultdict(set)
+
+    def assign(client_id, slot):
+        assigned[slot].append(client_id)
+        client_assigned[client_id].add(slot)
+
+    # 2. Greedy pass (same order as the original loop)
+    for client in clients:
+        for iso in candidates[client.id]:
+            if need[client.id] <= 0:
+                break
+            if capacity[iso] > 0:
+                capacity[iso] -= 1
+                need[client.id] -= 1
+                assign(client.id, iso)
+
+    initial_success_count = sum(len(v) for v in assigned.values())
+
+    # 3. Augmenting paths over slots. A failed search marks every slot it
+    # reached as dead: no later augmentation can open a path out of them.
+    dead_slots = set()
+    augmented = {}  # client_id -> [(slot, [(moved_client_id, from_slot, to_slot)])]
+
+    def find_path(client_id):
+        parent = {}
+        queue = []
+        for iso in candidates[client_id]:
+            if iso in client_assigned[client_id] or iso in dead_slots or iso in parent:
+                continue
+            parent[iso] = None
+            queue.append(iso)
+
+        for iso in queue:
+            if capacity[iso] > 0:
+                return iso, parent
+            for other_id in assigned[iso]:
+                for alt in candidates[other_id]:
+                    if alt in parent or alt in dead_slots or alt in client_assigned[other_id]:
+                        continue
+                    parent[alt] = (iso, other_id)
+                    queue.append(alt)
+
+        dead_slots.update(parent.keys())
+        return None, parent
+
+    for client in clients:
+        while need[client.id] > 0:
+            end_slot, parent = find_path(client.id)
+            if end_slot is None:
+                break
+
+            # Walk back from the slot with a free seat, shifting each client one hop
+            capacity[end_slot] -= 1
+            moves = []
+            iso = end_slot
+            while parent[iso] is not None:
+                prev_slot, moved_id = parent[iso]
+                assigned[prev_slot].remove(moved_id)
+                client_assigned[moved_id].discard(prev_slot)
+                assign(moved_id, iso)
+                moves.append((moved_id, prev_slot, iso))
+                iso = prev_slot
+
+            assign(client.id, iso)
+            need[client.id] -= 1
+            augmented.setdefault(client.id, []).append((iso, moves))
+
+    # 4. Trainers per slot (seats_left guarantees a trainer for every assigned client)
+    clients_by_id = {c.id: c for c in clients}
+    for iso, client_ids in assigned.items():
+        day_of_week, start_time = slot_info[iso]
+        for client_id in client_ids:
+            trainer_id = ledger.pick_trainer(iso, day_of_week, start_time)
+            ledger.book(clients_by_id[client_id], trainer_id, iso)
+
+    # 5. Report
+    def label(iso):
+        day_of_week, start_time = slot_info[iso]
+        return f"{(week_start + timedelta(days=day_of_week)).strftime('%A')} {start_time}"
+
+    resolution_details = []
+    for client_id, paths in augmented.items():
+        for iso, moves in paths:
+            notes = ", ".join(
+                f"Moved {clients_by_id[m].email} to {label(to_slot)}" for m, _, to_slot in moves
+            ) or "Free seat"
+            resolution_details.append({
+                "client": clients_by_id[client_id].email,
+                "original_slot": "Augmenting path",
+                "new_slot": label(iso),
+                "trainer": "Matched",
+                "notes": notes
+            })
+
+    failed_assignments = []
+    for client in clients:
+        for slot in client.default_slots:
+            iso = slot_iso(week_start, slot.day_of_week, slot.start_time)
+            if (client.email, iso) in ledger.booked:
+                continue
+            if ledger.weekly_count(client.id) >= client.weekly_workout_limit:
+                failed_assignments.append({
+                    "client": client.email,
+                    "slot": f"Slot {slot.day_of_week}",
+                    "reason": f"Weekly limit reached ({client.weekly_workout_limit})"
+                })
+            elif ledger.credits[client.id] <= 0:
+                failed_assignments.append({
+                    "client": client.email,
+                    "slot": f"Slot {slot.day_of_week}",
+                    "reason": "Insufficient credits"
+                })
+            else:
+                day_name = (week_start + timedelta(days=slot.day_of_week)).strftime('%A')
+                failed_assignments.append({
+                    "client": client.email,
+                    "slot": f"{day_name} {slot.start_time}",
+                    "reason": "No available trainer / Gym busy"
+                })
+                ledger.notify(
+                    client.id,
+                    f"Could not auto-schedule {day_name} at {slot.start_time}: No available trainer or gym full."
+                )
+
+    resolved_count = sum(len(paths) for paths in augmented.values())
+    return {
+        "success_count": initial_success_count,
+        "failed_assignments": failed_assignments,
+        "resolved_count": resolved_count,
+        "resolution_details": resolution_details
+    }
+
+
+# Pluggable solvers for auto-scheduling: name -> (solver, needs_repair_phase)
+SOLVERS = {
+    "greedy": (schedule_greedy, True),
+    "matching": (schedule_matching, False),
+}
@@ -91,6 +91,26 @@ class Appointment(AppointmentBase):
     class Config:
         from_attributes = True
 
+class AppointmentBatch(BaseModel):
+    appointments: List[AppointmentCreate]
+
+class WaitlistJoin(BaseModel):
+    client_email: str
+    start_time: str
+
+class WaitlistEntry(BaseModel):
+    id: int
+    client_id: int
+    start_time: str
+    status: str
+    appointment_id: Optional[int] = None
+    created_at: str
+    promoted_at: Optional[str] = None
+    position: Optional[int] = None # Place in the queue while waiting
+
+    class Config:
+        from_attributes = True
+
 # --- Trainer Schemas ---
 class TrainerBase(BaseModel):
     name: str
@@ -0,0 +1,118 @@
+"""
+In-memory index of trainer shifts for the booking and scheduling hot paths.
+
+The index is process-local: it is kept current by the endpoints of the
+process that serves them, and nothing tells other processes. That is
+correct for the supported deployment, a single API worker. With several
+workers, or after generate_dataset.py / other scripts write availabilities
+straight to the DB, an index can go stale until POST /admin/shift-index/rebuild
+(or a restart) reloads it. Checks that guard a write (the 3-trainers-per-shift
+cap when adding an availability) therefore query the DB, not this index.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+
+class ShiftIndex:
+    """
+    Process-wide index of trainer shifts: (day_of_week, "HH:MM") -> trainer ids.
+
+    Built once from the availabilities table and kept up to date by the
+    availability / trainer endpoints, so "who is working at this slot" is a
+    dict lookup instead of a scan over every trainer's availabilities.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._shifts = defaultdict(dict)  # day_of_week -> {availability_id: (start_time, end_time, trainer_id)}
+        self._slots = defaultdict(dict)   # day_of_week -> {start_time: (trainer_id, ...)}
+
+    def load(self, db: Session):
+        rows = db.query(
+            models.Availability.id,
+            models.Availability.trainer_id,
+            models.Availability.day_of_week,
+            models.Availability.start_time,
+            models.Availability.end_time
+        ).join(models.Trainer, models.Trainer.id == models.Availability.trainer_id).all()
+
+        with self._lock:
+            self._shifts.clear()
+            self._slots.clear()
+            for availability_id, trainer_id, day_of_week, start_time, end_time in rows:
+                self._shifts[day_of_week][availability_id] = (start_time, end_time, trainer_id)
+            self._loaded = True
+        logger.info(f"Shift index loaded: {len(rows)} shifts")
+
+    def ensure_loaded(self, db: Session):
+        if not self._loaded:
+            self.load(db)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._shifts.clear()
+            self._slots.clear()
+
+    # --- Incremental Updates ---
+
+    def add(self, availability: models.Availability):
+        if not self._loaded:
+            return # Picked up by the next full load
+        with self._lock:
+            self._shifts[availability.day_of_week][availability.id] = (
+                availability.start_time, availability.end_time, availability.trainer_id
+            )
+            self._slots.pop(availability.day_of_week, None)
+
+    def remove(self, availability: models.Availability):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._shifts[availability.day_of_week].pop(availability.id, None)
+            self._slots.pop(availability.day_of_week, None)
+
+    def remove_trainer(self, trainer_id: int):
+        if not self._loaded:
+            return
+        with self._lock:
+            for day_of_week, day_shifts in self._shifts.items():
+                stale = [a_id for a_id, shift in day_shifts.items() if shift[2] == trainer_id]
+                for a_id in stale:
+                    del day_shifts[a_id]
+                if stale:
+                    self._slots.pop(day_of_week, None)
+
+    # --- Lookups ---
+
+    def trainers_at(self, day_of_week: int, start_time: str):
+        """Trainer ids whose shift covers start_time on day_of_week, lowest id first."""
+        day_slots = self._slots.get(day_of_week)
+        if day_slots is not None:
+            trainers = day_slots.get(start_time)
+            if trainers is not None:
+                return trainers
+
+        with self._lock:
+            trainers = tuple(sorted({
+                trainer_id for shift_start, shift_end, trainer_id in self._shifts.get(day_of_week, {}).values()
+                if shift_start <= start_time and shift_end > start_time
+            }))
+            self._slots[day_of_week][start_time] = trainers
+        return trainers
+
+    def trainer_ids(self):
+        """Every trainer with at least one shift."""
+        with self._lock:
+            return {shift[2] for day_shifts in self._shifts.values() for shift in day_shifts.values()}
+
+
+shift_index = ShiftIndex()
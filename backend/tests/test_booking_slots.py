@@ -0,0 +1,135 @@
+"""
+Slot strings: the same slot written differently ('…T09:00', '…T09:00:00.000',
+'…T09:00:00+00:00') must hit the same occupancy, lock and usage rows as
+'…T09:00:00', for single and batch bookings. Runs in-process against a
+throwaway SQLite database.
+
+    cd backend && python -m pytest -q tests/test_booking_slots.py
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app binds its engine at import time: choose the database first
+SCRATCH_DIR = tempfile.mkdtemp(prefix='gym-slots-')
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH_DIR, 'slots.db')}")
+os.environ.setdefault("WHATSAPP_MOCK_LOG", os.path.join(SCRATCH_DIR, "whatsapp_mock.log"))
+os.environ["OUTBOX_WORKERS"] = "0"
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+from fastapi import HTTPException
+
+import booking
+import client_usage
+import models
+import occupancy
+import schemas
+from database import SessionLocal, engine
+from generate_dataset import generate
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    generate(engine, clients=10, trainers=5, shift_density=1.0, seed=11)
+    db = SessionLocal()
+    for client in db.query(models.User).filter(models.User.role == "client").all():
+        client.workout_credits, client.weekly_workout_limit = 20, 7
+    db.commit()
+    db.close()
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def next_monday_at(hour: int) -> str:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    monday = today - timedelta(days=today.weekday()) + timedelta(days=7)
+    return monday.strftime("%Y-%m-%d") + f"T{hour:02d}:00:00"
+
+
+def people(db):
+    clients = [c.email for c in db.query(models.User).filter(models.User.role == "client").order_by(models.User.id)]
+    trainers = [t.id for t in db.query(models.Trainer).order_by(models.Trainer.id)]
+    return clients, trainers
+
+
+def appointment(email, trainer_id, start_time):
+    return schemas.AppointmentCreate(trainer_id=trainer_id, client_name="Slots", client_email=email, start_time=start_time)
+
+
+def assert_counters_in_step(db):
+    # Every counter row under the canonical key, and equal to a recount from appointments
+    stored = {(r.start_time, r.total_clients, r.active_trainers) for r in db.query(models.SlotOccupancy).filter(models.SlotOccupancy.total_clients > 0)}
+    stored_trainers = {(r.start_time, r.trainer_id, r.clients) for r in db.query(models.SlotTrainerOccupancy).filter(models.SlotTrainerOccupancy.clients > 0)}
+    occupancy.rebuild(db)
+    db.flush()
+    assert stored == {(r.start_time, r.total_clients, r.active_trainers) for r in db.query(models.SlotOccupancy).filter(models.SlotOccupancy.total_clients > 0)}
+    assert stored_trainers == {(r.start_time, r.trainer_id, r.clients) for r in db.query(models.SlotTrainerOccupancy).filter(models.SlotTrainerOccupancy.clients > 0)}
+    assert client_usage.audit(db) == []
+    db.rollback()
+
+
+def test_single_bookings_share_the_slot_across_string_forms(db):
+    clients, trainers = people(db)
+    slot = next_monday_at(9)
+
+    for i, form in enumerate([slot, slot[:-3], slot + ".000"]):
+        booking.create_booking(db, appointment(clients[i], trainers[i], form))
+
+    # A 4th trainer in the same slot, written another way: still the 4th
+    with pytest.raises(HTTPException) as e:
+        booking.create_booking(db, appointment(clients[3], trainers[3], slot + "+00:00"))
+    assert "Max 3 trainers" in e.value.detail
+
+    # Same client, same slot, other form: duplicate
+    with pytest.raises(HTTPException) as e:
+        booking.create_booking(db, appointment(clients[0], trainers[1], slot[:-3]))
+    assert e.value.detail == booking.DUPLICATE_BOOKING
+
+    assert {row.start_time for row in db.query(models.SlotOccupancy)} == {slot}
+    assert occupancy.slot(db, slot).total_clients == 3
+    assert_counters_in_step(db)
+
+
+def test_batch_uses_canonical_slot_keys(db):
+    clients, trainers = people(db)
+    slot = next_monday_at(10)
+    booking.create_booking(db, appointment(clients[0], trainers[0], slot))
+
+    results = booking.create_batch(db, [
+        appointment(clients[1], trainers[1], slot + ".000"),
+        appointment(clients[2], trainers[2], slot[:-3]),
+        appointment(clients[3], trainers[3], slot + "+00:00"),
+    ])
+
+    assert [detail for _, detail in results][:2] == [None, None]
+    assert "Max 3 trainers" in results[2][1]
+    assert {a.start_time for a in db.query(models.Appointment)} == {slot}
+    assert occupancy.slot(db, slot).total_clients == 3
+    assert_counters_in_step(db)
+
+
+def test_batch_rejects_duplicates_written_differently(db):
+    clients, trainers = people(db)
+    slot = next_monday_at(11)
+    other_slot = next_monday_at(16)
+    booking.create_booking(db, appointment(clients[0], trainers[0], slot))
+
+    results = booking.create_batch(db, [
+        appointment(clients[0], trainers[1], slot[:-3]),            # already booked in the DB
+        appointment(clients[1], trainers[1], other_slot + ".000"),
+        appointment(clients[1], trainers[2], other_slot[:-3]),      # same client twice in this batch
+    ])
+
+    assert [detail for _, detail in results] == [booking.DUPLICATE_BOOKING, None, booking.DUPLICATE_BOOKING]
+    assert db.query(models.Appointment).filter(models.Appointment.client_email == clients[0]).count() == 1
+    assert db.query(models.Appointment).filter(models.Appointment.client_email == clients[1]).count() == 1
+    assert_counters_in_step(db)
@@ -0,0 +1,196 @@
+"""
+Ledger writes: the auto-scheduler plans from a snapshot, so whatever
+commits between WeekLedger.load and write_ledgers (bookings, refunds,
+resupplies) must survive the write, and planned items that no longer fit
+are dropped instead of overwriting it. Runs in-process against a
+throwaway SQLite database.
+
+    cd backend && python -m pytest -q tests/test_ledger_write.py
+"""
+import os
+import sys
+import tempfile
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app binds its engine at import time: choose the database first
+SCRATCH_DIR = tempfile.mkdtemp(prefix='gym-ledger-')
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH_DIR, 'ledger.db')}")
+os.environ.setdefault("WHATSAPP_MOCK_LOG", os.path.join(SCRATCH_DIR, "whatsapp_mock.log"))
+os.environ["OUTBOX_WORKERS"] = "0"
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+
+import booking
+import models
+import occupancy
+import scheduler
+import schemas
+from database import SessionLocal, engine
+from generate_dataset import generate
+from week_state import MAX_CLIENTS_PER_SLOT, MAX_CLIENTS_PER_TRAINER, MAX_TRAINERS_PER_SLOT
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    generate(engine, clients=80, trainers=6, shift_density=0.8, seed=5)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def next_week() -> datetime:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=today.weekday()) + timedelta(days=7)
+
+
+def planned_ledger(db):
+    ledger = scheduler.WeekLedger.load(db, next_week())
+    scheduler.schedule_greedy(ledger)
+    planned = Counter(b.client_id for b in ledger.new_bookings)
+    assert planned, "dataset should leave something to schedule"
+    return ledger, planned
+
+
+def set_credits(client_id: int, credits: int):
+    # Another request, committed between the ledger's load and its write
+    other = SessionLocal()
+    other.get(models.User, client_id).workout_credits = credits
+    other.commit()
+    other.close()
+
+
+def credits_of(db, client_id: int) -> int:
+    return db.query(models.User.workout_credits).filter(models.User.id == client_id).scalar()
+
+
+def booked(db, client_id: int) -> int:
+    return db.query(models.Appointment).filter(models.Appointment.client_id == client_id).count()
+
+
+def book_elsewhere(client, trainer_id: int, slot: str):
+    # A regular booking, committed between the ledger's load and its write
+    other = SessionLocal()
+    booking.create_booking(other, schemas.AppointmentCreate(
+        trainer_id=trainer_id, client_name="Walk-in", client_email=client.email, start_time=slot
+    ))
+    other.close()
+
+
+def full_planned_slot(ledger):
+    """A slot the plan fills to the 6-client cap with new bookings, and its planned clients."""
+    new_by_slot = defaultdict(list)
+    for b in ledger.new_bookings:
+        new_by_slot[b.start_time].append(b)
+    for slot, planned in new_by_slot.items():
+        if len(ledger.bookings_at(slot)) == MAX_CLIENTS_PER_SLOT and len(planned) == MAX_CLIENTS_PER_SLOT:
+            return slot, planned
+    raise AssertionError("dataset should fill at least one slot")
+
+
+def assert_within_caps(db):
+    occupancy.rebuild(db)
+    db.flush()
+    for row in db.query(models.SlotOccupancy):
+        assert row.total_clients <= MAX_CLIENTS_PER_SLOT
+        assert row.active_trainers <= MAX_TRAINERS_PER_SLOT
+    for row in db.query(models.SlotTrainerOccupancy):
+        assert row.clients <= MAX_CLIENTS_PER_TRAINER
+    db.rollback()
+
+
+def test_credit_changes_after_load_are_kept(db):
+    ledger, planned = planned_ledger(db)
+    client_id, count = planned.most_common(1)[0]
+    loaded = next(c.workout_credits for c in ledger.clients if c.id == client_id)
+    set_credits(client_id, loaded + 5) # Resupplied meanwhile
+
+    dropped = ledger.write(db)
+
+    assert dropped == []
+    assert credits_of(db, client_id) == loaded + 5 - count
+    assert booked(db, client_id) == count
+
+
+def test_bookings_beyond_current_balance_are_dropped(db):
+    ledger, planned = planned_ledger(db)
+    client_id, count = planned.most_common(1)[0]
+    assert count >= 2
+    set_credits(client_id, 1) # Spent elsewhere meanwhile
+
+    dropped = ledger.write(db)
+
+    assert credits_of(db, client_id) == 0
+    assert booked(db, client_id) == 1
+    assert [d["reason"] for d in dropped] == ["Insufficient credits"] * (count - 1)
+    notified = db.query(models.Notification).filter(
+        models.Notification.user_id == client_id,
+        models.Notification.message.like("Could not auto-schedule%Insufficient credits.")
+    ).count()
+    assert notified == count - 1
+
+
+def test_slot_filled_meanwhile_drops_planned_bookings(db):
+    ledger, _ = planned_ledger(db)
+    slot, planned = full_planned_slot(ledger)
+    walk_in = next(
+        c for c in ledger.clients
+        if c.id not in {b.client_id for b in planned} and c.workout_credits > 0 and c.weekly_workout_limit > 0
+    )
+    book_elsewhere(walk_in, planned[0].trainer_id, slot)
+
+    dropped = ledger.write(db)
+
+    assert [d["reason"] for d in dropped] == ["No available trainer / Gym busy"]
+    assert occupancy.slot(db, slot).total_clients == MAX_CLIENTS_PER_SLOT
+    assert db.query(models.Appointment).filter(
+        models.Appointment.client_id == walk_in.id,
+        models.Appointment.start_time == slot
+    ).count() == 1
+    assert_within_caps(db)
+
+
+def test_client_booked_meanwhile_is_not_booked_twice(db):
+    ledger, _ = planned_ledger(db)
+    slot, planned = full_planned_slot(ledger)
+    client = next(c for c in ledger.clients if c.id == planned[0].client_id)
+    book_elsewhere(client, planned[0].trainer_id, slot)
+
+    dropped = ledger.write(db)
+
+    assert [d["reason"] for d in dropped] == ["Already booked at this time"]
+    assert db.query(models.Appointment).filter(
+        models.Appointment.client_id == client.id,
+        models.Appointment.start_time == slot
+    ).count() == 1
+    assert_within_caps(db)
+
+
+def test_move_of_appointment_cancelled_meanwhile_is_dropped(db):
+    ledger, _ = planned_ledger(db)
+    ledger.write(db)
+    ledger = scheduler.WeekLedger.load(db, next_week())
+    scheduler.resolve_blockers(ledger)
+    assert ledger.moved_bookings, "dataset should need at least one blocker move"
+    appointment_id = next(iter(ledger.moved_bookings))
+    origin_slot, _ = ledger.moved_from[appointment_id]
+
+    other = SessionLocal()
+    other.get(models.Appointment, appointment_id).status = "cancelled"
+    occupancy.refresh(other, [origin_slot])
+    other.commit()
+    other.close()
+
+    dropped = ledger.write(db)
+
+    assert "Appointment changed while scheduling" in [d["reason"] for d in dropped]
+    appointment = db.get(models.Appointment, appointment_id, populate_existing=True)
+    assert (appointment.status, appointment.start_time) == ("cancelled", origin_slot)
+    assert_within_caps(db)
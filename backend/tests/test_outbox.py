@@ -0,0 +1,257 @@
+"""
+Notification outbox worker, run in-process against a throwaway SQLite
+database and a stub sender (no Twilio, no running server).
+
+    cd backend && python -m pytest -q tests/test_outbox.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app binds its engine at import time: choose the database first
+SCRATCH_DIR = tempfile.mkdtemp(prefix='gym-outbox-')
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH_DIR, 'outbox.db')}")
+os.environ.setdefault("WHATSAPP_MOCK_LOG", os.path.join(SCRATCH_DIR, "whatsapp_mock.log"))
+os.environ["OUTBOX_WORKERS"] = "0"
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+from fastapi import HTTPException
+
+import booking
+import models
+import outbox
+import schemas
+import whatsapp_service
+from database import SessionLocal, engine
+from generate_dataset import generate
+
+
+class StubSender:
+    """Records sends; fails the first `failures` calls per message body."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.sent = []
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, to_number: str, body: str):
+        with self._lock:
+            self.calls[body] = self.calls.get(body, 0) + 1
+            if self.calls[body] <= self.failures:
+                raise RuntimeError("stub: Twilio unavailable")
+            self.sent.append((to_number, body))
+        return "stub"
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    generate(engine, clients=8, trainers=3, shift_density=1.0, seed=7)
+    yield
+    db = SessionLocal()
+    db.query(models.OutboxMessage).delete()
+    db.commit()
+    db.close()
+
+
+def enqueue(*bodies):
+    db = SessionLocal()
+    try:
+        for body in bodies:
+            outbox.enqueue(db, "+15550000000", body)
+        db.commit()
+    finally:
+        db.close()
+
+
+def statuses():
+    db = SessionLocal()
+    try:
+        return {m.body: (m.status, m.attempts) for m in db.query(models.OutboxMessage).all()}
+    finally:
+        db.close()
+
+
+def test_drain_sends_due_messages():
+    enqueue("a", "b", "c")
+    sender = StubSender()
+    worker = outbox.OutboxWorker(sender=sender, workers=0, rate=100)
+
+    assert worker.drain_once() == 3
+    assert sorted(body for _, body in sender.sent) == ["a", "b", "c"]
+    assert set(statuses().values()) == {(outbox.SENT, 1)}
+    assert worker.drain_once() == 0
+
+
+def test_failed_send_backs_off_then_dead_letters(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    enqueue("flaky")
+    sender = StubSender(failures=10)
+    worker = outbox.OutboxWorker(sender=sender, workers=0, rate=100)
+
+    # First failure: back to pending, not due again until the backoff has passed
+    assert worker.drain_once() == 1
+    db = SessionLocal()
+    message = db.query(models.OutboxMessage).one()
+    assert message.status == outbox.PENDING and message.attempts == 1
+    assert "Twilio unavailable" in message.last_error
+    assert datetime.fromisoformat(message.next_attempt_at) > datetime.now() + timedelta(seconds=outbox.BACKOFF_BASE - 1)
+    db.close()
+    assert worker.drain_once() == 0
+
+    # Retry immediately from here on: attempts 2 and 3 fail, then it is dead
+    monkeypatch.setattr(outbox, "BACKOFF_BASE", 0.0)
+    db = SessionLocal()
+    db.query(models.OutboxMessage).update({"next_attempt_at": datetime.now().isoformat()})
+    db.commit()
+    db.close()
+    assert worker.drain_once() == 1
+    assert worker.drain_once() == 1
+    assert statuses()["flaky"] == (outbox.DEAD, 3)
+    assert worker.drain_once() == 0
+    assert sender.sent == []
+
+    # Requeue from the dead letters: the sender recovered
+    db = SessionLocal()
+    message_id = db.query(models.OutboxMessage.id).scalar()
+    assert outbox.requeue(db, message_id)
+    db.close()
+    sender.failures = 0
+    sender.calls.clear()
+    assert worker.drain_once() == 1
+    assert statuses()["flaky"] == (outbox.SENT, 1)
+
+
+def test_backoff_doubles_up_to_cap():
+    assert [outbox.backoff(n) for n in (1, 2, 3)] == [outbox.BACKOFF_BASE, outbox.BACKOFF_BASE * 2, outbox.BACKOFF_BASE * 4]
+    assert outbox.backoff(50) == outbox.BACKOFF_MAX
+
+
+def test_abandoned_claim_is_picked_up_again():
+    enqueue("stuck")
+    db = SessionLocal()
+    db.query(models.OutboxMessage).update({
+        "status": outbox.SENDING,
+        "attempts": 1,
+        "claimed_at": (datetime.now() - timedelta(seconds=outbox.CLAIM_TIMEOUT + 1)).isoformat()
+    })
+    db.commit()
+    db.close()
+
+    sender = StubSender()
+    assert outbox.OutboxWorker(sender=sender, workers=0, rate=100).drain_once() == 1
+    assert statuses()["stuck"] == (outbox.SENT, 2)
+
+
+def test_rate_limiter_spaces_sends():
+    limiter = outbox.RateLimiter(rate=20)
+    started = time.monotonic()
+    for _ in range(30):
+        limiter.acquire()
+    # 20 from the initial burst, the other 10 at 20/s
+    assert time.monotonic() - started >= 0.45
+
+
+def test_worker_pool_sends_each_message_once():
+    bodies = [f"m{i}" for i in range(25)]
+    enqueue(*bodies)
+    sender = StubSender()
+    worker = outbox.OutboxWorker(sender=sender, workers=3, rate=200)
+    worker.start()
+    try:
+        deadline = time.monotonic() + 10
+        while len(sender.sent) < len(bodies) and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+
+    assert sorted(body for _, body in sender.sent) == sorted(bodies)
+    assert set(statuses().values()) == {(outbox.SENT, 1)}
+
+
+def test_booking_writes_confirmation_in_its_transaction():
+    db = SessionLocal()
+    try:
+        client = db.query(models.User).filter(models.User.role == "client").order_by(models.User.id).first()
+        trainer = db.query(models.Trainer).order_by(models.Trainer.id).first()
+        trainer_name = trainer.name
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        slot = (today - timedelta(days=today.weekday()) + timedelta(days=8)).strftime("%Y-%m-%d") + "T09:00:00"
+        appointment = schemas.AppointmentCreate(trainer_id=trainer.id, client_name="Outbox", client_email=client.email, start_time=slot)
+
+        booking.create_booking(db, appointment)
+        # Duplicate: rejected and rolled back, so no second message
+        with pytest.raises(HTTPException):
+            booking.create_booking(db, appointment)
+    finally:
+        db.close()
+
+    messages = statuses()
+    assert len(messages) == 1
+    body, (status, attempts) = next(iter(messages.items()))
+    assert status == outbox.PENDING and attempts == 0
+    assert "Hello Outbox" in body and trainer_name in body
+
+    sender = StubSender()
+    assert outbox.OutboxWorker(sender=sender, workers=0, rate=100).drain_once() == 1
+    assert len(sender.sent) == 1
+
+
+def test_burst_reuses_pooled_connection_to_stub_server(monkeypatch):
+    server = whatsapp_service.stub_server(port=0, fail_every=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", "ACstub")
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "stub")
+    monkeypatch.setenv("TWILIO_API_BASE", f"http://127.0.0.1:{server.server_address[1]}")
+    whatsapp_service.sender.reset_stats()
+    try:
+        enqueue(*[f"burst{i}" for i in range(8)])
+        # The default sender (whatsapp_service.deliver) on the shared client
+        worker = outbox.OutboxWorker(workers=0, rate=100)
+        assert worker.drain_once() == 8
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    stats = whatsapp_service.sender.stats()
+    assert (stats["sent"], stats["errors"]) == (6, 2)
+    assert stats["avg_latency_ms"] is not None
+    assert len(server.received) == 8 and server.received[0]["To"] == "whatsapp:+15550000000"
+    # One kept-alive connection for the whole burst (a 500 doesn't close it)
+    assert len(server.connections) == 1
+    assert sorted(s for s, _ in statuses().values()) == [outbox.PENDING] * 2 + [outbox.SENT] * 6
+
+
+def test_mock_mode_buffers_messages_and_writes_log_in_batches(monkeypatch):
+    monkeypatch.delenv("TWILIO_ACCOUNT_SID", raising=False)
+    whatsapp_service.mock_log.clear()
+    bodies = [f"mock{i}" for i in range(50)]
+    enqueue(*bodies)
+    worker = outbox.OutboxWorker(workers=0, rate=1000)
+    assert worker.drain_once(limit=100) == 50
+
+    recent = whatsapp_service.mock_log.recent()
+    assert [m["body"] for m in recent] == bodies
+    assert whatsapp_service.mock_log.recent(limit=2, to_number="+15550000000")[-1]["body"] == "mock49"
+
+    whatsapp_service.mock_log.flush()
+    with open(whatsapp_service.mock_log.path) as f:
+        logged = f.read()
+    assert all(f"BODY: {body}\n" in logged for body in bodies)
+
+
+def test_mock_log_rotates_by_size(tmp_path):
+    log = whatsapp_service.MockLog(path=str(tmp_path / "mock.log"), max_bytes=1000, backups=2, recent_size=5)
+    for i in range(40):
+        log.record("whatsapp:+1", "whatsapp:+2", f"m{i}", "x" * 99)
+        log.flush()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["mock.log", "mock.log.1", "mock.log.2"]
+    assert all(p.stat().st_size <= 1000 for p in tmp_path.iterdir())
+    assert [m["body"] for m in log.recent()] == [f"m{i}" for i in range(35, 40)]
@@ -0,0 +1,100 @@
+"""
+Waitlist: only slots a client could ever book can be queued for, and a
+promoted waiter gets the same booking records as a regular booking
+(appointment link, in-app notification, WhatsApp outbox message). Runs
+in-process against a throwaway SQLite database.
+
+    cd backend && python -m pytest -q tests/test_waitlist.py
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app binds its engine at import time: choose the database first
+SCRATCH_DIR = tempfile.mkdtemp(prefix='gym-waitlist-')
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH_DIR, 'waitlist.db')}")
+os.environ.setdefault("WHATSAPP_MOCK_LOG", os.path.join(SCRATCH_DIR, "whatsapp_mock.log"))
+os.environ["OUTBOX_WORKERS"] = "0"
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import models
+import waitlist
+from database import SessionLocal, engine
+from generate_dataset import generate
+
+TUESDAY_9 = "2031-03-04T09:00:00"
+NO_SHIFT_DAY = 3 # Availability.day_of_week without trainers in these tests
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    generate(engine, clients=20, trainers=3, shift_density=1.0, seed=1)
+    db = SessionLocal()
+    db.query(models.Availability).filter(models.Availability.day_of_week == NO_SHIFT_DAY).delete()
+    db.commit()
+    db.close()
+    main.shift_index.invalidate()
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def clients_with_credits(client):
+    return [u for u in client.get("/users/").json() if u["role"] == "client" and u["workout_credits"] > 0]
+
+
+def fill_slot(client, users, slot):
+    booked = 0
+    for user in users:
+        for trainer_id in (1, 2, 3):
+            response = client.post("/appointments/", json={
+                "trainer_id": trainer_id, "client_name": "Full", "client_email": user["email"], "start_time": slot
+            })
+            if response.status_code == 200:
+                booked += 1
+                break
+        if booked == 6:
+            return
+    raise AssertionError("could not fill the slot")
+
+
+@pytest.mark.parametrize("slot, detail", [
+    ("2031-03-04T13:00:00", "Clients can only book between 07:00-12:00 or 15:00-20:00."),
+    ("2031-03-04T21:00:00", "Clients can only book between 07:00-12:00 or 15:00-20:00."),
+    ("2031-03-06T09:00:00", "No trainer is on shift at this time."),
+])
+def test_unbookable_slots_cannot_be_joined(client, slot, detail):
+    user = clients_with_credits(client)[0]
+    response = client.post("/appointments/waitlist", json={"client_email": user["email"], "start_time": slot})
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail
+
+
+def test_promotion_links_appointment_and_queues_whatsapp(client):
+    users = clients_with_credits(client)
+    fill_slot(client, users, TUESDAY_9)
+    waiter = users[8]
+    assert client.post("/appointments/waitlist", json={"client_email": waiter["email"], "start_time": TUESDAY_9}).status_code == 200
+
+    db = SessionLocal()
+    outbox_before = db.query(models.OutboxMessage).count()
+    db.close()
+
+    cancelled = next(a for a in client.get("/appointments/").json() if a["start_time"] == TUESDAY_9)
+    assert client.put(f"/appointments/{cancelled['id']}/cancel").status_code == 200
+
+    db = SessionLocal()
+    entry = db.query(models.WaitlistEntry).one()
+    assert entry.status == waitlist.PROMOTED
+    appointment = db.get(models.Appointment, entry.appointment_id)
+    assert (appointment.client_id, appointment.start_time) == (waiter["id"], TUESDAY_9)
+    assert db.query(models.OutboxMessage).count() == outbox_before + 1
+    db.close()
@@ -0,0 +1,197 @@
+"""
+Concurrent booking check.
+
+Fires parallel bookings through booking.create_booking (the POST /appointments/
+path) from many threads released at the same instant, then checks that every
+capacity invariant still holds:
+
+- slot storm: many clients race for one slot -> at most 6 clients, 2 per
+  trainer, 3 trainers
+- credit drain: one client with 2 credits books many slots at once -> credits
+  never go negative
+- weekly limit: one client with limit 2 books many slots at once -> at most 2
+
+Runs against a throwaway SQLite database by default; pass --database-url to
+point it at a scratch Postgres database (it is WIPED by the dataset generator).
+
+Usage:
+    python verify_concurrent_booking.py
+    python verify_concurrent_booking.py --threads 64 --database-url postgresql://.../gym_scratch
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Configure Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("verify_concurrent_booking")
+
+
+def race(attempts):
+    """Books each AppointmentCreate in its own thread, all released at once. Returns status counts."""
+    from fastapi import HTTPException
+
+    import booking
+    from database import SessionLocal
+
+    statuses = Counter()
+    barrier = threading.Barrier(len(attempts))
+    lock = threading.Lock()
+
+    def worker(appointment):
+        db = SessionLocal()
+        try:
+            barrier.wait()
+            booking.create_booking(db, appointment)
+            status = 200
+        except HTTPException as e:
+            status = e.status_code
+        except Exception as e:
+            logger.error(f"Unexpected error: {e!r}")
+            status = 500
+        finally:
+            db.close()
+        with lock:
+            statuses[status] += 1
+
+    threads = [threading.Thread(target=worker, args=(a,)) for a in attempts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return statuses
+
+
+def check_invariants(db) -> list:
+    """Capacity violations across all slots and clients (empty = OK)."""
+    from sqlalchemy import func
+
+    import client_usage
+    import models
+
+    problems = []
+    active = (models.Appointment.status != "cancelled",)
+
+    for start_time, trainer_id, count in db.query(
+        models.Appointment.start_time, models.Appointment.trainer_id, func.count(models.Appointment.id)
+    ).filter(*active).group_by(models.Appointment.start_time, models.Appointment.trainer_id).all():
+        if count > 2:
+            problems.append(f"{start_time}: trainer {trainer_id} has {count} clients")
+
+    for start_time, count, trainers in db.query(
+        models.Appointment.start_time,
+        func.count(models.Appointment.id),
+        func.count(func.distinct(models.Appointment.trainer_id))
+    ).filter(*active).group_by(models.Appointment.start_time).all():
+        if count > 6:
+            problems.append(f"{start_time}: {count} clients")
+        if trainers > 3:
+            problems.append(f"{start_time}: {trainers} trainers")
+
+    for user in db.query(models.User).filter(models.User.workout_credits < 0).all():
+        problems.append(f"{user.email}: {user.workout_credits} credits")
+
+    for email, count in db.query(
+        models.Appointment.client_email, func.count(models.Appointment.id)
+    ).filter(*active).group_by(models.Appointment.client_email).all():
+        user = db.query(models.User).filter(models.User.email == email).first()
+        if user and count > user.weekly_workout_limit:
+            problems.append(f"{email}: {count} bookings, limit {user.weekly_workout_limit}")
+
+    for m in client_usage.audit(db):
+        problems.append(f"client {m['client_id']} week {m['week_start']}: counter {m['stored']}, expected {m['expected']}")
+
+    return problems
+
+
+def run(args) -> bool:
+    import models
+    import schemas
+    from database import SessionLocal, engine
+    from generate_dataset import generate
+
+    generate(engine, clients=args.threads + 2, trainers=6, shift_density=1.0, seed=args.seed)
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today - timedelta(days=today.weekday()) + timedelta(days=7)
+    # Client hours only: 07:00-12:00 and 15:00-20:00
+    week_slots = [
+        (week_start + timedelta(days=day)).strftime("%Y-%m-%d") + f"T{hour:02d}:00:00"
+        for day in range(7) for hour in (9, 10, 11, 16, 17, 18)
+    ]
+
+    db = SessionLocal()
+    try:
+        clients = db.query(models.User).filter(models.User.role == "client").order_by(models.User.id).all()
+        for client in clients:
+            client.workout_credits, client.weekly_workout_limit = 20, 7
+        drain, limited = clients[0], clients[1]
+        drain.workout_credits = 2
+        limited.weekly_workout_limit = 2
+        db.commit()
+        drain_email, limited_email = drain.email, limited.email
+        storm_emails = [c.email for c in clients[2:2 + args.threads]]
+    finally:
+        db.close()
+
+    def appointment(email, trainer_id, start_time):
+        return schemas.AppointmentCreate(trainer_id=trainer_id, client_name="Race", client_email=email, start_time=start_time)
+
+    # 1. Slot storm: every thread books the same slot, trainers round-robin
+    storm = race([appointment(email, i % 6 + 1, week_slots[0]) for i, email in enumerate(storm_emails)])
+    logger.info(f"Slot storm ({len(storm_emails)} clients, one slot): {dict(storm)}")
+
+    # 2. Credit drain: 2 credits, one booking per slot
+    drain_result = race([appointment(drain_email, 1, slot) for slot in week_slots[1:1 + args.threads]])
+    logger.info(f"Credit drain (2 credits): {dict(drain_result)}")
+
+    # 3. Weekly limit: limit 2, one booking per slot
+    limit_result = race([appointment(limited_email, 2, slot) for slot in week_slots[1:1 + args.threads]])
+    logger.info(f"Weekly limit (limit 2): {dict(limit_result)}")
+
+    db = SessionLocal()
+    try:
+        problems = check_invariants(db)
+    finally:
+        db.close()
+
+    expected = [
+        (storm[200] == 6, f"slot storm booked {storm[200]} clients, expected 6"),
+        (drain_result[200] == 2, f"credit drain booked {drain_result[200]}, expected 2"),
+        (limit_result[200] == 2, f"weekly limit booked {limit_result[200]}, expected 2"),
+        (not (storm[500] or drain_result[500] or limit_result[500]), "unexpected errors"),
+    ]
+    problems += [message for ok, message in expected if not ok]
+
+    for problem in problems:
+        logger.error(f"FAIL: {problem}")
+    if not problems:
+        logger.info("PASS: all capacity invariants held under concurrent bookings")
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race parallel bookings and check capacity invariants.")
+    parser.add_argument("--threads", type=int, default=32, help="Parallel bookings per scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="Scratch database to use (default: temporary SQLite file)")
+    args = parser.parse_args()
+
+    # The app binds its engine at import time: choose the database first
+    workdir = tempfile.mkdtemp(prefix="gym-race-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'race.db')}"
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(workdir)
+
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import requests
+import time
+import logging
+
+# Configure Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BASE_URL = "http://localhost:8000"
+
+def wait_for_job(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = requests.get(f"{BASE_URL}/jobs/{job_id}").json()
+        logger.info(f"Job {job_id}: {job['status']} ({job['progress']['done']}/{job['progress']['total']})")
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.5)
+    raise Exception(f"Job {job_id} did not finish in {timeout}s")
+
+def test_auto_schedule_job():
+    week_start = "2026-02-02"
+    r = requests.post(f"{BASE_URL}/jobs/auto-schedule", json={"week_start_date": week_start})
+    if r.status_code != 200:
+        raise Exception(f"Submit failed: {r.status_code} {r.text}")
+    job_id = r.json()["job_id"]
+    logger.info(f"Submitted job {job_id}")
+
+    job = wait_for_job(job_id)
+    if job["status"] != "succeeded":
+        raise Exception(f"Job failed: {job['error']}")
+    logger.info(f"Report: success_count={job['result']['success_count']}")
+
+def test_invalid_job():
+    r = requests.post(f"{BASE_URL}/jobs/auto-schedule", json={"week_start_date": "not-a-date"})
+    job = wait_for_job(r.json()["job_id"])
+    if job["status"] != "failed":
+        raise Exception("Expected invalid job to fail")
+    logger.info(f"PASS: Invalid job failed with '{job['error']}'")
+
+if __name__ == "__main__":
+    try:
+        test_auto_schedule_job()
+        test_invalid_job()
+        logger.info("✅ Jobs verified")
+    except Exception as e:
+        logger.error(f"❌ Failed: {e}")
@@ -0,0 +1,146 @@
+"""
+Query plan check for the appointment / notification indexes.
+
+Runs the hot endpoints against a throwaway SQLite database filled by the
+dataset generator and an auto-schedule run, captures every statement they
+send that reads appointments or notifications, and checks its
+EXPLAIN QUERY PLAN: each must search through an index (no full SCAN of
+either table), and a user's notifications must come back in index order
+(no temp B-tree for the ORDER BY).
+
+Usage:
+    python verify_query_plans.py
+    python verify_query_plans.py --verbose    # print every plan
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Configure Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("verify_query_plans")
+
+CHECKED_TABLES = ("appointments", "notifications")
+
+
+class StatementLog:
+    """Collects (step, statement, parameters) for statements that filter a checked table."""
+
+    def __init__(self):
+        self.step = None
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.step is None or executemany or "WHERE" not in statement:
+            return
+        if any(re.search(rf"\b(FROM|UPDATE|JOIN)\s+{table}\b", statement) for table in CHECKED_TABLES):
+            self.statements.append((self.step, statement, parameters))
+
+
+def plan_problems(plan) -> list:
+    problems = []
+    for detail in plan:
+        for table in CHECKED_TABLES:
+            if re.match(rf"SCAN {table}\b", detail) and "USING" not in detail:
+                problems.append(f"full scan of {table}")
+        if "USE TEMP B-TREE FOR ORDER BY" in detail and any(f" {t} " in detail for t in CHECKED_TABLES):
+            problems.append("sorts in a temp B-tree")
+    return problems
+
+
+def run(args) -> bool:
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import main
+    import models
+    from database import SessionLocal, async_engine, engine
+    from generate_dataset import generate
+
+    generate(engine, clients=args.clients, trainers=args.trainers, shift_density=0.7, seed=args.seed)
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today - timedelta(days=today.weekday()) + timedelta(days=7)
+    week = week_start.strftime("%Y-%m-%d")
+
+    client = TestClient(main.app)
+    report = client.post("/appointments/auto-schedule/range", json={"week_start_date": week, "weeks": 3}).json()
+    logger.info(f"Dataset: {args.clients} clients, {args.trainers} trainers, {report.get('success_count')} appointments")
+
+    db = SessionLocal()
+    try:
+        client_id = db.query(models.Appointment.client_id).order_by(models.Appointment.id).limit(1).scalar()
+        trainer_id = db.query(models.Trainer.id).order_by(models.Trainer.id).limit(1).scalar()
+    finally:
+        db.close()
+
+    log = StatementLog()
+    event.listen(engine, "before_cursor_execute", log)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", log)
+
+    # 1. Hot reads
+    log.step = "week capacity"
+    client.get(f"/schedule/capacity?week_start={week}")
+    log.step = "feasibility"
+    client.post("/schedule/feasibility", json={"week_start_date": week, "client_id": client_id})
+    log.step = "auto-schedule"
+    client.post("/appointments/auto-schedule", json={"week_start_date": week, "dry_run": True})
+    log.step = "notifications"
+    client.get(f"/users/{client_id}/notifications")
+
+    # 2. Bulk writes
+    log.step = "clear week"
+    client.delete(f"/appointments/week/{week}")
+    log.step = "fire trainer"
+    db = SessionLocal()
+    try:
+        main.fire_trainer_internal(trainer_id, db)
+    finally:
+        db.close()
+    log.step = None
+
+    # 3. Plans
+    failures = 0
+    with engine.connect() as conn:
+        for step, statement, parameters in log.statements:
+            plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()]
+            problems = plan_problems(plan)
+            failures += bool(problems)
+            if problems or args.verbose:
+                report_line = f"[{step}] {' '.join(statement.split())[:160]}"
+                log_plan = logger.error if problems else logger.info
+                log_plan(f"{'FAIL: ' + ', '.join(problems) if problems else 'OK'} {report_line}")
+                for detail in plan:
+                    log_plan(f"    {detail}")
+
+    logger.info(f"Checked {len(log.statements)} statements")
+    if not failures:
+        logger.info("PASS: every hot appointment / notification query uses an index")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that hot appointment queries use the composite indexes.")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--trainers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every statement")
+    args = parser.parse_args()
+
+    # The app binds its engine at import time: choose the database first
+    workdir = tempfile.mkdtemp(prefix="gym-plans-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'plans.db')}"
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(workdir)
+
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import client_usage
+import models
+import occupancy
+import outbox
+from week_state import MAX_CLIENTS_PER_TRAINER
+
+logger = logging.getLogger(__name__)
+
+# Entry statuses
+WAITING = "waiting"
+PROMOTED = "promoted"    # booked into a freed seat
+LEFT = "left"            # removed by the client / admin
+
+# Waiters passed over (no credits / weekly limit reached) keep their place;
+# each promotion looks at most this many entries of the slot.
+PROMOTION_SCAN_LIMIT = 20
+
+
+# --- Joining ---
+
+def join(db: Session, client: models.User, start_time: str) -> models.WaitlistEntry:
+    """Appends the client to the slot's queue (committed by the caller)."""
+    entry = models.WaitlistEntry(
+        client_id=client.id,
+        start_time=start_time,
+        status=WAITING,
+        created_at=datetime.now().isoformat()
+    )
+    db.add(entry)
+    db.flush()
+    return entry
+
+
+def find_waiting(db: Session, client_id: int, start_time: str):
+    return db.query(models.WaitlistEntry).filter(
+        models.WaitlistEntry.client_id == client_id,
+        models.WaitlistEntry.start_time == start_time,
+        models.WaitlistEntry.status == WAITING
+    ).first()
+
+
+def position(db: Session, entry: models.WaitlistEntry) -> int:
+    """1-based place in the slot's queue."""
+    ahead = db.query(func.count(models.WaitlistEntry.id)).filter(
+        models.WaitlistEntry.start_time == entry.start_time,
+        models.WaitlistEntry.status == WAITING,
+        models.WaitlistEntry.id < entry.id
+    ).scalar()
+    return ahead + 1
+
+
+# --- Promotion ---
+
+def ineligible_reason(db: Session, client: models.User, start_time: str):
+    """Why the waiter can't be booked right now (None if they can)."""
+    if client is None:
+        return "Client no longer exists"
+    if client.workout_credits <= 0:
+        return "No credits"
+
+    if client_usage.count(db, client.id, start_time) >= client.weekly_workout_limit:
+        return "Weekly limit reached"
+    return None
+
+
+def promote(db: Session, start_time: str, trainer_id: int):
+    """
+    Books the first eligible waiter of the slot into the seat just freed with
+    `trainer_id` (call under occupancy.lock after the cancellation is
+    flushed, commit afterwards).
+
+    Walks the queue in FIFO order: waiters already booked at the slot leave
+    the queue, waiters without credits / over their weekly limit keep their
+    place for the next free seat. Returns the new appointment, or None.
+    """
+    if datetime.fromisoformat(start_time) < datetime.now():
+        return None
+
+    if occupancy.trainer_clients(db, start_time, trainer_id) >= MAX_CLIENTS_PER_TRAINER:
+        return None
+
+    waiters = db.query(models.WaitlistEntry).filter(
+        models.WaitlistEntry.start_time == start_time,
+        models.WaitlistEntry.status == WAITING
+    ).order_by(models.WaitlistEntry.id).limit(PROMOTION_SCAN_LIMIT).all()
+
+    for entry in waiters:
+        client = db.query(models.User).filter(models.User.id == entry.client_id).with_for_update().first()
+
+        already_booked = client is not None and db.query(models.Appointment.id).filter(
+            models.Appointment.client_id == client.id,
+            models.Appointment.start_time == start_time,
+            models.Appointment.status != "cancelled"
+        ).first()
+        if client is None or already_booked:
+            entry.status = LEFT
+            continue
+
+        reason = ineligible_reason(db, client, start_time)
+        if reason:
+            logger.info(f"Waitlist {start_time}: skipping {client.email} ({reason})")
+            continue
+
+        appointment = models.Appointment(
+            trainer_id=trainer_id,
+            client_id=client.id,
+            client_name=client.first_name or client.email.split('@')[0],
+            client_email=client.email,
+            start_time=start_time,
+            status="confirmed"
+        )
+        db.add(appointment)
+        db.flush() # Assigns appointment.id for the entry below
+        client.workout_credits -= 1
+        occupancy.add(db, start_time, trainer_id, 1)
+        client_usage.add(db, client.id, start_time, 1)
+
+        entry.status = PROMOTED
+        entry.appointment_id = appointment.id
+        entry.promoted_at = datetime.now().isoformat()
+
+        slot_dt = datetime.fromisoformat(start_time)
+        db.add(models.Notification(
+            user_id=client.id,
+            message=f"A spot opened up: you are booked for {slot_dt.strftime('%A %d %b at %H:%M')} (1 credit used).",
+            created_at=datetime.now().isoformat()
+        ))
+        # Same WhatsApp confirmation as a regular booking, sent after commit by the outbox workers
+        outbox.enqueue_appointment_created(db, appointment)
+        logger.info(f"Waitlist {start_time}: promoted {client.email} (trainer {trainer_id})")
+        return appointment
+
+    return None
@@ -0,0 +1,211 @@
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+from shift_index import ShiftIndex, shift_index
+
+logger = logging.getLogger(__name__)
+
+# --- Capacity Rules (same as create_appointment) ---
+MAX_CLIENTS_PER_SLOT = 6
+MAX_CLIENTS_PER_TRAINER = 2
+MAX_TRAINERS_PER_SLOT = 3
+
+
+class WeekState:
+    """
+    Capacity state of one week as NumPy arrays.
+
+    - counts[slot, trainer]: clients booked with the trainer at the slot
+    - on_shift[slot, trainer]: trainer's shift covers the slot
+    - totals[slot] / active[slot]: clients booked / trainers with >= 1 client
+    - client_counts[client]: bookings of the client this week
+
+    Slots, trainers and clients get a row/column the first time they are
+    seen, so the arrays only cover what the week actually touches. Bulk
+    questions ("which trainers can take a client at these N slots") are
+    single masked array operations; WeekLedger uses the same arrays for
+    its per-booking updates.
+    """
+
+    def __init__(self, shifts: ShiftIndex, trainer_ids=()):
+        self.shifts = shifts
+
+        self.slot_index = {}      # slot iso -> row
+        self.trainer_ids = []     # column -> trainer id
+        self.trainer_index = {}   # trainer id -> column
+        self.client_index = {}    # client id -> position in client_counts
+
+        self.counts = np.zeros((64, max(len(trainer_ids), 8)), dtype=np.int16)
+        self.on_shift = np.zeros(self.counts.shape, dtype=bool)
+        self.totals = np.zeros(64, dtype=np.int16)
+        self.active = np.zeros(64, dtype=np.int16)
+        self.client_counts = np.zeros(256, dtype=np.int16)
+
+        for trainer_id in sorted(trainer_ids):
+            self.column(trainer_id)
+
+    @classmethod
+    def load(cls, db: Session, week_start: datetime, clients: bool = True):
+        """
+        Builds the week from one grouped query: (start_time, trainer_id) ->
+        bookings, plus one per client (skipped with clients=False). Shifts
+        come from the shift index.
+        """
+        week_end = week_start + timedelta(days=7)
+        shift_index.ensure_loaded(db)
+        in_week = (
+            models.Appointment.start_time >= week_start,
+            models.Appointment.start_time < week_end,
+            models.Appointment.status != "cancelled"
+        )
+
+        state = cls(shift_index, shift_index.trainer_ids())
+
+        slot_rows = db.query(
+            models.Appointment.start_time,
+            models.Appointment.trainer_id,
+            func.count(models.Appointment.id)
+        ).filter(*in_week).group_by(models.Appointment.start_time, models.Appointment.trainer_id).all()
+        for start_time, trainer_id, count in slot_rows:
+            slot_dt = datetime.fromisoformat(start_time)
+            row = state.row(start_time, slot_dt.weekday(), slot_dt.strftime("%H:%M"))
+            state.add(row, trainer_id, count)
+
+        if not clients:
+            return state
+
+        client_rows = db.query(
+            models.Appointment.client_id,
+            func.count(models.Appointment.id)
+        ).filter(*in_week).group_by(models.Appointment.client_id).all()
+        for client_id, count in client_rows:
+            state.add_client(client_id, count)
+
+        return state
+
+    # --- Indexing ---
+
+    def row(self, slot: str, day_of_week: int, start_time: str) -> int:
+        """Row of the slot; registered (with its on-shift mask) on first use."""
+        row = self.slot_index.get(slot)
+        if row is not None:
+            return row
+
+        row = len(self.slot_index)
+        if row >= self.counts.shape[0]:
+            self._grow(rows=row * 2)
+        self.slot_index[slot] = row
+        for trainer_id in self.shifts.trainers_at(day_of_week, start_time):
+            col = self.column(trainer_id) # May grow (replace) on_shift
+            self.on_shift[row, col] = True
+        return row
+
+    def column(self, trainer_id: int) -> int:
+        col = self.trainer_index.get(trainer_id)
+        if col is not None:
+            return col
+
+        col = len(self.trainer_ids)
+        if col >= self.counts.shape[1]:
+            self._grow(cols=col * 2)
+        self.trainer_ids.append(trainer_id)
+        self.trainer_index[trainer_id] = col
+        return col
+
+    def _client(self, client_id: int) -> int:
+        pos = self.client_index.get(client_id)
+        if pos is None:
+            pos = self.client_index[client_id] = len(self.client_index)
+            if pos >= len(self.client_counts):
+                self.client_counts = np.concatenate([self.client_counts, np.zeros_like(self.client_counts)])
+        return pos
+
+    def _grow(self, rows: int = None, cols: int = None):
+        old_rows, old_cols = self.counts.shape
+        rows, cols = max(rows or old_rows, old_rows), max(cols or old_cols, old_cols)
+
+        counts = np.zeros((rows, cols), dtype=self.counts.dtype)
+        counts[:old_rows, :old_cols] = self.counts
+        on_shift = np.zeros((rows, cols), dtype=bool)
+        on_shift[:old_rows, :old_cols] = self.on_shift
+        self.counts, self.on_shift = counts, on_shift
+
+        if rows > old_rows:
+            self.totals = np.concatenate([self.totals, np.zeros(rows - old_rows, dtype=self.totals.dtype)])
+            self.active = np.concatenate([self.active, np.zeros(rows - old_rows, dtype=self.active.dtype)])
+
+    # --- Updates ---
+
+    def add(self, row: int, trainer_id: int, delta: int = 1):
+        col = self.column(trainer_id)
+        before = self.counts[row, col]
+        after = before + delta
+        self.counts[row, col] = after
+        self.totals[row] += delta
+        if before == 0 and after > 0:
+            self.active[row] += 1
+        elif before > 0 and after == 0:
+            self.active[row] -= 1
+
+    def add_client(self, client_id: int, delta: int = 1):
+        pos = self._client(client_id) # May grow (replace) client_counts
+        self.client_counts[pos] += delta
+
+    # --- Queries ---
+
+    def trainer_clients(self, row: int, trainer_id: int) -> int:
+        col = self.trainer_index.get(trainer_id)
+        return 0 if col is None else int(self.counts[row, col])
+
+    def client_count(self, client_id: int) -> int:
+        pos = self.client_index.get(client_id)
+        return 0 if pos is None else int(self.client_counts[pos])
+
+    def available_mask(self, rows) -> np.ndarray:
+        """
+        (len(rows) x trainers) mask of trainers that can take one more client:
+        on shift, below 2 clients, and either already active or the slot has
+        fewer than 3 active trainers (6 per slot follows from 3 x 2).
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        n = len(self.trainer_ids)
+        counts = self.counts[rows, :n]
+        can_activate = (self.active[rows] < MAX_TRAINERS_PER_SLOT)[:, None]
+        return self.on_shift[rows, :n] & (counts < MAX_CLIENTS_PER_TRAINER) & ((counts > 0) | can_activate)
+
+    def available_trainers(self, row: int):
+        """Trainer ids that can take one more client at the slot, lowest id first."""
+        cols = np.flatnonzero(self.available_mask([row])[0])
+        return sorted(self.trainer_ids[c] for c in cols)
+
+    def seats_left(self, rows) -> np.ndarray:
+        """
+        Clients each slot can still take: spare seats of active trainers on
+        shift, plus 2 for every trainer that can still be activated.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        n = len(self.trainer_ids)
+        counts = self.counts[rows, :n]
+        on_shift = self.on_shift[rows, :n]
+
+        spare = np.where(on_shift & (counts > 0), MAX_CLIENTS_PER_TRAINER - counts, 0).clip(min=0).sum(axis=1)
+        idle = (on_shift & (counts == 0)).sum(axis=1)
+        new_trainers = np.minimum(idle, np.maximum(MAX_TRAINERS_PER_SLOT - self.active[rows], 0))
+        seats = spare + new_trainers * MAX_CLIENTS_PER_TRAINER
+        return np.maximum(np.minimum(seats, MAX_CLIENTS_PER_SLOT - self.totals[rows]), 0)
+
+    def trainer_seats(self, rows) -> np.ndarray:
+        """
+        (len(rows) x trainers) clients each trainer can still take at the
+        slot: 0 unless available_mask, else their spare seats, capped by
+        the slot's seats_left.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        n = len(self.trainer_ids)
+        spare = np.where(self.available_mask(rows), MAX_CLIENTS_PER_TRAINER - self.counts[rows, :n], 0)
+        return np.minimum(spare, self.seats_left(rows)[:, None])
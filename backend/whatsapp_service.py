@@ -1,6 +1,19 @@
 
 import os
+import atexit
+import json
 import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 
 # Configure Logging
@@ -9,15 +22,120 @@ logger = logging.getLogger(__name__)
 # --- CONFIGURATION ---
 # In a real app, these should be in a .env file
 # For testing, you use the Twilio Sandbox details.
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "")              # e.g. http://127.0.0.1:8099 for the stub server
+TWILIO_TIMEOUT = float(os.getenv("TWILIO_TIMEOUT", "10"))       # seconds per API request
+TWILIO_POOL_SIZE = int(os.getenv("TWILIO_POOL_SIZE", "8"))      # kept-alive connections (>= outbox workers)
+TWILIO_HOST = "https://api.twilio.com"
+
+MOCK_LOG_PATH = os.getenv("WHATSAPP_MOCK_LOG", "whatsapp_mock.log")
+MOCK_LOG_MAX_BYTES = int(os.getenv("WHATSAPP_MOCK_LOG_MAX_BYTES", str(5 * 1024 * 1024)))  # rotate beyond this size
+MOCK_LOG_BACKUPS = 3             # rotated files kept (whatsapp_mock.log.1 ... .3)
+MOCK_RECENT_SIZE = int(os.getenv("WHATSAPP_MOCK_RECENT", "500"))  # messages kept in memory for the admin API
+MOCK_BATCH_SIZE = 500            # messages written per open/append/close
+MOCK_QUEUE_SIZE = 10000          # pending lines before new ones are dropped from the file (not the buffer)
+
+
+class PooledHttpClient(TwilioHttpClient):
+    """
+    Twilio HTTP client on one kept-alive requests session, optionally
+    pointed at another base URL (the local stub server) instead of
+    api.twilio.com.
+    """
+
+    def __init__(self, api_base: str = "", pool_size: int = TWILIO_POOL_SIZE, timeout: float = TWILIO_TIMEOUT):
+        super().__init__(pool_connections=True, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.api_base = api_base.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        if self.api_base and url.startswith(TWILIO_HOST):
+            url = self.api_base + url[len(TWILIO_HOST):]
+        return super().request(method, url, *args, **kwargs)
+
+
+class WhatsAppSender:
+    """
+    Process-wide Twilio client, built once and reused by every send (the
+    outbox workers share it), with send counters for the admin API.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._config = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def client(self):
+        """The shared Client, or None without credentials (mock mode). Rebuilt if the configuration changes."""
+        account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+        auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+        if not account_sid or not auth_token:
+            return None
+        config = (account_sid, auth_token, api_base())
+        with self._lock:
+            if self._client is None or self._config != config:
+                self._client = Client(account_sid, auth_token, http_client=PooledHttpClient(api_base=config[2]))
+                self._config = config
+            return self._client
+
+    def send(self, client, from_number: str, to_number: str, body_text: str) -> str:
+        started = time.perf_counter()
+        try:
+            message = client.messages.create(from_=from_number, body=body_text, to=to_number)
+        except Exception as e:
+            self._record(started, error=e)
+            raise
+        self._record(started)
+        return message.sid
+
+    def record_mock(self):
+        with self._stats_lock:
+            self._mocked += 1
+
+    def _record(self, started: float, error: Exception = None):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            if error is None:
+                self._sent += 1
+                self._latency_total_ms += elapsed_ms
+                self._latency_max_ms = max(self._latency_max_ms, elapsed_ms)
+            else:
+                self._errors += 1
+                self._last_error = str(error)[:500]
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._sent = 0
+            self._errors = 0
+            self._mocked = 0
+            self._latency_total_ms = 0.0
+            self._latency_max_ms = 0.0
+            self._last_error = None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "sent": self._sent,
+                "errors": self._errors,
+                "mocked": self._mocked,
+                "avg_latency_ms": round(self._latency_total_ms / self._sent, 2) if self._sent else None,
+                "max_latency_ms": round(self._latency_max_ms, 2),
+                "last_error": self._last_error,
+                "api_base": api_base() or TWILIO_HOST
+            }
+
+
+def api_base() -> str:
+    # Read per call so tests / scripts can point an already imported module at the stub
+    return os.getenv("TWILIO_API_BASE", TWILIO_API_BASE)
+
+sender = WhatsAppSender()
 
 def get_twilio_client():
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    
-    if not account_sid or not auth_token:
-        return None
-    
-    return Client(account_sid, auth_token)
+    return sender.client()
 
 def send_whatsapp_message(to_number: str, body_text: str):
     """
@@ -26,6 +144,20 @@ def send_whatsapp_message(to_number: str, body_text: str):
     Args:
         to_number (str): The recipient's phone number (e.g., +1234567890).
         body_text (str): The message content.
+
+    Returns False instead of raising when Twilio rejects the message.
+    """
+    try:
+        deliver(to_number, body_text)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to send WhatsApp: {e}")
+        return False
+
+def deliver(to_number: str, body_text: str) -> str:
+    """
+    Sends one message and returns its Twilio SID ("mock" without credentials).
+    Raises on failure, so the notification outbox can retry it.
     """
     client = get_twilio_client()
     from_number = os.getenv("TWILIO_FROM_NUMBER", "whatsapp:+14155238886") # Default is Twilio Sandbox Number
@@ -41,18 +173,11 @@ def send_whatsapp_message(to_number: str, body_text: str):
         to_number = f"whatsapp:{to_number}"
 
     if client:
-        try:
-            message = client.messages.create(
-                from_=from_number,
-                body=body_text,
-                to=to_number
-            )
-            logger.info(f"WhatsApp message sent to {to_number}: {message.sid}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send WhatsApp: {e}")
-            return False
+        sid = sender.send(client, from_number, to_number, body_text)
+        logger.info(f"WhatsApp message sent to {to_number}: {sid}")
+        return sid
     else:
+        sender.record_mock()
         # MOCK MODE: Just print it if no credentials
         log_msg = (
             f"\n{'='*40}\n"
@@ -67,23 +192,106 @@ def send_whatsapp_message(to_number: str, body_text: str):
         else:
              logger.info(log_msg)
         
-        # Also append to a local log file for easy viewing
-        try:
-            with open("whatsapp_mock.log", "a") as f:
-                f.write(log_msg + "\n")
-        except Exception as e:
-            logger.error(f"Failed to write to mock log: {e}")
+        # Also append to a local log file for easy viewing (batched by a background writer)
+        mock_log.record(from_number, to_number, body_text, log_msg)
             
-        return True
+        return "mock"
 
-def notify_appointment_created(client_name: str, date: str, time: str, trainer_name: str, client_phone: str = None):
+class MockLog:
     """
-    Helper to format and send booking confirmation.
+    Mock-mode message log. record() only appends to an in-memory ring
+    buffer (recent messages for the admin API and tests) and a queue; a
+    background thread writes the queue to `path` in batches and rotates
+    the file beyond `max_bytes`.
     """
-    # If no phone provided, use test target or dummy
-    target = client_phone or os.getenv("TEST_WHATSAPP_TARGET") or "+15550000000"
-    
-    message = (
+
+    def __init__(self, path: str = MOCK_LOG_PATH, max_bytes: int = MOCK_LOG_MAX_BYTES, backups: int = MOCK_LOG_BACKUPS, recent_size: int = MOCK_RECENT_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._recent = deque(maxlen=recent_size)
+        self._queue = queue.Queue(maxsize=MOCK_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, from_number: str, to_number: str, body_text: str, text: str):
+        with self._lock:
+            self._recent.append({
+                "from": from_number,
+                "to": to_number,
+                "body": body_text,
+                "sent_at": datetime.now().isoformat()
+            })
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="whatsapp-mock-log", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(text + "\n")
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def recent(self, limit: int = None, to_number: str = None) -> list:
+        """Recent mock messages, oldest first (optionally only those to one number)."""
+        with self._lock:
+            messages = list(self._recent)
+        if to_number:
+            messages = [m for m in messages if m["to"].endswith(to_number)]
+        return messages[-limit:] if limit else messages
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+
+    def flush(self):
+        """Blocks until everything recorded so far is on disk."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            # Batch whatever queued up meanwhile (during a burst, everything since the last write)
+            while len(lines) < MOCK_BATCH_SIZE:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write("".join(lines))
+            except Exception as e:
+                logger.error(f"Failed to write to mock log: {e}")
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    def _write(self, text: str):
+        data = text.encode("utf-8")
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _rotate(self):
+        # whatsapp_mock.log -> .1 -> .2 ...; the oldest backup is dropped
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+mock_log = MockLog()
+atexit.register(mock_log.flush)
+
+def default_target() -> str:
+    # No per-client numbers yet: test target or dummy
+    return os.getenv("TEST_WHATSAPP_TARGET") or "+15550000000"
+
+def appointment_created_message(client_name: str, date: str, time: str, trainer_name: str) -> str:
+    return (
         f"💪 Gym Appointment Confirmed!\n"
         f"Hello {client_name},\n"
         f"You are booked with {trainer_name}.\n"
@@ -91,5 +299,81 @@ def notify_appointment_created(client_name: str, date: str, time: str, trainer_n
         f"⏰ Time: {time}\n"
         f"See you there!"
     )
-    
-    send_whatsapp_message(target, message)
+
+def notify_appointment_created(client_name: str, date: str, time: str, trainer_name: str, client_phone: str = None):
+    """
+    Helper to format and send booking confirmation.
+    """
+    # If no phone provided, use test target or dummy
+    target = client_phone or default_target()
+    send_whatsapp_message(target, appointment_created_message(client_name, date, time, trainer_name))
+
+
+# --- Stub Twilio server (local testing) ---
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Answers POST .../Messages.json like Twilio; every Nth message fails when fail_every is set."""
+    protocol_version = "HTTP/1.1" # keep-alive, so the pooled session reuses its connection
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        server = self.server
+        with server.lock:
+            server.received.append(form)
+            server.connections.add(self.client_address)
+            number = len(server.received)
+
+        if not self.path.endswith("/Messages.json"):
+            return self._reply(404, {"code": 20404, "message": "Not found", "status": 404})
+        if server.fail_every and number % server.fail_every == 0:
+            return self._reply(500, {"code": 20500, "message": "Stub failure", "status": 500})
+        self._reply(201, {
+            "sid": "SM" + uuid.uuid4().hex,
+            "status": "queued",
+            "from": form.get("From"),
+            "to": form.get("To"),
+            "body": form.get("Body")
+        })
+
+    def _reply(self, status: int, payload: dict):
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def stub_server(port: int = 8099, fail_every: int = 0) -> ThreadingHTTPServer:
+    """
+    Local stand-in for the Twilio messages API (port 0 picks a free port).
+    Point the app at it with TWILIO_API_BASE=http://127.0.0.1:<port> and any
+    TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN. The caller runs serve_forever();
+    `received` and `connections` record what arrived.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.received = []
+    server.connections = set()
+    server.fail_every = fail_every
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a local stub of the Twilio messages API.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fail-every", type=int, default=0, help="Fail every Nth message with a 500")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = stub_server(args.port, args.fail_every)
+    logger.info(f"Stub Twilio API on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
-import { Trainer, Availability } from '@/lib/types';
-import { createAppointment, getCurrentUser, getAppointments } from '@/lib/store';
+import { Trainer, Availability, SlotCapacity } from '@/lib/types';
+import { createAppointment, getCurrentUser, getAppointments, getWeekCapacity } from '@/lib/store';
 import { X, Calendar, Clock, Check, ChevronLeft, ChevronRight } from 'lucide-react';
 import { startOfWeek, endOfWeek, eachDayOfInterval, format, addDays, subDays, isSameDay, parseISO, isBefore, startOfToday } from 'date-fns';
 
@@ -16,6 +16,7 @@ export default function BookingModal({ isOpen, onClose, trainer }: BookingModalP
     const [isSubmitting, setIsSubmitting] = useState(false);
     const [error, setError] = useState('');
     const [appointments, setAppointments] = useState<any[]>([]);
+    const [capacity, setCapacity] = useState<Record<string, SlotCapacity> | null>(null);
 
     // Calendar State
     const [currentWeekStart, setCurrentWeekStart] = useState(startOfWeek(new Date(), { weekStartsOn: 0 }));
@@ -33,6 +34,15 @@ export default function BookingModal({ isOpen, onClose, trainer }: BookingModalP
         }
     }, [isOpen]);
 
+    useEffect(() => {
+        if (!isOpen) return;
+        // Seats per slot / trainer for the displayed week
+        setCapacity(null);
+        getWeekCapacity(format(currentWeekStart, 'yyyy-MM-dd')).then(data => {
+            if (data) setCapacity(Object.fromEntries(data.slots.map(s => [s.start_time, s])));
+        });
+    }, [isOpen, currentWeekStart]);
+
     if (!isOpen || !trainer) return null;
 
     // Calendar Helpers
@@ -122,7 +132,11 @@ export default function BookingModal({ isOpen, onClose, trainer }: BookingModalP
             if (userBooked) return 'joined'; // Already booked by YOU
         }
 
-        // 5. Trainer Capacity
+        // 5. Trainer Capacity (gym / shift limits included)
+        if (capacity) {
+            const slot = capacity[`${slotTimeISO}:00`];
+            return slot && (slot.trainer_seats[trainer.id] ?? 0) > 0 ? 'available' : 'full';
+        }
         const trainerApps = appointments.filter(a =>
             a.trainer_id === trainer.id &&
             a.start_time === slotTimeISO &&
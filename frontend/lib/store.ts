@@ -1,4 +1,4 @@
-import { Trainer, Appointment, User, Availability } from './types';
+import { Trainer, Appointment, User, Availability, WeekCapacity } from './types';
 
 // Use environment variable for production, fallback to localhost for dev
 const API_Base = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
@@ -355,6 +355,18 @@ export async function getAppointments(): Promise<Appointment[]> {
     }
 }
 
+// Free capacity of the 7 days from weekStartDate (YYYY-MM-DD), per bookable slot
+export async function getWeekCapacity(weekStartDate: string): Promise<WeekCapacity | null> {
+    try {
+        const res = await fetch(`${API_Base}/schedule/capacity?week_start=${weekStartDate}`);
+        if (!res.ok) throw new Error('Failed to fetch capacity');
+        return res.json();
+    } catch (error) {
+        console.error(error);
+        return null;
+    }
+}
+
 export async function createAppointment(
     trainerId: number,
     startTime: string, // ISO String
@@ -49,6 +49,18 @@ export interface Appointment {
   status: 'confirmed' | 'pending' | 'cancelled';
 }
 
+export interface SlotCapacity {
+  start_time: string; // ISO, e.g. 2024-05-06T09:00:00
+  seats_left: number;
+  trainers_on_shift: number[];
+  trainer_seats: Record<string, number>; // trainer id -> clients they can still take
+}
+
+export interface WeekCapacity {
+  week_start: string; // YYYY-MM-DD
+  slots: SlotCapacity[];
+}
+
 export interface Notification {
   id: number;
   user_id: number;